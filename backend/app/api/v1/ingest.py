@@ -1,69 +1,74 @@
 from fastapi import APIRouter, UploadFile, File, BackgroundTasks
 from app.services.scrapbox_service import ScrapboxService
-from app.services.encoder_service import EncoderService
 from app.services.elasticsearch_service import ElasticsearchService
-from app.models.scrapbox import ScrapboxProject
-import json
+from app.services.ingestion_service import IngestionService
+import os
+import tempfile
+from pathlib import Path
 from typing import Optional
 from loguru import logger
-import asyncio
 
 router = APIRouter()
 es_service = ElasticsearchService()
 
-async def process_ingestion(project_data: dict):
-    try:
-        project = ScrapboxProject(**project_data)
-        await es_service.create_index_if_not_exists()
-        
-        all_chunks = []
-        for page in project.pages:
-            chunks = ScrapboxService.chunk_page(page, project.name)
-            all_chunks.extend(chunks)
-        
-        logger.info(f"Processing {len(all_chunks)} chunks from project {project.name}")
-        
-        # Encode chunks in batches to avoid overloading
-        batch_size = 10
-        semaphore = asyncio.Semaphore(5) # Max 5 concurrent encodes
-
-        async def encode_with_sem(chunk):
-            async with semaphore:
-                chunk.sparse_vector = await EncoderService.encode(chunk.text)
-                return chunk
+UPLOAD_READ_SIZE = 1 << 20
 
-        for i in range(0, len(all_chunks), batch_size):
-            batch = all_chunks[i:i + batch_size]
-            tasks = [encode_with_sem(c) for c in batch]
-            processed_batch = await asyncio.gather(*tasks)
-            await es_service.bulk_index_chunks(processed_batch)
-            logger.info(f"Progress: {i + len(batch)}/{len(all_chunks)}")
+async def process_ingestion(project_data: dict, incremental: bool = False):
+    try:
+        await IngestionService.ingest_project(project_data, es_service, incremental=incremental)
+    except Exception as e:
+        logger.error(f"Ingestion failed: {e}")
 
+async def process_export_file(path: str, incremental: bool = False, project_name: Optional[str] = None):
+    try:
+        await IngestionService.ingest_export_file(path, es_service, incremental=incremental, project_name=project_name)
     except Exception as e:
         logger.error(f"Ingestion failed: {e}")
+    finally:
+        os.remove(path)
 
 @router.post("/ingest")
-async def ingest_scrapbox(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
-    content = await file.read()
-    data = json.loads(content)
-    
-    background_tasks.add_task(process_ingestion, data)
+async def ingest_scrapbox(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    incremental: bool = False
+):
+    """
+    Ingest a Scrapbox export file.
+    The upload is spooled to disk and parsed page by page, so large exports are never held in memory.
+    With incremental=true only new or modified pages are re-encoded.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        while chunk := await file.read(UPLOAD_READ_SIZE):
+            tmp.write(chunk)
+
+    project_name = Path(file.filename).stem if file.filename else None
+    background_tasks.add_task(process_export_file, tmp.name, incremental, project_name)
     return {"message": "Ingestion started from file"}
 
+@router.get("/ingest/status")
+async def ingest_status():
+    """Per-stage throughput and queue depth of the most recent ingestion."""
+    pipeline = IngestionService.last_pipeline
+    return pipeline.metrics() if pipeline else {"running": False}
+
 @router.post("/ingest/api")
 async def ingest_from_api(
     background_tasks: BackgroundTasks, 
     project_name: str, 
-    connect_sid: Optional[str] = None
+    connect_sid: Optional[str] = None,
+    incremental: bool = False
 ):
     """
     Ingest data directly from Scrapbox API.
     connect_sid is optional, but required for private projects.
+    With incremental=true unchanged pages are neither fetched nor re-encoded.
     """
     async def task_wrapper():
         try:
-            data = await ScrapboxService.fetch_project_data(project_name, connect_sid)
-            await process_ingestion(data)
+            known_versions = await IngestionService.known_versions(es_service, project_name) if incremental else None
+            data = await ScrapboxService.fetch_project_data(project_name, connect_sid, known_versions=known_versions)
+            await process_ingestion(data, incremental)
         except Exception as e:
             logger.error(f"API Ingestion failed: {e}")
 
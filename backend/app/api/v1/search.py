@@ -1,78 +1,154 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from app.services.encoder_service import EncoderService
+from typing import List, Literal, Optional, Dict, Any
+from app.services.encoder_service import query_vector_cache, get_embedding_cache
 from app.services.elasticsearch_service import ElasticsearchService
-from app.services.llm_service import LLMService
+from app.services.search_service import SearchService, RetrievalError
+from app.services.llm_service import LLMService, QueuePosition
+from app.services.llm_scheduler import LLMOverloaded, llm_scheduler
+from app.services.answer_cache import answer_cache
+from app.services.semantic_cache import semantic_cache
+from app.services.llm_metrics import llm_metrics
+from app.core.cache import normalize_query
+from app.core.config import settings
+from app.core.metrics import SEARCH_COALESCED, request_timings
+from app.core.single_flight import SingleFlight, StreamingSingleFlight
 import json
 import asyncio
+import time
 
 router = APIRouter()
 es_service = ElasticsearchService()
+search_flights = SingleFlight()
+stream_flights = StreamingSingleFlight()
 
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 5
+    # "splade", "bm25" or "hybrid"; defaults to SEARCH_MODE
+    mode: Optional[Literal["splade", "bm25", "hybrid"]] = None
 
 class SearchResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
 
-@router.post("/search", response_model=SearchResponse)
-async def search_rag(request: SearchRequest):
-    # 1. Encode query
+def overloaded_error(e: LLMOverloaded) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def flight_key(request: SearchRequest) -> tuple:
+    return (normalize_query(request.query), request.top_k, request.mode or settings.SEARCH_MODE)
+
+def admit(in_flight: bool):
+    """
+    Sheds load before encoding and searching when the LLM queue is already full.
+    Requests joining an identical in-flight request add no LLM work and are always admitted.
+    """
+    if in_flight:
+        return
     try:
-        query_vector = await EncoderService.encode(request.query)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Encoder error: {str(e)}")
+        llm_scheduler.check_capacity()
+    except LLMOverloaded as e:
+        raise overloaded_error(e)
 
-    # 2. Search Elasticsearch
+async def run_search(request: SearchRequest) -> SearchResponse:
+    # 1. Encode query and search Elasticsearch
     try:
-        contexts = await es_service.search(query_vector, top_k=request.top_k)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+        contexts, query_vector = await SearchService.retrieve(es_service, request.query, request.top_k, request.mode)
+    except RetrievalError as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
     if not contexts:
         return SearchResponse(answer="関連する情報が見つかりませんでした。", sources=[])
 
-    # 3. Generate Answer
-    answer = await LLMService.generate_answer(request.query, contexts)
+    # 2. Generate Answer
+    try:
+        answer = await LLMService.generate_answer(request.query, contexts, query_vector)
+    except LLMOverloaded as e:
+        raise overloaded_error(e)
 
     return SearchResponse(
         answer=answer,
         sources=contexts
     )
 
+@router.post("/search", response_model=SearchResponse)
+async def search_rag(request: SearchRequest):
+    if not settings.SEARCH_COALESCE_ENABLED:
+        admit(False)
+        return await run_search(request)
+    key = flight_key(request)
+    in_flight = search_flights.in_flight(key)
+    admit(in_flight)
+    if in_flight:
+        SEARCH_COALESCED.inc(endpoint="search")
+    return await search_flights.do(key, lambda: run_search(request))
+
+def timing_event(phase: str, start: float) -> str:
+    """SSE event with the time since the request started and the stage timings so far (ms)."""
+    stages = {stage: round(seconds * 1000, 1) for stage, seconds in (request_timings.get() or {}).items()}
+    timing = {"phase": phase, "elapsed_ms": round((time.monotonic() - start) * 1000, 1), "stages": stages}
+    return f"data: {json.dumps({'timing': timing})}\n\n"
+
+async def search_events(request: SearchRequest, start: float):
+    """SSE events of one search: sources, queue positions, answer tokens, timings and errors."""
+    # 1. Encode query and search Elasticsearch
+    try:
+        contexts, query_vector = await SearchService.retrieve(es_service, request.query, request.top_k, request.mode)
+    except RetrievalError as e:
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        return
+
+    # Send sources first
+    yield f"data: {json.dumps({'sources': contexts})}\n\n"
+    yield timing_event("retrieve", start)
+
+    if not contexts:
+        yield f"data: {json.dumps({'answer': '関連する情報が見つかりませんでした。'})}\n\n"
+        return
+
+    # 2. Generate Answer (Stream)
+    try:
+        first = True
+        async for token in LLMService.generate_answer_stream(request.query, contexts, query_vector):
+            if isinstance(token, QueuePosition):
+                yield f"data: {json.dumps({'queue': {'position': token.position}})}\n\n"
+                continue
+            yield f"data: {json.dumps({'answer': token})}\n\n"
+            if first and token:
+                first = False
+                yield timing_event("first_token", start)
+    except LLMOverloaded as e:
+        yield f"data: {json.dumps({'error': str(e), 'retry_after': e.retry_after})}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': f'Generation error: {str(e)}'})}\n\n"
+    yield timing_event("done", start)
+
 @router.post("/search/stream")
 async def search_rag_stream(request: SearchRequest):
-    async def event_generator():
-        # 1. Encode query
-        try:
-            query_vector = await EncoderService.encode(request.query)
-        except Exception as e:
-            yield f"data: {json.dumps({'error': f'Encoder error: {str(e)}'})}\n\n"
-            return
-
-        # 2. Search Elasticsearch
-        try:
-            contexts = await es_service.search(query_vector, top_k=request.top_k)
-        except Exception as e:
-            yield f"data: {json.dumps({'error': f'Search error: {str(e)}'})}\n\n"
-            return
-
-        # Send sources first
-        yield f"data: {json.dumps({'sources': contexts})}\n\n"
-
-        if not contexts:
-            yield f"data: {json.dumps({'answer': '関連する情報が見つかりませんでした。'})}\n\n"
-            return
-
-        # 3. Generate Answer (Stream)
-        try:
-            async for token in LLMService.generate_answer_stream(request.query, contexts):
-                yield f"data: {json.dumps({'answer': token})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'error': f'Generation error: {str(e)}'})}\n\n"
-
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    start = time.monotonic()
+    if not settings.SEARCH_COALESCE_ENABLED:
+        admit(False)
+        return StreamingResponse(search_events(request, start), media_type="text/event-stream")
+    # Identical concurrent streams share one pipeline run; every subscriber gets all events
+    key = flight_key(request)
+    in_flight = stream_flights.in_flight(key)
+    admit(in_flight)
+    if in_flight:
+        SEARCH_COALESCED.inc(endpoint="stream")
+    events = stream_flights.subscribe(key, lambda: search_events(request, start))
+    return StreamingResponse(events, media_type="text/event-stream")
+
+@router.get("/cache/stats")
+async def cache_stats():
+    embedding_cache = get_embedding_cache()
+    return {
+        "query_vector": query_vector_cache.stats(),
+        "answer": answer_cache.stats(),
+        "semantic_answer": semantic_cache.stats(),
+        "embedding": embedding_cache.stats() if embedding_cache else None,
+    }
+
+@router.get("/llm/metrics")
+async def llm_generation_metrics():
+    return {**llm_metrics.summary(), "scheduler": llm_scheduler.stats()}
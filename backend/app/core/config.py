@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     # Elasticsearch
@@ -7,17 +7,130 @@ class Settings(BaseSettings):
     ES_USER: Optional[str] = None
     ES_PASSWORD: Optional[str] = None
     ES_INDEX: str = "scrapbox-rag"
+    # SPLADE field type: "rank_features" or "sparse_vector" (native, ES 8.15+)
+    ES_VECTOR_MODE: Literal["rank_features", "sparse_vector"] = "rank_features"
 
     # Ollama (Gemma 3)
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     LLM_MODEL: str = "gemma3:4b"
+    # Estimated tokens of retrieved context allowed into the prompt
+    LLM_CONTEXT_TOKEN_BUDGET: int = 2048
+    # How long Ollama keeps the model loaded after a request (e.g. "30m", "-1" = forever)
+    LLM_KEEP_ALIVE: Optional[str] = "30m"
+    # Context window and max generated tokens (unset = Ollama/model defaults)
+    LLM_NUM_CTX: Optional[int] = None
+    LLM_NUM_PREDICT: Optional[int] = None
+    # Load the model and prefill the static prompt prefix at startup
+    LLM_WARMUP: bool = False
+    # Admission control: concurrent generations, queued requests and their max wait (seconds)
+    LLM_MAX_CONCURRENCY: int = 2
+    LLM_MAX_QUEUE: int = 16
+    LLM_QUEUE_TIMEOUT: float = 30.0
+    LLM_RETRY_AFTER: int = 10  # Retry-After (seconds) sent when rejecting
 
     # SPLADE Encoder API
     SPLADE_API_URL: str = "http://localhost:8001/encode"
+    SPLADE_BATCH_API_URL: str = "http://localhost:8001/encode_batch"
+    # Must match MODEL_ID of the encoder; scopes the embedding cache
+    SPLADE_MODEL_ID: str = "hotchpotch/japanese-splade-v2"
+    # Response format requested from the encoder: "json" ({token_id: weight}),
+    # "compact" (indices/values lists) or "msgpack" (packed uint32 ids / float16 weights;
+    # opt-in since float16 rounds the weights)
+    ENCODER_WIRE_FORMAT: Literal["json", "compact", "msgpack"] = "json"
+
+    # Bulk indexing: documents and bytes per bulk request, retries of rejected documents
+    ES_BULK_CHUNK_SIZE: int = 500
+    ES_BULK_MAX_BYTES: int = 10 * 1024 * 1024
+    ES_BULK_MAX_RETRIES: int = 3
+    ES_BULK_RETRY_BACKOFF: float = 2.0  # seconds, doubled per retry
+    # Full (non-incremental) imports disable refresh/replicas while loading
+    ES_BULK_LOAD_MODE: bool = True
+    ES_BULK_FORCE_MERGE_SEGMENTS: Optional[int] = None  # force-merge after a full import when set
+
+    # Chunking: tokens per chunk (page title included), tokens repeated at the start of the
+    # next chunk when a section is split by size, and the size a chunk must reach before
+    # a heading starts a new one
+    CHUNK_MAX_TOKENS: int = 384
+    CHUNK_OVERLAP_TOKENS: int = 32
+    CHUNK_MIN_TOKENS: int = 64
+    # "estimate" (CJK-aware estimate) or "tokenizer" (SPLADE_MODEL_ID's tokenizer, needs transformers)
+    CHUNK_TOKEN_COUNTER: Literal["estimate", "tokenizer"] = "estimate"
+    CHUNK_TITLE_PREFIX: bool = True  # start each chunk's text with the page title
+
+    # Ingestion pipeline (chunk -> encode -> index)
+    INGEST_ENCODE_BATCH_SIZE: int = 32  # chunks per encoder call
+    INGEST_ENCODE_CONCURRENCY: int = 2  # concurrent encoder calls
+    INGEST_INDEX_BATCH_SIZE: int = 200  # chunks per bulk request
+    INGEST_INDEX_CONCURRENCY: int = 2  # concurrent bulk requests
+    INGEST_QUEUE_SIZE: int = 256  # chunks buffered in front of each stage
+    INGEST_METRICS_INTERVAL: float = 10.0  # seconds between progress logs
+
+    # Embedding cache (chunk text hash -> sparse vector) used during ingestion
+    EMBEDDING_CACHE_PATH: Optional[str] = ".cache/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 2_000_000
+    # Part of the cache namespace: bump it whenever the encoder output changes without a new
+    # SPLADE_MODEL_ID (threshold, top-k, windowing, backend, ...) so stale vectors are dropped
+    EMBEDDING_CACHE_VERSION: str = "1"
+
+    # Retrieval: "splade", "bm25" (kuromoji multi_match) or "hybrid" (both, fused)
+    SEARCH_MODE: Literal["splade", "bm25", "hybrid"] = "splade"
+    HYBRID_FUSION: Literal["rrf", "weighted"] = "rrf"
+    HYBRID_RRF_K: int = 60
+    HYBRID_BM25_WEIGHT: float = 0.5  # weighted fusion only; SPLADE gets the rest
+    HYBRID_CANDIDATES: int = 50  # hits fetched from each retriever before fusion
+    # Query encoding slower than this, or failing, falls back to BM25 when enabled
+    SEARCH_ENCODER_TIMEOUT: float = 2.0
+    SEARCH_BM25_FALLBACK: bool = True
+    # Concurrent identical requests (normalized query, top_k, mode) share one execution
+    SEARCH_COALESCE_ENABLED: bool = True
+
+    # Answer cache (query + retrieved chunk ids/updated -> generated answer)
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIZE: int = 512
+    ANSWER_CACHE_TTL: Optional[float] = 86400.0
+
+    # Semantic answer cache: reuse the answer of a similar earlier query (SPLADE cosine)
+    # that retrieved the same top documents
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.9
+    SEMANTIC_CACHE_SIZE: int = 1000
+    SEMANTIC_CACHE_TOP_DOCS: int = 3
+
+    # Sparse vector pruning (unset = keep every token the encoder returns)
+    QUERY_PRUNE_TOP_K: Optional[int] = None
+    QUERY_PRUNE_MASS: Optional[float] = None  # share of total weight to keep, 0-1
+    QUERY_PRUNE_MIN_WEIGHT: float = 0.0
+    DOC_PRUNE_TOP_K: Optional[int] = None
+    DOC_PRUNE_MASS: Optional[float] = None
+    DOC_PRUNE_MIN_WEIGHT: float = 0.0
+
+    # Query vector cache (LRU/TTL in-process, optional SQLite file shared by workers)
+    QUERY_CACHE_ENABLED: bool = True
+    QUERY_CACHE_SIZE: int = 1024
+    QUERY_CACHE_TTL: Optional[float] = 3600.0
+    QUERY_CACHE_DB_PATH: Optional[str] = None
+    QUERY_CACHE_SHARED_SIZE: int = 100_000
 
     # Scrapbox
     SCRAPBOX_PROJECT: Optional[str] = None
     SCRAPBOX_COOKIE_CONNECT_SID: Optional[str] = None
+    SCRAPBOX_API_BASE_URL: str = "https://scrapbox.io/api"
+    SCRAPBOX_PAGE_LIST_LIMIT: int = 1000
+    SCRAPBOX_FETCH_CONCURRENCY: int = 8
+    SCRAPBOX_RATE_LIMIT: float = 10.0  # requests per second
+    SCRAPBOX_MAX_RETRIES: int = 5
+    SCRAPBOX_RETRY_BACKOFF: float = 1.0  # seconds, doubled on each retry
+
+    # Shared HTTP clients (connection pool / keep-alive)
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+
+    # Per-service timeouts (seconds)
+    ENCODER_TIMEOUT: float = 30.0
+    ENCODER_BATCH_TIMEOUT: float = 120.0
+    LLM_TIMEOUT: float = 120.0
+    SCRAPBOX_TIMEOUT: float = 30.0
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -0,0 +1,50 @@
+import httpx
+from typing import Dict
+from app.core.config import settings
+from loguru import logger
+
+class HTTPClientRegistry:
+    """
+    Application-scoped httpx.AsyncClient instances, one connection pool per upstream service.
+    Clients are opened by the FastAPI lifespan and reused across requests so that
+    connections to the encoder, Ollama and Scrapbox are kept alive.
+    """
+    SERVICES = ("encoder", "llm", "scrapbox")
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _timeout(name: str) -> float:
+        return {
+            "encoder": settings.ENCODER_TIMEOUT,
+            "llm": settings.LLM_TIMEOUT,
+            "scrapbox": settings.SCRAPBOX_TIMEOUT,
+        }[name]
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Returns the shared client for `name`, creating it on first use (e.g. from CLI scripts)."""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=self._timeout(name),
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+            self._clients[name] = client
+        return client
+
+    async def start(self):
+        for name in self.SERVICES:
+            self.get(name)
+        logger.info(f"Opened HTTP clients: {', '.join(self.SERVICES)}")
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+http_clients = HTTPClientRegistry()
@@ -0,0 +1,231 @@
+import abc
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Per-request stage timings (seconds), filled by `timed`/`record_timing` and
+# reported as a Server-Timing header by MetricsMiddleware
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+INF_LABEL = 'le="+Inf"'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape_label(value: str) -> str:
+    # Label values escape backslash, double quote and newline in the text format
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class _Metric(abc.ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines of the metric in the text exposition format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+                for key, v in self._values.items()
+            ]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, n in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {n}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_LABEL)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge("rag_http_requests_in_flight", "HTTP requests being served")
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "rag_http_request_duration_seconds", "HTTP request duration until the response body is complete",
+    ["method", "route", "status"],
+)
+ENCODE_SECONDS = registry.histogram("rag_encode_seconds", "SPLADE encoder call latency", ["kind"])
+ES_SEARCH_SECONDS = registry.histogram("rag_es_search_seconds", "Elasticsearch search round-trip latency", ["mode"])
+ES_TOOK_SECONDS = registry.histogram("rag_es_took_seconds", "Elasticsearch server-side search time (took)", ["mode"])
+LLM_TTFT_SECONDS = registry.histogram("rag_llm_ttft_seconds", "LLM time to first token")
+LLM_GENERATION_SECONDS = registry.histogram("rag_llm_generation_seconds", "LLM total generation time")
+LLM_IN_FLIGHT = registry.gauge("rag_llm_generations_in_flight", "LLM generations in progress")
+LLM_QUEUE_DEPTH = registry.gauge("rag_llm_queue_depth", "Requests waiting for an LLM slot")
+LLM_REJECTED = registry.counter("rag_llm_rejected_total", "Requests rejected by LLM admission control", ["reason"])
+LLM_TOKENS = registry.counter("rag_llm_tokens_total", "Tokens processed by the LLM", ["kind"])
+SEARCH_COALESCED = registry.counter(
+    "rag_search_coalesced_total", "Search requests that joined an identical in-flight request", ["endpoint"]
+)
+SEARCH_DEGRADED = registry.counter(
+    "rag_search_degraded_total", "Searches served without a failed retrieval stage", ["failed"]
+)
+INGEST_ITEMS = registry.counter("rag_ingest_items_total", "Items processed by each ingestion stage", ["stage"])
+INGEST_FAILED = registry.counter("rag_ingest_failed_total", "Items failed in each ingestion stage", ["stage"])
+INGEST_BATCH_SECONDS = registry.histogram("rag_ingest_batch_seconds", "Ingestion stage batch latency", ["stage"])
+
+def record_timing(stage: str, seconds: float):
+    """Adds `seconds` to the current request's timing of `stage` (no-op outside a request)."""
+    timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(histogram: Histogram, stage: Optional[str] = None, **labels: str) -> Iterator[None]:
+    """Observes the duration of the block in `histogram` and, if `stage` is given, in the request timings."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        histogram.observe(elapsed, **labels)
+        if stage:
+            record_timing(stage, elapsed)
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request duration and in-flight requests, and adding a
+    Server-Timing header with the stage timings collected before the response started.
+    Streaming responses are measured until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        timings: Dict[str, float] = {}
+        token = request_timings.set(timings)
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                header = server_timing({**timings, "total": time.monotonic() - start})
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            request_timings.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.monotonic() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"]),
+            )
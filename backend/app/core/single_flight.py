@@ -0,0 +1,102 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution whose result
+    (or exception) is shared by every caller. The key is forgotten once the call completes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        # A caller that goes away does not cancel the shared call for the others
+        return await asyncio.shield(task)
+
+class Broadcast:
+    """
+    Runs one async iterator in a background task and fans its items out to any number of
+    subscribers. Subscribers replay the items produced before they joined, so each one
+    sees the complete stream. The source is cancelled when the last subscriber leaves.
+    """
+
+    def __init__(self, source: AsyncIterator[Any], on_done: Callable[[], None]):
+        self.items: List[Any] = []
+        self.finished = False
+        self.subscribers = 0
+        self.cancelled = False
+        self._changed = asyncio.Condition()
+        self._on_done = on_done
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                async with self._changed:
+                    self.items.append(item)
+                    self._changed.notify_all()
+        finally:
+            self._on_done()
+            async with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        """True once the source is cancelled or exhausted; new subscribers need a new broadcast."""
+        return self.cancelled or self._task.done()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: len(self.items) > i or self.finished)
+                    items = self.items[i:]
+                    finished = self.finished
+                for item in items:
+                    yield item
+                i += len(items)
+                if finished and i >= len(self.items):
+                    return
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self._task.done():
+                # Forget it now: the task only finishes after the cancellation is delivered
+                self.cancelled = True
+                self._on_done()
+                self._task.cancel()
+
+class StreamingSingleFlight:
+    """SingleFlight for streams: concurrent subscribers with the same key share one Broadcast."""
+
+    def __init__(self):
+        self._streams: Dict[Hashable, Broadcast] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._streams
+
+    def _forget(self, key: Hashable, broadcast: Broadcast):
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.closed:
+            broadcast = Broadcast(factory(), on_done=lambda: self._forget(key, broadcast))
+            self._streams[key] = broadcast
+        return broadcast.subscribe()
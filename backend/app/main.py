@@ -1,10 +1,26 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1 import search, ingest
 from app.core.config import settings
+from app.core.http_client import http_clients
+from app.core.metrics import MetricsMiddleware, registry
+from app.services.llm_service import LLMService
 from loguru import logger
 
-app = FastAPI(title="Scrapbox RAG API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_clients.start()
+    # Warm-up runs in the background so it does not delay accepting requests
+    warmup = asyncio.create_task(LLMService.warm_up()) if settings.LLM_WARMUP else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    await http_clients.close()
+
+app = FastAPI(title="Scrapbox RAG API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -13,8 +29,12 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Request duration, in-flight requests and Server-Timing headers
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(search.router, prefix="/api/v1", tags=["search"])
 app.include_router(ingest.router, prefix="/api/v1", tags=["ingest"])
@@ -23,6 +43,11 @@ app.include_router(ingest.router, prefix="/api/v1", tags=["ingest"])
 async def root():
     return {"message": "Scrapbox RAG API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the process metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
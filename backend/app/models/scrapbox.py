@@ -16,6 +16,7 @@ class ScrapboxProject(BaseModel):
 class ScrapboxChunk(BaseModel):
     id: str  # unique id for ES: {page_id}_{chunk_index}
     page_id: str
+    project: Optional[str] = None
     title: str
     text: str
     url: str
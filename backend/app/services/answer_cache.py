@@ -0,0 +1,39 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.cache import LRUCache, normalize_query
+
+class AnswerCache:
+    """
+    Generated answers keyed on the normalized query plus the ordered (chunk id, updated)
+    pairs of the retrieved contexts, so an entry goes stale as soon as a source page
+    changes or retrieval returns different chunks. Answers are stored as the token
+    sequence the LLM produced, so streaming clients can be replayed the same tokens.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.cache = LRUCache(maxsize, ttl)
+
+    @staticmethod
+    def key(query: str, contexts: List[Dict[str, Any]]) -> str:
+        sources = [[ctx.get("id") or ctx.get("url"), ctx.get("updated")] for ctx in contexts]
+        payload = json.dumps([settings.LLM_MODEL, normalize_query(query), sources], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, query: str, contexts: List[Dict[str, Any]]) -> Optional[List[str]]:
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None
+        return self.cache.get(self.key(query, contexts))
+
+    def set(self, query: str, contexts: List[Dict[str, Any]], tokens: List[str]):
+        if settings.ANSWER_CACHE_ENABLED:
+            self.cache.set(self.key(query, contexts), tokens)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+answer_cache = AnswerCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL)
@@ -0,0 +1,194 @@
+import math
+import re
+from typing import Callable, List, NamedTuple, Optional
+from app.core.config import settings
+from app.services.context_packer import estimate_tokens
+
+# A line that is only bold/large text (`[* heading]`, `[** heading]`, ...) is a section heading
+HEADING = re.compile(r"^\[\*+\s[^\]]*\]$")
+# `code:name` and `table:name` blocks: every following line indented deeper belongs to them
+BLOCK_START = re.compile(r"^(code|table):")
+INDENT = re.compile(r"^[ \t　]*")
+
+# Token counts of a list of lines, one call per page so a tokenizer can batch them
+TokenCounter = Callable[[List[str]], List[int]]
+
+def estimate_counter(lines: List[str]) -> List[int]:
+    # Counting each line with its newline makes the per-line counts add up to at
+    # least the estimate of the joined chunk (the estimate rounds up per text)
+    return [estimate_tokens(line + "\n") for line in lines]
+
+_tokenizer = None
+
+def tokenizer_counter(lines: List[str]) -> List[int]:
+    """Exact counts with the encoder's tokenizer (loaded on first use)."""
+    global _tokenizer
+    if _tokenizer is None:
+        # Optional dependency: transformers is only needed with CHUNK_TOKEN_COUNTER=tokenizer
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(settings.SPLADE_MODEL_ID)
+    if not lines:
+        return []
+    return [len(ids) for ids in _tokenizer(lines, add_special_tokens=False)["input_ids"]]
+
+def get_token_counter() -> TokenCounter:
+    return tokenizer_counter if settings.CHUNK_TOKEN_COUNTER == "tokenizer" else estimate_counter
+
+def clean_line(text: str) -> str:
+    # Remove the brackets of [links], [images.jpg], etc. but keep their text
+    return re.sub(r"\[([^\]]+)\]", r"\1", text).strip()
+
+class Line(NamedTuple):
+    text: str
+    tokens: int
+
+class Block:
+    """A unit the chunker keeps together when it fits: a top-level line with its indented
+    children, a heading, or a code/table block."""
+
+    def __init__(self, heading: bool = False):
+        self.heading = heading
+        self.lines: List[str] = []
+        self.counted: List[Line] = []
+        self.tokens = 0
+
+def split_blocks(lines: List[str]) -> List[Block]:
+    """Groups page lines into blocks, cleaning Scrapbox markup outside code blocks."""
+    blocks: List[Block] = []
+    current: Optional[Block] = None
+    # Indent and kind of the open code:/table: block
+    open_indent: Optional[int] = None
+    open_kind = ""
+    for raw in lines:
+        indent = len(INDENT.match(raw).group())
+        if not raw.strip():
+            if open_indent is not None and indent > open_indent:
+                # Scrapbox stores blank lines inside code blocks as indent-only lines
+                if open_kind == "code":
+                    current.lines.append("")
+                continue
+            # Blank lines separate paragraphs and close code blocks
+            current, open_indent = None, None
+            continue
+        body = raw[indent:]
+        if open_indent is not None and indent > open_indent:
+            inner = raw[open_indent + 1:].rstrip()
+            # Code keeps its relative indentation and brackets; table cells become "a | b"
+            current.lines.append(inner if open_kind == "code" else clean_line(inner.replace("\t", " | ")))
+            continue
+        open_indent = None
+        heading = bool(HEADING.match(body))
+        if current is None or indent == 0 or heading:
+            current = Block(heading)
+            blocks.append(current)
+        start = BLOCK_START.match(body)
+        if start:
+            open_indent, open_kind = indent, start.group(1)
+            current.lines.append(body)
+        else:
+            current.lines.append(clean_line(body))
+    return blocks
+
+class Chunker:
+    """
+    Splits a page into chunks of at most `max_tokens` tokens. Blocks (see Block) are packed
+    greedily with running token counts; a heading starts a new chunk once the current one has
+    `min_tokens`, and a block that does not fit starts a new chunk, falling back to line and
+    then character splits only when it exceeds `max_tokens` on its own. Chunks split by size
+    repeat up to `overlap_tokens` of trailing lines. Unset limits follow the CHUNK_* settings.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        min_tokens: Optional[int] = None,
+        title_prefix: Optional[bool] = None,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.max_tokens = max_tokens or settings.CHUNK_MAX_TOKENS
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else settings.CHUNK_OVERLAP_TOKENS
+        self.min_tokens = min_tokens if min_tokens is not None else settings.CHUNK_MIN_TOKENS
+        self.title_prefix = title_prefix if title_prefix is not None else settings.CHUNK_TITLE_PREFIX
+        self.counter = counter or get_token_counter()
+
+    def _split_line(self, line: Line, budget: int) -> List[Line]:
+        """Cuts a line longer than `budget` tokens into pieces that fit."""
+        if line.tokens <= budget or len(line.text) <= 1:
+            return [line]
+        size = math.ceil(len(line.text) / math.ceil(line.tokens / budget))
+        texts = [line.text[i:i + size] for i in range(0, len(line.text), size)]
+        pieces = []
+        for piece in map(Line, texts, self.counter(texts)):
+            pieces.extend(self._split_line(piece, budget))
+        return pieces
+
+    def split(self, title: str, lines: List[str]) -> List[str]:
+        """Returns the chunk texts of a page."""
+        # The first line of a Scrapbox page repeats its title
+        if lines and lines[0].strip() == title.strip():
+            lines = lines[1:]
+        blocks = split_blocks(lines)
+        counts = iter(self.counter([line for block in blocks for line in block.lines]))
+        for block in blocks:
+            block.counted = [Line(text, next(counts)) for text in block.lines]
+            block.tokens = sum(line.tokens for line in block.counted)
+
+        prefix = f"{title}\n" if self.title_prefix and title else ""
+        title_tokens = self.counter([title])[0] if prefix else 0
+        # A very long title still leaves room for content
+        budget = max(self.max_tokens - title_tokens, self.max_tokens // 2, 1)
+
+        chunks: List[List[str]] = []
+        current: List[Line] = []
+        used = 0
+        fresh = 0  # lines of `current` not repeated from the previous chunk
+
+        def flush(overlap: bool):
+            nonlocal current, used, fresh
+            if fresh:
+                chunks.append([line.text for line in current])
+            tail: List[Line] = []
+            if overlap and fresh:
+                tail_tokens = 0
+                for line in reversed(current[-fresh:]):
+                    if tail_tokens + line.tokens > self.overlap_tokens:
+                        break
+                    tail.insert(0, line)
+                    tail_tokens += line.tokens
+                # Never repeat a whole chunk, so consecutive chunks always differ
+                if len(tail) == fresh:
+                    tail = []
+            current, used, fresh = tail, sum(line.tokens for line in tail), 0
+
+        def add(line: Line):
+            nonlocal used, fresh
+            current.append(line)
+            used += line.tokens
+            fresh += 1
+
+        for block in blocks:
+            if block.heading and used >= self.min_tokens:
+                flush(overlap=False)
+            if used + block.tokens > budget:
+                flush(overlap=True)
+                if used + block.tokens > budget and block.tokens <= budget:
+                    # The block fits alone but not after the overlap: keep the block whole
+                    current, used = [], 0
+            if used + block.tokens <= budget:
+                for line in block.counted:
+                    add(line)
+                continue
+            for line in block.counted:
+                for piece in self._split_line(line, budget):
+                    if used + piece.tokens > budget:
+                        flush(overlap=True)
+                        if used + piece.tokens > budget:
+                            current, used = [], 0
+                    add(piece)
+        flush(overlap=False)
+
+        if not chunks:
+            # A page with only a title is still findable by it
+            return [title] if title else []
+        return [prefix + "\n".join(chunk) for chunk in chunks]
@@ -0,0 +1,127 @@
+import math
+import re
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+# Kana, CJK ideographs and full-width forms tokenize to roughly one token per character
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+# Below this many tokens a truncated context is not worth including
+MIN_TRUNCATED_TOKENS = 32
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: one per CJK character, one per ~4 other characters."""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += 1.0 if _CJK.match(ch) else 0.25
+        if used > budget:
+            return text[:i]
+    return text
+
+def body_text(ctx: Dict[str, Any]) -> str:
+    """Chunk text without the leading page title line the chunker adds (CHUNK_TITLE_PREFIX)."""
+    prefix = f"{ctx.get('title')}\n"
+    text = ctx["text"]
+    return text[len(prefix):] if ctx.get("title") and text.startswith(prefix) else text
+
+def format_context(ctx: Dict[str, Any]) -> str:
+    # The title is already in the Source line
+    return f"Source: {ctx['title']} ({ctx['url']})\nContent: {body_text(ctx)}"
+
+class PackedContext(BaseModel):
+    contexts: List[Dict[str, Any]]
+    tokens: int
+    budget: int
+    dropped: int = 0
+    truncated: int = 0
+
+class ContextPacker:
+    """
+    Fits retrieved contexts into a prompt token budget: duplicate and overlapping chunks of
+    the same page are removed, adjacent chunks (`{page_id}_{n}`, `{page_id}_{n+1}`) are merged
+    into one context, and the result is filled in score order, truncating the last one.
+    """
+
+    @staticmethod
+    def _chunk_index(ctx: Dict[str, Any]) -> Optional[int]:
+        chunk_id = ctx.get("id") or ""
+        _, _, index = chunk_id.rpartition("_")
+        return int(index) if index.isdigit() else None
+
+    @staticmethod
+    def _join(a: str, b: str) -> str:
+        """Concatenates two consecutive chunks, dropping lines repeated by chunk overlap."""
+        a_lines, b_lines = a.split("\n"), b.split("\n")
+        for n in range(min(len(a_lines), len(b_lines)), 0, -1):
+            if a_lines[-n:] == b_lines[:n]:
+                return "\n".join(a_lines + b_lines[n:])
+        return a + "\n" + b
+
+    @staticmethod
+    def merge(contexts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Deduplicates and merges chunks per page; returns contexts ordered by their best score."""
+        pages: Dict[str, List[Dict[str, Any]]] = {}
+        for ctx in contexts:
+            pages.setdefault(ctx.get("page_id") or ctx["url"], []).append(ctx)
+
+        merged = []
+        for chunks in pages.values():
+            seen_ids = set()
+            unique = []
+            for ctx in chunks:
+                if ctx.get("id") in seen_ids:
+                    continue
+                seen_ids.add(ctx.get("id"))
+                # A chunk whose text is contained in another chunk of the page adds nothing
+                if any(ctx["text"] in other["text"] for other in unique):
+                    continue
+                unique = [other for other in unique if other["text"] not in ctx["text"]]
+                unique.append(ctx)
+
+            unique.sort(key=lambda c: (ContextPacker._chunk_index(c) is None, ContextPacker._chunk_index(c) or 0))
+            group: Optional[Dict[str, Any]] = None
+            last_index: Optional[int] = None
+            for ctx in unique:
+                index = ContextPacker._chunk_index(ctx)
+                if group is not None and index is not None and last_index is not None and index == last_index + 1:
+                    group["text"] = ContextPacker._join(group["text"], body_text(ctx))
+                    group["score"] = max(group.get("score") or 0.0, ctx.get("score") or 0.0)
+                else:
+                    group = dict(ctx)
+                    merged.append(group)
+                last_index = index
+
+        merged.sort(key=lambda c: c.get("score") or 0.0, reverse=True)
+        return merged
+
+    @staticmethod
+    def pack(contexts: List[Dict[str, Any]], budget: int) -> PackedContext:
+        merged = ContextPacker.merge(contexts)
+        packed = []
+        used = 0
+        truncated = 0
+        for ctx in merged:
+            # Separator between contexts ("\n\n") counts as one token
+            cost = estimate_tokens(format_context(ctx)) + 1
+            remaining = budget - used
+            if cost <= remaining:
+                packed.append(ctx)
+                used += cost
+                continue
+            header_cost = estimate_tokens(format_context({**ctx, "text": ""})) + 1
+            if remaining - header_cost >= MIN_TRUNCATED_TOKENS:
+                text = truncate_to_tokens(ctx["text"], remaining - header_cost)
+                packed.append({**ctx, "text": text})
+                used += header_cost + estimate_tokens(text)
+                truncated += 1
+            break
+        return PackedContext(
+            contexts=packed,
+            tokens=used,
+            budget=budget,
+            dropped=len(merged) - len(packed),
+            truncated=truncated,
+        )
@@ -1,9 +1,19 @@
 from elasticsearch import AsyncElasticsearch, helpers
 from app.core.config import settings
+from app.core.metrics import ES_SEARCH_SECONDS, ES_TOOK_SECONDS, SEARCH_DEGRADED, record_timing, timed
 from app.models.scrapbox import ScrapboxChunk
-from typing import List, Dict, Any
+from app.services.sparse_vector import PruningConfig, prune_sparse_vector
+from typing import List, Dict, Any, AsyncIterator, Awaitable, Iterable, Optional
+from contextlib import asynccontextmanager
+import asyncio
 from loguru import logger
 
+SOURCE_FIELDS = ["page_id", "title", "text", "url", "updated"]
+# Bulk item statuses retried with backoff before a document counts as failed
+RETRYABLE_BULK_STATUS = (429, 502, 503, 504)
+# Index settings relaxed while bulk loading, restored afterwards
+BULK_LOAD_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": 0}
+
 class ElasticsearchService:
     def __init__(self):
         self.client = AsyncElasticsearch(
@@ -11,13 +21,15 @@ class ElasticsearchService:
             basic_auth=(settings.ES_USER, settings.ES_PASSWORD) if settings.ES_USER else None,
             headers={"Accept": "application/vnd.elasticsearch+json; compatible-with=8", "Content-Type": "application/vnd.elasticsearch+json; compatible-with=8"}
         )
+        # Active bulk loads; overlapping imports share one relaxed-settings window
+        self._bulk_loads = 0
+        self._bulk_lock = asyncio.Lock()
+        self._bulk_original: Dict[str, Any] = {}
 
-    async def create_index_if_not_exists(self):
-        index = settings.ES_INDEX
-        if await self.client.indices.exists(index=index):
-            return
-
-        mapping = {
+    @staticmethod
+    def index_body(vector_mode: str) -> Dict[str, Any]:
+        """Index settings and mappings; `vector_mode` selects the SPLADE field type."""
+        return {
             "settings": {
                 "analysis": {
                     "analyzer": {
@@ -31,6 +43,7 @@ class ElasticsearchService:
             "mappings": {
                 "properties": {
                     "page_id": {"type": "keyword"},
+                    "project": {"type": "keyword"},
                     "title": {
                         "type": "text",
                         "analyzer": "kuromoji_analyzer",
@@ -42,20 +55,114 @@ class ElasticsearchService:
                     },
                     "url": {"type": "keyword", "index": False},
                     "updated": {"type": "date", "format": "epoch_second"},
-                    "sparse_vector": {"type": "rank_features"}
+                    # rank_features: one rank_feature clause per query token
+                    # sparse_vector: scored natively by a single sparse_vector query
+                    "sparse_vector": {"type": vector_mode}
                 }
             }
         }
-        await self.client.indices.create(index=index, body=mapping)
-        logger.info(f"Created index {index}")
 
-    async def bulk_index_chunks(self, chunks: List[ScrapboxChunk]):
+    async def create_index_if_not_exists(self):
+        index = settings.ES_INDEX
+        if await self.client.indices.exists(index=index):
+            # Indices created before the `project` field existed get it added in place
+            await self.client.indices.put_mapping(index=index, properties={"project": {"type": "keyword"}})
+            return
+
+        await self.client.indices.create(index=index, body=self.index_body(settings.ES_VECTOR_MODE))
+        logger.info(f"Created index {index} ({settings.ES_VECTOR_MODE})")
+
+    async def migrate_to_sparse_vector(self, source: str, dest: str, alias: Optional[str] = None, poll_interval: float = 10.0):
+        """
+        Copies a rank_features index into a new index mapped with the native sparse_vector
+        field type. The stored token weights are compatible, so a server-side _reindex suffices.
+        When `alias` is given it is moved from `source` to `dest` atomically afterwards.
+        """
+        if await self.client.indices.exists(index=dest):
+            raise ValueError(f"Destination index {dest} already exists")
+        await self.client.indices.create(index=dest, body=self.index_body("sparse_vector"))
+
+        response = await self.client.reindex(
+            source={"index": source},
+            dest={"index": dest},
+            wait_for_completion=False,
+        )
+        task = await self._wait_for_task(response["task"], f"Reindex {source} -> {dest}", poll_interval)
+        if task.get("error") or task.get("response", {}).get("failures"):
+            raise RuntimeError(f"Reindex failed: {task.get('error') or task['response']['failures'][:5]}")
+
+        if alias:
+            actions = [{"add": {"index": dest, "alias": alias}}]
+            if await self.client.indices.exists_alias(name=alias, index=source):
+                actions.insert(0, {"remove": {"index": source, "alias": alias}})
+            await self.client.indices.update_aliases(actions=actions)
+            logger.info(f"Alias {alias} now points to {dest}")
+
+    async def _wait_for_task(self, task_id: str, label: str, poll_interval: float) -> Dict[str, Any]:
+        """Polls the tasks API until the task completes, logging its progress."""
+        while True:
+            task = await self.client.tasks.get(task_id=task_id)
+            status = task["task"].get("status") or {}
+            if "total" in status:
+                logger.info(f"{label}: {status.get('created', 0)}/{status['total']}")
+            if task["completed"]:
+                return task
+            await asyncio.sleep(poll_interval)
+
+    @asynccontextmanager
+    async def bulk_load(self, force_merge_segments: Optional[int] = None, poll_interval: float = 10.0) -> AsyncIterator[None]:
+        """
+        Bulk-load mode for full imports: refreshes and replicas are disabled while the block
+        runs, then the previous settings are restored, the index is refreshed and, when
+        `force_merge_segments` (default ES_BULK_FORCE_MERGE_SEGMENTS) is set, force-merged.
+        Overlapping loads are reference-counted: the first one relaxes the settings and the
+        last one to leave restores them.
+        """
+        index = settings.ES_INDEX
+        async with self._bulk_lock:
+            if self._bulk_loads == 0:
+                response = await self.client.indices.get_settings(
+                    index=index, name=list(BULK_LOAD_SETTINGS), flat_settings=True
+                )
+                current = next(iter(response.values()), {}).get("settings", {})
+                # Settings that were not set explicitly are restored to their defaults (null)
+                self._bulk_original = {key: current.get(key) for key in BULK_LOAD_SETTINGS}
+                await self.client.indices.put_settings(index=index, settings=BULK_LOAD_SETTINGS)
+                logger.info(f"Bulk-load mode on for {index} (was {self._bulk_original})")
+            self._bulk_loads += 1
+        last = False
+        try:
+            yield
+        finally:
+            async with self._bulk_lock:
+                self._bulk_loads -= 1
+                last = self._bulk_loads == 0
+                if last:
+                    await self.client.indices.put_settings(index=index, settings=self._bulk_original)
+                    await self.client.indices.refresh(index=index)
+                    logger.info(f"Bulk-load mode off for {index}")
+
+        segments = force_merge_segments or settings.ES_BULK_FORCE_MERGE_SEGMENTS
+        if last and segments:
+            response = await self.client.indices.forcemerge(
+                index=index, max_num_segments=segments, wait_for_completion=False
+            )
+            await self._wait_for_task(response["task"], f"Force-merge {index}", poll_interval)
+            logger.info(f"Force-merged {index} to {segments} segment(s)")
+
+    async def bulk_index_chunks(self, chunks: List[ScrapboxChunk]) -> List[Dict[str, Any]]:
+        """
+        Indexes chunks with async_streaming_bulk in requests bounded by ES_BULK_CHUNK_SIZE
+        documents and ES_BULK_MAX_BYTES. Documents rejected with a retryable status are
+        retried with backoff; returns the per-document failures left after the retries.
+        """
         actions = [
             {
                 "_index": settings.ES_INDEX,
                 "_id": chunk.id,
                 "_source": {
                     "page_id": chunk.page_id,
+                    "project": chunk.project,
                     "title": chunk.title,
                     "text": chunk.text,
                     "url": chunk.url,
@@ -65,44 +172,228 @@ class ElasticsearchService:
             }
             for chunk in chunks if chunk.sparse_vector
         ]
-        if actions:
-            await helpers.async_bulk(self.client, actions)
-            logger.info(f"Indexed {len(actions)} chunks")
+        if not actions:
+            return []
+        failures = []
+        async for _, item in helpers.async_streaming_bulk(
+            self.client,
+            actions,
+            chunk_size=settings.ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes=settings.ES_BULK_MAX_BYTES,
+            raise_on_error=False,
+            raise_on_exception=False,
+            max_retries=settings.ES_BULK_MAX_RETRIES,
+            initial_backoff=settings.ES_BULK_RETRY_BACKOFF,
+            retry_on_status=RETRYABLE_BULK_STATUS,
+            yield_ok=False,
+        ):
+            failures.append(item)
+        if failures:
+            logger.warning(f"Failed to index {len(failures)}/{len(actions)} chunks, first: {failures[0]}")
+        logger.info(f"Indexed {len(actions) - len(failures)} chunks")
+        return failures
 
-    async def search(self, query_vector: Dict[str, float], top_k: int = 5) -> List[Dict[str, Any]]:
+    async def get_page_versions(self, project_name: str) -> Dict[str, Dict[str, int]]:
+        """
+        Returns {page_id: {"updated": ..., "chunks": ...}} for every indexed page of the project.
+        `updated` is the oldest timestamp among the page's chunks, so a partially
+        re-indexed page still counts as changed.
+        """
         index = settings.ES_INDEX
-        
+        versions: Dict[str, Dict[str, int]] = {}
+        after = None
+        while True:
+            composite = {
+                "size": 1000,
+                "sources": [{"page_id": {"terms": {"field": "page_id"}}}],
+            }
+            if after:
+                composite["after"] = after
+            body = {
+                "size": 0,
+                "query": {"term": {"project": project_name}},
+                "aggs": {
+                    "pages": {
+                        "composite": composite,
+                        "aggs": {"updated": {"min": {"field": "updated"}}}
+                    }
+                }
+            }
+            response = await self.client.search(index=index, body=body)
+            agg = response["aggregations"]["pages"]
+            for bucket in agg["buckets"]:
+                versions[bucket["key"]["page_id"]] = {
+                    # date aggregations report epoch milliseconds
+                    "updated": int(bucket["updated"]["value"] // 1000),
+                    "chunks": bucket["doc_count"],
+                }
+            after = agg.get("after_key")
+            if not agg["buckets"] or not after:
+                break
+        return versions
+
+    async def delete_chunks(self, chunk_ids: Iterable[str]):
+        actions = [
+            {"_op_type": "delete", "_index": settings.ES_INDEX, "_id": chunk_id}
+            for chunk_id in chunk_ids
+        ]
+        if actions:
+            # Missing ids (404) are not an error here
+            await helpers.async_bulk(self.client, actions, raise_on_error=False)
+            logger.info(f"Deleted {len(actions)} stale chunks")
+
+    async def delete_pages(self, page_ids: Iterable[str]):
+        page_ids = list(page_ids)
+        for i in range(0, len(page_ids), 1000):
+            batch = page_ids[i:i + 1000]
+            await self.client.delete_by_query(
+                index=settings.ES_INDEX,
+                body={"query": {"terms": {"page_id": batch}}},
+                conflicts="proceed",
+            )
+        if page_ids:
+            logger.info(f"Deleted chunks of {len(page_ids)} removed pages")
+
+    @staticmethod
+    def vector_query(query_vector: Dict[str, float]) -> Dict[str, Any]:
+        if settings.ES_VECTOR_MODE == "sparse_vector":
+            # Native sparse_vector query: one clause regardless of the number of tokens
+            return {"sparse_vector": {"field": "sparse_vector", "query_vector": query_vector}}
+
         # Construct the query using rank_features
-        # We use a bool query with multiple rank_feature queries or a single one if ES supports it
-        # Actually, for SPLADE, we often use the 'script_score' or 'rank_feature' queries.
-        
         should_clauses = [
             {"rank_feature": {"field": f"sparse_vector.{token}", "boost": weight}}
             for token, weight in query_vector.items()
         ]
-
         # Note: If too many tokens, this might hit limits. SPLADE usually has dozens/hundreds of tokens.
-        # Elasticsearch 8.x supports sparse_vector search more natively in some versions, 
-        # but rank_features is the classical way for SPLADE.
+        return {"bool": {"should": should_clauses[:1024]}}  # ES limit for should clauses
 
-        query = {
-            "query": {
-                "bool": {
-                    "should": should_clauses[:1024] # ES limit for should clauses
-                }
-            },
-            "_source": ["title", "text", "url", "updated"]
-        }
+    @staticmethod
+    def bm25_query(query_text: str) -> Dict[str, Any]:
+        # title and text are analyzed with kuromoji_analyzer
+        return {"multi_match": {"query": query_text, "fields": ["title^2", "text"]}}
 
-        response = await self.client.search(index=index, body=query, size=top_k)
-        hits = response["hits"]["hits"]
+    @staticmethod
+    def _format_hits(response: Dict[str, Any]) -> List[Dict[str, Any]]:
         return [
             {
+                "id": hit["_id"],
+                "page_id": hit["_source"].get("page_id"),
                 "score": hit["_score"],
                 "title": hit["_source"]["title"],
                 "text": hit["_source"]["text"],
                 "url": hit["_source"]["url"],
                 "updated": hit["_source"]["updated"]
             }
-            for hit in hits
+            for hit in response["hits"]["hits"]
+        ]
+
+    @staticmethod
+    async def _timed_search(mode: str, request: Awaitable[Any]) -> Any:
+        """Awaits a search request, recording its round-trip latency and the server-side `took`."""
+        with timed(ES_SEARCH_SECONDS, "es", mode=mode):
+            response = await request
+        if "took" in response:
+            ES_TOOK_SECONDS.observe(response["took"] / 1000.0, mode=mode)
+            record_timing("es_took", response["took"] / 1000.0)
+        return response
+
+    async def search(
+        self,
+        query_vector: Dict[str, float],
+        top_k: int = 5,
+        pruning: Optional[PruningConfig] = None,
+    ) -> List[Dict[str, Any]]:
+        """`pruning` defaults to the QUERY_PRUNE_* settings."""
+        index = settings.ES_INDEX
+        query_vector = prune_sparse_vector(query_vector, pruning or PruningConfig.for_query())
+
+        query = {
+            "query": self.vector_query(query_vector),
+            "_source": SOURCE_FIELDS
+        }
+
+        response = await self._timed_search("splade", self.client.search(index=index, body=query, size=top_k))
+        return self._format_hits(response)
+
+    async def search_bm25(self, query_text: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        query = {"query": self.bm25_query(query_text), "_source": SOURCE_FIELDS}
+        response = await self._timed_search(
+            "bm25", self.client.search(index=settings.ES_INDEX, body=query, size=top_k)
+        )
+        return self._format_hits(response)
+
+    async def search_hybrid(
+        self,
+        query_text: str,
+        query_vector: Dict[str, float],
+        top_k: int = 5,
+        pruning: Optional[PruningConfig] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Runs the kuromoji BM25 and SPLADE queries in one _msearch request and fuses
+        their candidate lists (HYBRID_FUSION: "rrf" or "weighted"). When one of the two
+        searches fails, the results of the other are returned alone.
+        """
+        query_vector = prune_sparse_vector(query_vector, pruning or PruningConfig.for_query())
+        candidates = max(top_k, settings.HYBRID_CANDIDATES)
+        header = {"index": settings.ES_INDEX}
+        searches = [
+            header, {"query": self.bm25_query(query_text), "_source": SOURCE_FIELDS, "size": candidates},
+            header, {"query": self.vector_query(query_vector), "_source": SOURCE_FIELDS, "size": candidates},
+        ]
+        response = await self._timed_search("hybrid", self.client.msearch(searches=searches))
+        bm25_response, splade_response = response["responses"]
+        if "error" in bm25_response and "error" in splade_response:
+            raise RuntimeError(f"Hybrid search failed: {bm25_response['error']}")
+        for failed, item in (("bm25", bm25_response), ("splade", splade_response)):
+            if "error" in item:
+                logger.warning(f"Hybrid search: {failed} query failed ({item['error']}), using the other results only")
+                SEARCH_DEGRADED.inc(failed=failed)
+        if "error" in splade_response:
+            return self._format_hits(bm25_response)[:top_k]
+        if "error" in bm25_response:
+            return self._format_hits(splade_response)[:top_k]
+        bm25_hits, splade_hits = self._format_hits(bm25_response), self._format_hits(splade_response)
+
+        if settings.HYBRID_FUSION == "weighted":
+            fused = self.weighted_score_fusion(
+                [bm25_hits, splade_hits],
+                [settings.HYBRID_BM25_WEIGHT, 1.0 - settings.HYBRID_BM25_WEIGHT],
+            )
+        else:
+            fused = self.reciprocal_rank_fusion([bm25_hits, splade_hits], k=settings.HYBRID_RRF_K)
+        return fused[:top_k]
+
+    @staticmethod
+    def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+        """score(d) = sum over lists of 1 / (k + rank of d)"""
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Dict[str, Any]] = {}
+        for results in result_lists:
+            for rank, doc in enumerate(results, start=1):
+                scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (k + rank)
+                docs.setdefault(doc["id"], doc)
+        return [
+            {**docs[doc_id], "score": score}
+            for doc_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        ]
+
+    @staticmethod
+    def weighted_score_fusion(result_lists: List[List[Dict[str, Any]]], weights: List[float]) -> List[Dict[str, Any]]:
+        """Weighted sum of per-list min-max normalized scores; BM25 and SPLADE scores are not on the same scale."""
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Dict[str, Any]] = {}
+        for results, weight in zip(result_lists, weights):
+            if not results:
+                continue
+            high = max(doc["score"] for doc in results)
+            low = min(doc["score"] for doc in results)
+            for doc in results:
+                normalized = (doc["score"] - low) / (high - low) if high > low else 1.0
+                scores[doc["id"]] = scores.get(doc["id"], 0.0) + weight * normalized
+                docs.setdefault(doc["id"], doc)
+        return [
+            {**docs[doc_id], "score": score}
+            for doc_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
         ]
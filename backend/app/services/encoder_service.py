@@ -1,8 +1,137 @@
+import asyncio
+import hashlib
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
 import httpx
-from typing import Dict, List
+import msgpack
 from app.core.config import settings
+from app.core.cache import LRUCache, SQLiteCache, normalize_query
+from app.core.http_client import http_clients
+from app.core.metrics import ENCODE_SECONDS, timed
 from loguru import logger
 
+class QueryVectorCache:
+    """
+    Query vectors keyed on the normalized query text: an in-process LRU in front of
+    an optional SQLite store shared by all uvicorn workers (QUERY_CACHE_DB_PATH).
+    """
+
+    def __init__(self):
+        self.local = LRUCache(settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TTL)
+        self.shared: Optional[SQLiteCache] = None
+        if settings.QUERY_CACHE_DB_PATH:
+            self.shared = SQLiteCache(
+                settings.QUERY_CACHE_DB_PATH,
+                max_entries=settings.QUERY_CACHE_SHARED_SIZE,
+                ttl=settings.QUERY_CACHE_TTL,
+                namespace="query_vector",
+            )
+
+    def get(self, query: str) -> Optional[Dict[str, float]]:
+        key = normalize_query(query)
+        vector = self.local.get(key)
+        if vector is None and self.shared is not None:
+            vector = self.shared.get(key)
+            if vector is not None:
+                self.local.set(key, vector)
+        return vector
+
+    def set(self, query: str, vector: Dict[str, float]):
+        key = normalize_query(query)
+        self.local.set(key, vector)
+        if self.shared is not None:
+            self.shared.set(key, vector)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.local.hits + (self.shared.hits if self.shared else 0)
+        misses = self.shared.misses if self.shared else self.local.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "local": self.local.stats(),
+            "shared": self.shared.stats() if self.shared else None,
+        }
+
+query_vector_cache = QueryVectorCache()
+
+class EmbeddingCache:
+    """
+    Persistent map from the SHA-256 of a chunk text to its sparse vector, so unchanged
+    chunks are never re-encoded. Entries are scoped to the encoder model id and `version`:
+    opening the cache with a different SPLADE_MODEL_ID or EMBEDDING_CACHE_VERSION drops every
+    entry written under the previous ones.
+    """
+
+    def __init__(self, path: str, max_entries: int, model_id: str, version: str = ""):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        namespace = f"{model_id}@{version}" if version else model_id
+        self.store = SQLiteCache(path, max_entries=max_entries, namespace=namespace, exclusive_namespace=True)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Dict[str, Dict[str, float]]:
+        return self.store.get_many(list({self.key(t) for t in texts}))
+
+    def set_many(self, texts: List[str], vectors: List[Dict[str, float]]):
+        self.store.set_many({self.key(t): v for t, v in zip(texts, vectors)})
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+_embedding_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Opens the embedding cache on first use; returns None when EMBEDDING_CACHE_PATH is unset."""
+    global _embedding_cache
+    if _embedding_cache is None and settings.EMBEDDING_CACHE_PATH:
+        _embedding_cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_PATH,
+            settings.EMBEDDING_CACHE_MAX_ENTRIES,
+            settings.SPLADE_MODEL_ID,
+            settings.EMBEDDING_CACHE_VERSION,
+        )
+    return _embedding_cache
+
+COMPACT_JSON = "application/vnd.splade.compact+json"
+MSGPACK = "application/x-msgpack"
+WIRE_MEDIA_TYPES = {"json": "application/json", "compact": COMPACT_JSON, "msgpack": MSGPACK}
+
+def wire_headers() -> Dict[str, str]:
+    return {"Accept": WIRE_MEDIA_TYPES[settings.ENCODER_WIRE_FORMAT]}
+
+def decode_vector(item: Any, media_type: str) -> Dict[str, float]:
+    """Converts one vector of an encoder response into {token_id: weight}."""
+    if media_type == MSGPACK:
+        n = len(item["indices"]) // 4
+        indices = struct.unpack(f"<{n}I", item["indices"])
+        values = struct.unpack(f"<{n}e", item["values"])
+        return {str(i): v for i, v in zip(indices, values)}
+    if media_type == COMPACT_JSON:
+        return {str(i): v for i, v in zip(item["indices"], item["values"])}
+    return item
+
+def decode_response(response: httpx.Response) -> Tuple[Dict[str, Any], str]:
+    """
+    Parses an encoder response in whichever format the encoder chose; older
+    encoders ignore the Accept header and always answer with plain JSON.
+    """
+    media_type = response.headers.get("content-type", "").split(";")[0].strip()
+    if media_type == MSGPACK:
+        return msgpack.unpackb(response.content, raw=False), media_type
+    return response.json(), media_type
+
 class EncoderService:
     @staticmethod
     async def encode(text: str) -> Dict[str, float]:
@@ -10,29 +139,68 @@ class EncoderService:
         Sends text to the SPLADE Encoder API and returns the sparse vector.
         """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    settings.SPLADE_API_URL,
-                    json={"text": text},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                # Assuming the response format is {"indices": [...], "values": [...]} 
-                # or a direct dictionary of {token: weight}
-                return data.get("vector", data)
+            client = http_clients.get("encoder")
+            with timed(ENCODE_SECONDS, "encode", kind="query"):
+                response = await client.post(settings.SPLADE_API_URL, json={"text": text}, headers=wire_headers())
+            response.raise_for_status()
+            data, media_type = decode_response(response)
+            # {"vector": ...} or, from very old encoders, a bare {token: weight}
+            return decode_vector(data.get("vector", data), media_type)
         except Exception as e:
             logger.error(f"Error encoding text: {e}")
             # Return empty or fall back if possible. For now, raise.
             raise
 
+    @staticmethod
+    async def encode_query(query: str) -> Dict[str, float]:
+        """
+        Encodes a search query, serving repeated queries from the query-vector cache.
+        """
+        if not settings.QUERY_CACHE_ENABLED:
+            return await EncoderService.encode(query)
+        vector = query_vector_cache.get(query)
+        if vector is None:
+            vector = await EncoderService.encode(query)
+            query_vector_cache.set(query, vector)
+        return vector
+
     @staticmethod
     async def encode_batch(texts: List[str]) -> List[Dict[str, float]]:
         """
-        Encodes a batch of texts.
+        Encodes a batch of texts with a single call to the SPLADE Encoder batch API.
+        """
+        if not texts:
+            return []
+        try:
+            client = http_clients.get("encoder")
+            with timed(ENCODE_SECONDS, kind="batch"):
+                response = await client.post(
+                    settings.SPLADE_BATCH_API_URL,
+                    json={"texts": texts},
+                    headers=wire_headers(),
+                    timeout=settings.ENCODER_BATCH_TIMEOUT
+                )
+            response.raise_for_status()
+            data, media_type = decode_response(response)
+            return [decode_vector(item, media_type) for item in data["vectors"]]
+        except Exception as e:
+            logger.error(f"Error encoding batch of {len(texts)} texts: {e}")
+            raise
+
+    @staticmethod
+    async def encode_batch_cached(texts: List[str]) -> List[Dict[str, float]]:
         """
-        # Simple sequential for now, can be optimized with asyncio.gather
-        results = []
-        for text in texts:
-            results.append(await EncoderService.encode(text))
-        return results
+        Like encode_batch, but serves texts found in the embedding cache without
+        calling the encoder and stores newly encoded vectors.
+        """
+        cache = get_embedding_cache()
+        if cache is None:
+            return await EncoderService.encode_batch(texts)
+
+        cached = await asyncio.to_thread(cache.get_many, texts)
+        missing = list(dict.fromkeys(t for t in texts if cache.key(t) not in cached))
+        if missing:
+            vectors = await EncoderService.encode_batch(missing)
+            await asyncio.to_thread(cache.set_many, missing, vectors)
+            cached.update({cache.key(t): v for t, v in zip(missing, vectors)})
+        return [cached[cache.key(t)] for t in texts]
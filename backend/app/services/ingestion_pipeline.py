@@ -0,0 +1,225 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.metrics import INGEST_BATCH_SECONDS, INGEST_FAILED, INGEST_ITEMS
+from app.models.scrapbox import ScrapboxChunk, ScrapboxPage
+from app.services.scrapbox_service import ScrapboxService
+from app.services.encoder_service import EncoderService
+from app.services.elasticsearch_service import ElasticsearchService
+from app.services.sparse_vector import PruningConfig, prune_sparse_vector
+from loguru import logger
+
+# Pages parsed per hop to the worker thread
+PAGE_READ_AHEAD = 64
+
+class StageMetrics:
+    """Throughput counters of one pipeline stage and the depth of the queue feeding it."""
+
+    def __init__(self, name: str, queue: Optional[asyncio.Queue] = None):
+        self.name = name
+        self.queue = queue
+        self.items = 0
+        self.batches = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self.started_at = time.monotonic()
+
+    def record(self, items: int, seconds: float, failed: int = 0):
+        self.items += items
+        self.batches += 1
+        self.failed += failed
+        self.busy_seconds += seconds
+        INGEST_ITEMS.inc(items, stage=self.name)
+        INGEST_BATCH_SECONDS.observe(seconds, stage=self.name)
+        if failed:
+            INGEST_FAILED.inc(failed, stage=self.name)
+
+    def sample_queue(self):
+        if self.queue is not None:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "items": self.items,
+            "batches": self.batches,
+            "failed": self.failed,
+            "items_per_second": self.items / elapsed if elapsed > 0 else 0.0,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "queue_depth": self.queue.qsize() if self.queue is not None else None,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+class IngestionPipeline:
+    """
+    Ingestion as three stages connected by bounded queues:
+
+        pages -> [chunk] -> encode queue -> [encode x N] -> index queue -> [index x M] -> ES
+
+    Each stage has its own batch size and worker count. A full queue blocks the stage
+    in front of it (backpressure), so the encoder and Elasticsearch work concurrently
+    instead of taking turns, while memory stays bounded by the queue sizes.
+    """
+
+    def __init__(
+        self,
+        es_service: ElasticsearchService,
+        encode_batch_size: Optional[int] = None,
+        encode_concurrency: Optional[int] = None,
+        index_batch_size: Optional[int] = None,
+        index_concurrency: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        self.es_service = es_service
+        self.encode_batch_size = encode_batch_size or settings.INGEST_ENCODE_BATCH_SIZE
+        self.encode_concurrency = encode_concurrency or settings.INGEST_ENCODE_CONCURRENCY
+        self.index_batch_size = index_batch_size or settings.INGEST_INDEX_BATCH_SIZE
+        self.index_concurrency = index_concurrency or settings.INGEST_INDEX_CONCURRENCY
+        queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.encode_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.index_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stages = {
+            "chunk": StageMetrics("chunk"),
+            "encode": StageMetrics("encode", self.encode_queue),
+            "index": StageMetrics("index", self.index_queue),
+        }
+        self.doc_pruning = PruningConfig.for_document()
+        self.chunk_counts: Dict[str, int] = {}
+        self.skipped_pages = 0
+        self.running = False
+
+    @staticmethod
+    def is_unchanged(page: ScrapboxPage, chunk_count: int, stored: Optional[Dict[str, int]]) -> bool:
+        """A page can be skipped when the index already holds all of its chunks at the same version."""
+        return stored is not None and stored["updated"] == page.updated and stored["chunks"] == chunk_count
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pages": len(self.chunk_counts),
+            "skipped_pages": self.skipped_pages,
+            "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+        }
+
+    @staticmethod
+    async def _take_batch(queue: asyncio.Queue, size: int) -> tuple:
+        """Waits for up to `size` items; returns (items, finished) where finished means the sentinel was seen."""
+        batch: List[ScrapboxChunk] = []
+        while len(batch) < size:
+            item = await queue.get()
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _chunk_stage(
+        self,
+        project_name: str,
+        pages: Iterable[ScrapboxPage],
+        stored: Dict[str, Dict[str, int]],
+        incremental: bool,
+    ):
+        stage = self.stages["chunk"]
+        page_iter = iter(pages)
+        while True:
+            # Parsing may block on file I/O, so pages are pulled in small groups off the event loop
+            group = await asyncio.to_thread(lambda: list(itertools.islice(page_iter, PAGE_READ_AHEAD)))
+            if not group:
+                break
+            for page in group:
+                start = time.monotonic()
+                chunks = ScrapboxService.chunk_page(page, project_name)
+                self.chunk_counts[page.id] = len(chunks)
+                stage.record(len(chunks), time.monotonic() - start)
+                if incremental and self.is_unchanged(page, len(chunks), stored.get(page.id)):
+                    self.skipped_pages += 1
+                    continue
+                for chunk in chunks:
+                    await self.encode_queue.put(chunk)
+        for _ in range(self.encode_concurrency):
+            await self.encode_queue.put(None)
+
+    async def _encode_worker(self):
+        stage = self.stages["encode"]
+        finished = False
+        while not finished:
+            stage.sample_queue()
+            batch, finished = await self._take_batch(self.encode_queue, self.encode_batch_size)
+            if not batch:
+                continue
+            start = time.monotonic()
+            failed = 0
+            # One encoder call (one forward pass) per batch, skipping cached texts
+            try:
+                vectors = await EncoderService.encode_batch_cached([c.text for c in batch])
+                # Pruned after the embedding cache, so changing DOC_PRUNE_* needs no re-encoding
+                for chunk, vector in zip(batch, vectors):
+                    chunk.sparse_vector = prune_sparse_vector(vector, self.doc_pruning)
+            except Exception as e:
+                failed = len(batch)
+                logger.warning(f"Failed to encode batch {batch[0].id}..{batch[-1].id}: {e}")
+            stage.record(len(batch), time.monotonic() - start, failed)
+            for chunk in batch:
+                if chunk.sparse_vector:
+                    await self.index_queue.put(chunk)
+
+    async def _index_worker(self):
+        stage = self.stages["index"]
+        finished = False
+        while not finished:
+            stage.sample_queue()
+            batch, finished = await self._take_batch(self.index_queue, self.index_batch_size)
+            if not batch:
+                continue
+            start = time.monotonic()
+            failures = await self.es_service.bulk_index_chunks(batch)
+            stage.record(len(batch), time.monotonic() - start, len(failures))
+
+    async def _encode_stage(self):
+        await asyncio.gather(*(self._encode_worker() for _ in range(self.encode_concurrency)))
+        for _ in range(self.index_concurrency):
+            await self.index_queue.put(None)
+
+    async def _index_stage(self):
+        await asyncio.gather(*(self._index_worker() for _ in range(self.index_concurrency)))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(settings.INGEST_METRICS_INTERVAL)
+            for stage in self.stages.values():
+                stage.sample_queue()
+            logger.info(
+                "Ingestion: "
+                + ", ".join(
+                    f"{name} {s['items']} ({s['items_per_second']:.1f}/s, queue {s['queue_depth']})"
+                    for name, s in self.metrics()["stages"].items()
+                )
+            )
+
+    async def run(
+        self,
+        project_name: str,
+        pages: Iterable[ScrapboxPage],
+        stored: Dict[str, Dict[str, int]],
+        incremental: bool = False,
+    ) -> Dict[str, Any]:
+        """Runs all stages to completion and returns the final metrics."""
+        self.running = True
+        tasks = [
+            asyncio.create_task(self._chunk_stage(project_name, pages, stored, incremental)),
+            asyncio.create_task(self._encode_stage()),
+            asyncio.create_task(self._index_stage()),
+        ]
+        reporter = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + [reporter]:
+                task.cancel()
+            self.running = False
+        metrics = self.metrics()
+        logger.info(f"Ingestion finished: {metrics}")
+        return metrics
@@ -0,0 +1,118 @@
+import asyncio
+from typing import Dict, Iterable, Optional, Set
+from app.core.config import settings
+from app.models.scrapbox import ScrapboxPage, ScrapboxProject
+from app.services.scrapbox_export import ScrapboxExportReader
+from app.services.elasticsearch_service import ElasticsearchService
+from app.services.ingestion_pipeline import IngestionPipeline
+from loguru import logger
+
+class IngestionService:
+    # Most recently started pipeline, for progress reporting
+    last_pipeline: Optional[IngestionPipeline] = None
+
+    @staticmethod
+    async def known_versions(es_service: ElasticsearchService, project_name: str) -> Dict[str, int]:
+        """{page_id: updated} of the indexed pages, used to skip fetching unchanged pages."""
+        await es_service.create_index_if_not_exists()
+        stored = await es_service.get_page_versions(project_name)
+        return {page_id: v["updated"] for page_id, v in stored.items()}
+
+    @staticmethod
+    async def remove_stale_chunks(
+        es_service: ElasticsearchService,
+        stored: Dict[str, Dict[str, int]],
+        chunk_counts: Dict[str, int],
+        seen_page_ids: Set[str],
+    ):
+        """
+        Deletes chunks of pages that no longer exist, and the trailing `{page_id}_{n}`
+        chunks of pages that now produce fewer chunks than before.
+        """
+        deleted_pages = [page_id for page_id in stored if page_id not in seen_page_ids]
+        stale_ids = [
+            f"{page_id}_{n}"
+            for page_id, count in chunk_counts.items()
+            if page_id in stored
+            for n in range(count, stored[page_id]["chunks"])
+        ]
+        await es_service.delete_pages(deleted_pages)
+        await es_service.delete_chunks(stale_ids)
+
+    @staticmethod
+    async def ingest_pages(
+        project_name: str,
+        pages: Iterable[ScrapboxPage],
+        es_service: ElasticsearchService,
+        incremental: bool = False,
+        unchanged_page_ids: Iterable[str] = (),
+        failed_page_ids: Iterable[str] = (),
+    ):
+        """
+        Chunks, encodes and indexes pages as they are produced by `pages`, which may be a
+        lazy iterator (e.g. a streaming export reader), through an IngestionPipeline.
+        In incremental mode pages whose `updated` timestamp and chunk count match the
+        index are skipped. `unchanged_page_ids` lists pages the fetcher already skipped and
+        `failed_page_ids` pages it could not fetch; both keep their indexed chunks.
+        Full imports run in the index's bulk-load mode (ES_BULK_LOAD_MODE).
+        """
+        await es_service.create_index_if_not_exists()
+        stored = await es_service.get_page_versions(project_name)
+
+        pipeline = IngestionPipeline(es_service)
+        IngestionService.last_pipeline = pipeline
+        if not incremental and settings.ES_BULK_LOAD_MODE:
+            async with es_service.bulk_load():
+                metrics = await pipeline.run(project_name, pages, stored, incremental=incremental)
+        else:
+            metrics = await pipeline.run(project_name, pages, stored, incremental=incremental)
+        chunk_counts = pipeline.chunk_counts
+
+        unchanged_page_ids = set(unchanged_page_ids)
+        failed_page_ids = set(failed_page_ids)
+        logger.info(
+            f"Processed {metrics['stages']['index']['items']} chunks from project {project_name} "
+            f"({pipeline.skipped_pages + len(unchanged_page_ids)} unchanged pages skipped, "
+            f"{metrics['stages']['index']['failed']} failed, {len(failed_page_ids)} pages not fetched)"
+        )
+        # Only pages missing from the listed project are deleted, not pages that failed to fetch
+        await IngestionService.remove_stale_chunks(
+            es_service, stored, chunk_counts, set(chunk_counts) | unchanged_page_ids | failed_page_ids
+        )
+
+    @staticmethod
+    async def ingest_project(
+        project_data: dict,
+        es_service: ElasticsearchService,
+        incremental: bool = False,
+    ):
+        """Ingests an in-memory project, e.g. one fetched from the Scrapbox API."""
+        project = ScrapboxProject(**project_data)
+        await IngestionService.ingest_pages(
+            project.name,
+            project.pages,
+            es_service,
+            incremental=incremental,
+            unchanged_page_ids=project_data.get("unchanged_page_ids", []),
+            failed_page_ids=project_data.get("failed_page_ids", []),
+        )
+
+    @staticmethod
+    async def ingest_export_file(
+        path: str,
+        es_service: ElasticsearchService,
+        incremental: bool = False,
+        project_name: Optional[str] = None,
+    ):
+        """
+        Streams a Scrapbox export file: pages are parsed, chunked and encoded one by one
+        instead of loading the whole export. `project_name` is used when the export does
+        not name the project before its pages.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            reader = ScrapboxExportReader(f)
+            header = await asyncio.to_thread(reader.header)
+            name = header.get("name") or project_name
+            if not name:
+                raise ValueError("Export does not contain a project name before its pages")
+            await IngestionService.ingest_pages(name, reader.pages(), es_service, incremental=incremental)
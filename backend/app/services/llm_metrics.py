@@ -0,0 +1,97 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from pydantic import BaseModel
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class GenerationStats(BaseModel):
+    """Timings of one LLM generation. Token counts and durations come from Ollama's final `done` message."""
+    model: str
+    ttft_seconds: Optional[float] = None  # request sent -> first non-empty token
+    total_seconds: float = 0.0
+    prompt_tokens: int = 0
+    eval_tokens: int = 0
+    load_seconds: float = 0.0
+    prompt_eval_seconds: float = 0.0
+    eval_seconds: float = 0.0
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        return self.eval_tokens / self.eval_seconds if self.eval_seconds > 0 else None
+
+    @property
+    def prompt_tokens_per_second(self) -> Optional[float]:
+        return self.prompt_tokens / self.prompt_eval_seconds if self.prompt_eval_seconds > 0 else None
+
+    @classmethod
+    def from_done(cls, model: str, data: Dict[str, Any], ttft: Optional[float], total: float) -> "GenerationStats":
+        # Ollama reports durations in nanoseconds
+        return cls(
+            model=model,
+            ttft_seconds=ttft,
+            total_seconds=total,
+            prompt_tokens=data.get("prompt_eval_count", 0),
+            eval_tokens=data.get("eval_count", 0),
+            load_seconds=data.get("load_duration", 0) / 1e9,
+            prompt_eval_seconds=data.get("prompt_eval_duration", 0) / 1e9,
+            eval_seconds=data.get("eval_duration", 0) / 1e9,
+        )
+
+    def log_fields(self) -> Dict[str, Any]:
+        return {
+            **self.model_dump(),
+            "tokens_per_second": self.tokens_per_second,
+            "prompt_tokens_per_second": self.prompt_tokens_per_second,
+        }
+
+class LLMMetrics:
+    """Aggregates of the most recent `window` generations, for capacity planning of the LLM host."""
+
+    def __init__(self, window: int = 1000):
+        self.recent: Deque[GenerationStats] = deque(maxlen=window)
+        self.completed = 0
+        self.errors = 0
+        self.started_at = time.time()
+
+    def record(self, stats: GenerationStats):
+        self.recent.append(stats)
+        self.completed += 1
+
+    def record_error(self):
+        self.errors += 1
+
+    def clear(self):
+        self.recent.clear()
+        self.completed = 0
+        self.errors = 0
+
+    def summary(self) -> Dict[str, Any]:
+        def dist(values: List[float]) -> Dict[str, Optional[float]]:
+            return {
+                "avg": sum(values) / len(values) if values else None,
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+            }
+
+        recent = list(self.recent)
+        return {
+            "completed": self.completed,
+            "errors": self.errors,
+            "window": len(recent),
+            "ttft_seconds": dist([s.ttft_seconds for s in recent if s.ttft_seconds is not None]),
+            "total_seconds": dist([s.total_seconds for s in recent]),
+            "tokens_per_second": dist([s.tokens_per_second for s in recent if s.tokens_per_second]),
+            "prompt_tokens_per_second": dist(
+                [s.prompt_tokens_per_second for s in recent if s.prompt_tokens_per_second]
+            ),
+            "prompt_tokens": dist([float(s.prompt_tokens) for s in recent]),
+            "eval_tokens": dist([float(s.eval_tokens) for s in recent]),
+            "load_seconds": dist([s.load_seconds for s in recent]),
+        }
+
+llm_metrics = LLMMetrics()
@@ -0,0 +1,143 @@
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Deque, Optional
+from app.core.config import settings
+from app.core.metrics import LLM_QUEUE_DEPTH, LLM_REJECTED
+
+class LLMOverloaded(Exception):
+    """The LLM cannot take the request: 429 when the queue is full, 503 when the queue wait timed out."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"LLM is busy ({reason}), retry after {retry_after}s")
+
+class Ticket:
+    """A request's place in the LLM queue; released exactly once when generation ends."""
+
+    def __init__(self, scheduler: "LLMScheduler", deadline: float):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.admitted = False
+        self.released = False
+        self.changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based position in the queue, 0 once admitted."""
+        return 0 if self.admitted else self.scheduler._waiters.index(self) + 1
+
+    async def positions(self) -> AsyncIterator[int]:
+        """
+        Yields the queue position whenever it changes and returns once admitted.
+        Raises LLMOverloaded (503) when the deadline passes first.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while not self.admitted:
+                yield self.position
+                self.changed.clear()
+                timeout = self.deadline - loop.time()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    if not self.admitted:
+                        LLM_REJECTED.inc(reason="deadline")
+                        raise LLMOverloaded(503, "queue deadline exceeded", self.scheduler.retry_after())
+        except BaseException:
+            # Client went away (cancellation) or the wait timed out: give up the place or slot
+            self.release()
+            raise
+
+    async def wait(self):
+        async for _ in self.positions():
+            pass
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+class LLMScheduler:
+    """
+    Admission control in front of the LLM: at most `max_concurrency` generations run at once,
+    up to `max_queue` more wait in FIFO order for at most `queue_timeout` seconds, and anything
+    beyond that is rejected immediately instead of piling up on the model until it times out.
+    Unset limits follow the LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE and LLM_QUEUE_TIMEOUT settings.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[Ticket] = deque()
+
+    @property
+    def max_concurrency(self) -> int:
+        return self._max_concurrency or settings.LLM_MAX_CONCURRENCY
+
+    @property
+    def max_queue(self) -> int:
+        return self._max_queue if self._max_queue is not None else settings.LLM_MAX_QUEUE
+
+    @property
+    def queue_timeout(self) -> float:
+        return self._queue_timeout if self._queue_timeout is not None else settings.LLM_QUEUE_TIMEOUT
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        return settings.LLM_RETRY_AFTER
+
+    def check_capacity(self):
+        """Raises LLMOverloaded (429) when a new request could neither run nor queue."""
+        if self.active >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+            LLM_REJECTED.inc(reason="queue_full")
+            raise LLMOverloaded(429, "queue full", self.retry_after())
+
+    def enqueue(self) -> Ticket:
+        """Takes a free slot or a place in the queue; the ticket must be released."""
+        self.check_capacity()
+        ticket = Ticket(self, asyncio.get_running_loop().time() + self.queue_timeout)
+        if self.active < self.max_concurrency and not self._waiters:
+            ticket.admitted = True
+            self.active += 1
+        else:
+            self._waiters.append(ticket)
+            LLM_QUEUE_DEPTH.set(len(self._waiters))
+        return ticket
+
+    def _release(self, ticket: Ticket):
+        if ticket.admitted:
+            self.active -= 1
+        else:
+            self._waiters.remove(ticket)
+        notify = []
+        while self._waiters and self.active < self.max_concurrency:
+            waiter = self._waiters.popleft()
+            waiter.admitted = True
+            self.active += 1
+            notify.append(waiter)
+        # Admitted waiters start; everyone still waiting has moved up
+        for waiter in notify + list(self._waiters):
+            waiter.changed.set()
+        LLM_QUEUE_DEPTH.set(len(self._waiters))
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+llm_scheduler = LLMScheduler()
@@ -1,97 +1,222 @@
-import httpx
-from typing import List, Dict, Any
+import json
+import time
+from typing import AsyncIterator, List, Dict, Any, NamedTuple, Optional, Union
 from app.core.config import settings
+from app.core.http_client import http_clients
+from app.core.metrics import LLM_GENERATION_SECONDS, LLM_IN_FLIGHT, LLM_TOKENS, LLM_TTFT_SECONDS, record_timing
+from app.services.answer_cache import answer_cache
+from app.services.context_packer import ContextPacker, format_context
+from app.services.llm_metrics import GenerationStats, llm_metrics
+from app.services.llm_scheduler import LLMOverloaded, llm_scheduler
+from app.services.semantic_cache import semantic_cache
 from loguru import logger
 
-class LLMService:
-    @staticmethod
-    async def generate_answer(query: str, contexts: List[Dict[str, Any]]) -> str:
-        """
-        Generates an answer using Gemma 3 via Ollama based on the provided contexts.
-        """
-        context_text = "\n\n".join([
-            f"Source: {ctx['title']} ({ctx['url']})\nContent: {ctx['text']}"
-            for ctx in contexts
-        ])
-
-        prompt = f"""<start_of_turn>user
+# Static instruction block. It always opens the prompt byte-for-byte unchanged, so Ollama
+# can reuse the KV cache of this prefix across requests instead of prefilling it again.
+# Gemma 3 Instruct format might differ slightly, but using this as a standard.
+PROMPT_PREFIX = """<start_of_turn>user
 提供されたScrapboxの情報のみに基づいて、質問に答えてください。
 回答は日本語で、根拠となった情報のタイトルとURLを含めてください。
 
 情報:
-{context_text}
+"""
+
+class QueuePosition(NamedTuple):
+    """Emitted by the answer stream while the request waits for an LLM slot."""
+    position: int
+
+class LLMService:
+    @staticmethod
+    def build_prompt(query: str, context_text: str) -> str:
+        """Static prefix first, then the per-request contexts and question."""
+        return f"""{PROMPT_PREFIX}{context_text}
 
 質問: {query}<end_of_turn>
 <start_of_turn>model
 """
-        # Gemma 3 Instruct format might differ slightly, but using this as a standard.
 
+    @staticmethod
+    def request_body(prompt: str, stream: bool, **options: Any) -> Dict[str, Any]:
+        """/api/generate payload with the configured keep_alive, num_ctx and num_predict."""
+        options = {"temperature": 0.1, "top_p": 0.9, **options}
+        if settings.LLM_NUM_CTX is not None:
+            options.setdefault("num_ctx", settings.LLM_NUM_CTX)
+        if settings.LLM_NUM_PREDICT is not None:
+            options.setdefault("num_predict", settings.LLM_NUM_PREDICT)
+        body = {
+            "model": settings.LLM_MODEL,
+            "prompt": prompt,
+            "stream": stream,
+            "options": options,
+        }
+        if settings.LLM_KEEP_ALIVE is not None:
+            body["keep_alive"] = settings.LLM_KEEP_ALIVE
+        return body
+
+    @staticmethod
+    async def warm_up():
+        """
+        Loads the model and prefills PROMPT_PREFIX with a one-token generation, so the first
+        user request after startup does not pay for model loading.
+        """
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{settings.OLLAMA_BASE_URL}/api/generate",
-                    json={
-                        "model": settings.LLM_MODEL,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.1,
-                            "top_p": 0.9,
-                        }
-                    },
-                    timeout=120.0
-                )
-                response.raise_for_status()
-                return response.json().get("response", "回答を生成できませんでした。")
+            client = http_clients.get("llm")
+            response = await client.post(
+                f"{settings.OLLAMA_BASE_URL}/api/generate",
+                json=LLMService.request_body(PROMPT_PREFIX, stream=False, num_predict=1),
+            )
+            response.raise_for_status()
+            logger.info(f"Warmed up LLM {settings.LLM_MODEL}")
         except Exception as e:
-            logger.error(f"Error calling LLM: {e}")
-            return f"エラーが発生しました: {str(e)}"
+            logger.warning(f"LLM warm-up failed: {e}")
+
+    @staticmethod
+    def _cached_tokens(
+        query: str, contexts: List[Dict[str, Any]], query_vector: Optional[Dict[str, float]]
+    ) -> Optional[List[str]]:
+        """Exact answer cache first, then (when enabled) the semantic cache on the query vector."""
+        tokens = answer_cache.get(query, contexts)
+        if tokens is None and query_vector and settings.SEMANTIC_CACHE_ENABLED:
+            tokens = semantic_cache.get(query_vector, contexts)
+        return tokens
+
+    @staticmethod
+    def _store(
+        query: str, contexts: List[Dict[str, Any]], query_vector: Optional[Dict[str, float]], tokens: List[str]
+    ):
+        answer_cache.set(query, contexts, tokens)
+        if query_vector and settings.SEMANTIC_CACHE_ENABLED:
+            semantic_cache.set(query_vector, contexts, tokens)
+
+    @staticmethod
+    def build_context_text(contexts: List[Dict[str, Any]]) -> str:
+        """Packs the contexts into LLM_CONTEXT_TOKEN_BUDGET (deduplicated, merged, in score order)."""
+        packed = ContextPacker.pack(contexts, settings.LLM_CONTEXT_TOKEN_BUDGET)
+        logger.info(
+            f"Packed {len(packed.contexts)}/{len(contexts)} contexts into ~{packed.tokens}/{packed.budget} tokens "
+            f"({packed.truncated} truncated, {packed.dropped} dropped)"
+        )
+        return "\n\n".join(format_context(ctx) for ctx in packed.contexts)
 
     @staticmethod
-    async def generate_answer_stream(query: str, contexts: List[Dict[str, Any]]):
+    async def _stream_prompt(prompt: str) -> AsyncIterator[str]:
         """
-        Generates a streaming answer using Gemma 3 via Ollama.
+        Streams the tokens of one Ollama generation, then records its time-to-first-token,
+        throughput and token counts from the final `done` message. Errors propagate;
+        a stream that ends without `done` raises, so partial answers are never cached.
         """
-        context_text = "\n\n".join([
-            f"Source: {ctx['title']} ({ctx['url']})\nContent: {ctx['text']}"
-            for ctx in contexts
-        ])
+        client = http_clients.get("llm")
+        start = time.monotonic()
+        ttft: Optional[float] = None
+        LLM_IN_FLIGHT.inc()
+        try:
+            async with client.stream(
+                "POST",
+                f"{settings.OLLAMA_BASE_URL}/api/generate",
+                json=LLMService.request_body(prompt, stream=True),
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    token = data.get("response")
+                    if token is not None:
+                        if ttft is None and token:
+                            ttft = time.monotonic() - start
+                            LLM_TTFT_SECONDS.observe(ttft)
+                            record_timing("llm_ttft", ttft)
+                        yield token
+                    if data.get("done"):
+                        stats = GenerationStats.from_done(settings.LLM_MODEL, data, ttft, time.monotonic() - start)
+                        llm_metrics.record(stats)
+                        LLM_GENERATION_SECONDS.observe(stats.total_seconds)
+                        LLM_TOKENS.inc(stats.prompt_tokens, kind="prompt")
+                        LLM_TOKENS.inc(stats.eval_tokens, kind="eval")
+                        record_timing("llm", stats.total_seconds)
+                        logger.bind(llm=stats.log_fields()).info(
+                            f"LLM generation: ttft={stats.ttft_seconds}s, {stats.eval_tokens} tokens "
+                            f"({stats.tokens_per_second or 0:.1f}/s), prompt {stats.prompt_tokens} tokens"
+                        )
+                        return
+            raise RuntimeError("LLM stream ended before completion")
+        except Exception:
+            llm_metrics.record_error()
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec()
 
-        prompt = f"""<start_of_turn>user
-提供されたScrapboxの情報のみに基づいて、質問に答えてください。
-回答は日本語で、根拠となった情報のタイトルとURLを含めてください。
+    @staticmethod
+    async def _generate(
+        query: str,
+        contexts: List[Dict[str, Any]],
+        query_vector: Optional[Dict[str, float]],
+    ) -> AsyncIterator[Union[str, QueuePosition]]:
+        """
+        The single generation path: cached tokens are replayed, otherwise the request waits
+        for an LLM slot (yielding its queue position) and the prompt is streamed from Ollama;
+        the complete answer is cached. Raises LLMOverloaded when admission is refused.
+        """
+        cached = LLMService._cached_tokens(query, contexts, query_vector)
+        if cached is not None:
+            for token in cached:
+                yield token
+            return
 
-情報:
-{context_text}
+        ticket = llm_scheduler.enqueue()
+        try:
+            async for position in ticket.positions():
+                yield QueuePosition(position)
+            prompt = LLMService.build_prompt(query, LLMService.build_context_text(contexts))
+            tokens = []
+            async for token in LLMService._stream_prompt(prompt):
+                tokens.append(token)
+                yield token
+        finally:
+            ticket.release()
+        if "".join(tokens):
+            LLMService._store(query, contexts, query_vector, tokens)
 
-質問: {query}<end_of_turn>
-<start_of_turn>model
-"""
+    @staticmethod
+    async def generate_answer(
+        query: str,
+        contexts: List[Dict[str, Any]],
+        query_vector: Optional[Dict[str, float]] = None,
+    ) -> str:
+        """
+        Generates an answer using Gemma 3 via Ollama based on the provided contexts.
+        Answers are served from the answer cache when the same query retrieved the same chunks,
+        or from the semantic cache when `query_vector` is close to an earlier query's.
+        Raises LLMOverloaded when the LLM is saturated.
+        """
+        try:
+            answer = "".join([
+                token async for token in LLMService._generate(query, contexts, query_vector)
+                if isinstance(token, str)
+            ])
+        except LLMOverloaded:
+            raise
+        except Exception as e:
+            logger.error(f"Error calling LLM: {e}")
+            return f"エラーが発生しました: {str(e)}"
+        return answer or "回答を生成できませんでした。"
+
+    @staticmethod
+    async def generate_answer_stream(
+        query: str,
+        contexts: List[Dict[str, Any]],
+        query_vector: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Generates a streaming answer using Gemma 3 via Ollama: answer tokens (str), preceded by
+        QueuePosition events while waiting for an LLM slot. On an answer cache hit the cached
+        tokens are replayed without calling the LLM. Raises LLMOverloaded when the LLM is saturated.
+        """
         try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
-                    "POST",
-                    f"{settings.OLLAMA_BASE_URL}/api/generate",
-                    json={
-                        "model": settings.LLM_MODEL,
-                        "prompt": prompt,
-                        "stream": True,
-                        "options": {
-                            "temperature": 0.1,
-                            "top_p": 0.9,
-                        }
-                    },
-                    timeout=120.0
-                ) as response:
-                    async for line in response.aiter_lines():
-                        if not line:
-                            continue
-                        import json
-                        data = json.loads(line)
-                        if "response" in data:
-                            yield data["response"]
-                        if data.get("done"):
-                            break
+            async for token in LLMService._generate(query, contexts, query_vector):
+                yield token
+        except LLMOverloaded:
+            raise
         except Exception as e:
             logger.error(f"Error in LLM stream: {e}")
             yield f"\n[Error: {str(e)}]"
@@ -0,0 +1,112 @@
+import json
+from typing import Any, Dict, Iterator, Optional, TextIO
+from app.models.scrapbox import ScrapboxPage
+
+class ScrapboxExportReader:
+    """
+    Incremental parser for Scrapbox export files.
+    Reads the top-level fields (name, displayName, ...) with `header()`, then yields
+    `pages[]` one page at a time from `pages()`, so memory stays bounded by the
+    largest single page instead of the whole export.
+    """
+
+    def __init__(self, fp: TextIO, read_size: int = 1 << 20):
+        self.fp = fp
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self._header: Optional[Dict[str, Any]] = None
+        self._in_pages = False
+
+    def _fill(self) -> bool:
+        """Reads more input; returns False at end of file."""
+        if self.eof:
+            return False
+        # Grow the read when a single value spans the whole buffer, keeping re-parsing linear
+        data = self.fp.read(max(self.read_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        # Drop consumed input so the buffer does not grow with the file
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Skips whitespace and returns the next character ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError(f"Invalid Scrapbox export: expected one of {chars!r}, got {c!r}")
+        self.pos += 1
+        return c
+
+    def _value(self) -> Any:
+        """Decodes the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer end (e.g. a number) may continue in the next read
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                continue
+
+    def header(self) -> Dict[str, Any]:
+        """Top-level fields that precede `pages`."""
+        if self._header is not None:
+            return self._header
+        self._header = {}
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return self._header
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "pages":
+                self._expect("[")
+                self._in_pages = True
+                return self._header
+            self._header[key] = self._value()
+            if self._expect(",}") == "}":
+                return self._header
+
+    def pages(self) -> Iterator[ScrapboxPage]:
+        self.header()
+        if not self._in_pages:
+            return
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.to_page(self._value())
+            if self._expect(",]") == "]":
+                return
+
+    @staticmethod
+    def to_page(data: Dict[str, Any]) -> ScrapboxPage:
+        # Exports with metadata store lines as {"text": ..., "created": ..., ...}
+        lines = [line["text"] if isinstance(line, dict) else line for line in data.get("lines", [])]
+        return ScrapboxPage(
+            id=data["id"],
+            title=data["title"],
+            lines=lines,
+            updated=data["updated"],
+            pin=data.get("pin", 0),
+        )
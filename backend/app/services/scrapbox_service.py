@@ -1,100 +1,188 @@
-import re
+import asyncio
 import httpx
 import urllib.parse
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 from app.models.scrapbox import ScrapboxPage, ScrapboxChunk, ScrapboxProject
+from app.core.config import settings
+from app.core.http_client import http_clients
+from app.core.rate_limit import TokenBucket
+from app.services.chunker import Chunker, clean_line
 from loguru import logger
 
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 class ScrapboxService:
     @staticmethod
-    async def fetch_project_data(project_name: str, connect_sid: Optional[str] = None) -> dict:
-        """Fetch all pages from a Scrapbox project via API."""
-        base_url = f"https://scrapbox.io/api/pages/{project_name}"
-        cookies = {"connect.sid": connect_sid} if connect_sid else {}
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # 1. Get page list
-            logger.info(f"Fetching page list for project: {project_name}")
-            response = await client.get(f"{base_url}?limit=1000", cookies=cookies)
+    async def _get_with_retry(
+        client: httpx.AsyncClient,
+        url: str,
+        bucket: TokenBucket,
+        headers: dict,
+        params: Optional[dict] = None,
+    ) -> httpx.Response:
+        """GET with rate limiting and exponential backoff on 429/5xx and transport errors."""
+        for attempt in range(settings.SCRAPBOX_MAX_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                response = await client.get(url, params=params, headers=headers)
+            except httpx.TransportError as e:
+                if attempt == settings.SCRAPBOX_MAX_RETRIES:
+                    raise
+                logger.warning(f"Request to {url} failed ({e}), retrying")
+                await asyncio.sleep(settings.SCRAPBOX_RETRY_BACKOFF * 2 ** attempt)
+                continue
+
+            if response.status_code not in RETRYABLE_STATUS or attempt == settings.SCRAPBOX_MAX_RETRIES:
+                return response
+
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else settings.SCRAPBOX_RETRY_BACKOFF * 2 ** attempt
+            logger.warning(f"Got {response.status_code} from {url}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def list_pages(project_name: str, connect_sid: Optional[str] = None, bucket: Optional[TokenBucket] = None) -> List[dict]:
+        """Walk the paginated page list of a project using `skip`."""
+        base_url = f"{settings.SCRAPBOX_API_BASE_URL}/pages/{project_name}"
+        # Sent as a header: the shared client must not persist one project's session cookie
+        headers = {"Cookie": f"connect.sid={connect_sid}"} if connect_sid else {}
+        bucket = bucket or TokenBucket(settings.SCRAPBOX_RATE_LIMIT)
+        client = http_clients.get("scrapbox")
+        limit = settings.SCRAPBOX_PAGE_LIST_LIMIT
+
+        pages_list = []
+        skip = 0
+        while True:
+            response = await ScrapboxService._get_with_retry(
+                client, base_url, bucket, headers, params={"skip": skip, "limit": limit}
+            )
             response.raise_for_status()
-            pages_list = response.json()["pages"]
-            
-            # 2. Fetch full content for each page
-            full_pages = []
-            for i, p in enumerate(pages_list):
+            data = response.json()
+            pages = data.get("pages", [])
+            pages_list.extend(pages)
+            skip += len(pages)
+            logger.info(f"Listed {skip}/{data.get('count', '?')} pages of {project_name}")
+            if not pages or skip >= data.get("count", 0):
+                break
+        return pages_list
+
+    @staticmethod
+    async def fetch_project_data(
+        project_name: str,
+        connect_sid: Optional[str] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        known_versions: Optional[Dict[str, int]] = None,
+    ) -> dict:
+        """
+        Fetch all pages from a Scrapbox project via API.
+        Page bodies are fetched by a bounded pool of workers sharing a token-bucket rate limit.
+        `progress(done, total)` is called after each page.
+        Pages whose `updated` matches `known_versions[page_id]` are not fetched; their ids
+        are returned in `unchanged_page_ids`. Pages that could not be fetched (transport
+        errors, or non-200 after retries) are returned in `failed_page_ids`, so callers can
+        keep their indexed content instead of treating them as deleted.
+        """
+        base_url = f"{settings.SCRAPBOX_API_BASE_URL}/pages/{project_name}"
+        # Sent as a header: the shared client must not persist one project's session cookie
+        headers = {"Cookie": f"connect.sid={connect_sid}"} if connect_sid else {}
+        bucket = TokenBucket(settings.SCRAPBOX_RATE_LIMIT)
+        client = http_clients.get("scrapbox")
+
+        # 1. Get page list
+        logger.info(f"Fetching page list for project: {project_name}")
+        pages_list = await ScrapboxService.list_pages(project_name, connect_sid, bucket)
+        unchanged_page_ids = []
+        if known_versions:
+            changed = []
+            for p in pages_list:
+                if p.get("id") in known_versions and p.get("updated") == known_versions[p["id"]]:
+                    unchanged_page_ids.append(p["id"])
+                else:
+                    changed.append(p)
+            logger.info(f"Skipping {len(unchanged_page_ids)} unchanged pages")
+            pages_list = changed
+        total = len(pages_list)
+
+        # 2. Fetch full content for each page
+        full_pages: List[Optional[dict]] = [None] * total
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in enumerate(pages_list):
+            queue.put_nowait(item)
+        done = 0
+        failed_page_ids: List[str] = []
+
+        async def worker():
+            nonlocal done
+            while True:
+                try:
+                    i, p = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
                 page_title = p["title"]
-                logger.info(f"Fetching page ({i+1}/{len(pages_list)}): {page_title}")
-                
                 # Encode title for URL
                 encoded_title = urllib.parse.quote(page_title, safe="")
-                page_res = await client.get(f"{base_url}/{encoded_title}", cookies=cookies)
-                
-                if page_res.status_code == 200:
+                try:
+                    page_res = await ScrapboxService._get_with_retry(client, f"{base_url}/{encoded_title}", bucket, headers)
+                except httpx.TransportError as e:
+                    logger.warning(f"Failed to fetch page {page_title}: {e}")
+                    page_res = None
+
+                if page_res is not None and page_res.status_code == 200:
                     page_data = page_res.json()
                     # Convert to our model format (lines is a list of objects in API, but our model expects list[str])
                     lines = [line_obj["text"] for line_obj in page_data.get("lines", [])]
-                    full_pages.append({
+                    full_pages[i] = {
                         "id": page_data["id"],
                         "title": page_data["title"],
                         "updated": page_data["updated"],
                         "lines": lines
-                    })
-                
-            return {
-                "name": project_name,
-                "displayName": project_name,
-                "pages": full_pages
-            }
+                    }
+                else:
+                    if page_res is not None:
+                        logger.warning(f"Skipping page {page_title}: HTTP {page_res.status_code}")
+                    if p.get("id"):
+                        failed_page_ids.append(p["id"])
+
+                done += 1
+                if progress:
+                    progress(done, total)
+                if done % 100 == 0 or done == total:
+                    logger.info(f"Fetched pages: {done}/{total}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(settings.SCRAPBOX_FETCH_CONCURRENCY, total))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+
+        return {
+            "name": project_name,
+            "displayName": project_name,
+            "pages": [p for p in full_pages if p is not None],
+            "unchanged_page_ids": unchanged_page_ids,
+            "failed_page_ids": failed_page_ids,
+        }
 
     @staticmethod
     def clean_scrapbox_text(text: str) -> str:
-        # Remove [links], [images.jpg], etc.
-        # Simple regex to remove brackets but keep text
-        text = re.sub(r'\[([^\]]+)\]', r'\1', text)
-        return text.strip()
+        # Remove [links], [images.jpg], etc. but keep their text
+        return clean_line(text)
 
     @staticmethod
-    def chunk_page(page: ScrapboxPage, project_name: str) -> List[ScrapboxChunk]:
-        chunks = []
-        lines = page.lines
-        title = page.title
-        page_url = f"https://scrapbox.io/{project_name}/{title.replace(' ', '_')}"
-        
-        # Simple semantic chunking: grouped by sections or indents
-        current_chunk_text = []
-        max_chunk_length = 500
-        
-        for i, line in enumerate(lines):
-            # Skip empty lines if chunk is empty
-            if not line.strip() and not current_chunk_text:
-                continue
-            
-            clean_line = ScrapboxService.clean_scrapbox_text(line)
-            current_chunk_text.append(clean_line)
-            
-            # If current chunk is long enough or we see a potential break
-            if sum(len(l) for l in current_chunk_text) > max_chunk_length:
-                text = "\n".join(current_chunk_text)
-                chunks.append(ScrapboxChunk(
-                    id=f"{page.id}_{len(chunks)}",
-                    page_id=page.id,
-                    title=title,
-                    text=text,
-                    url=page_url,
-                    updated=page.updated
-                ))
-                current_chunk_text = []
-
-        # Add remaining text as a chunk
-        if current_chunk_text:
-            text = "\n".join(current_chunk_text)
-            chunks.append(ScrapboxChunk(
-                id=f"{page.id}_{len(chunks)}",
+    def chunk_page(page: ScrapboxPage, project_name: str, chunker: Optional[Chunker] = None) -> List[ScrapboxChunk]:
+        """Splits a page into token-bounded, structure-aware chunks (see Chunker)."""
+        page_url = f"https://scrapbox.io/{project_name}/{page.title.replace(' ', '_')}"
+        texts = (chunker or Chunker()).split(page.title, page.lines)
+        return [
+            ScrapboxChunk(
+                id=f"{page.id}_{i}",
                 page_id=page.id,
-                title=title,
+                project=project_name,
+                title=page.title,
                 text=text,
                 url=page_url,
                 updated=page.updated
-            ))
-            
-        return chunks
+            )
+            for i, text in enumerate(texts)
+        ]
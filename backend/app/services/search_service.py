@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import SEARCH_DEGRADED
+from app.services.encoder_service import EncoderService
+from app.services.elasticsearch_service import ElasticsearchService
+from loguru import logger
+
+class RetrievalError(Exception):
+    """A retrieval stage failed; `str(e)` is the message returned to clients."""
+
+    def __init__(self, stage: str, cause: Exception):
+        self.stage = stage
+        self.cause = cause
+        super().__init__(f"{stage} error: {cause}")
+
+class SearchService:
+    @staticmethod
+    async def encode_query(query: str, mode: str, fallback: bool = True) -> Optional[Dict[str, float]]:
+        """
+        Encodes the query for SPLADE retrieval. Returns None when the encoder is slow or down
+        and both `fallback` and SEARCH_BM25_FALLBACK allow continuing with BM25 only.
+        """
+        if mode == "bm25":
+            return None
+        if not (fallback and settings.SEARCH_BM25_FALLBACK):
+            try:
+                return await EncoderService.encode_query(query)
+            except Exception as e:
+                raise RetrievalError("Encoder", e)
+        try:
+            return await asyncio.wait_for(
+                EncoderService.encode_query(query), timeout=settings.SEARCH_ENCODER_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Encoder unavailable ({e!r}), falling back to BM25")
+            SEARCH_DEGRADED.inc(failed="encoder")
+            return None
+
+    @staticmethod
+    async def retrieve(
+        es_service: ElasticsearchService,
+        query: str,
+        top_k: int = 5,
+        mode: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, float]]]:
+        """Returns the retrieved contexts and the query vector (None when BM25 only)."""
+        # An explicit "splade" request fails rather than silently returning BM25 results
+        fallback = mode in (None, "hybrid")
+        mode = mode or settings.SEARCH_MODE
+        query_vector = await SearchService.encode_query(query, mode, fallback)
+        try:
+            if query_vector is None:
+                contexts = await es_service.search_bm25(query, top_k=top_k)
+            elif mode == "hybrid":
+                contexts = await es_service.search_hybrid(query, query_vector, top_k=top_k)
+            else:
+                contexts = await es_service.search(query_vector, top_k=top_k)
+        except Exception as e:
+            raise RetrievalError("Search", e)
+        return contexts, query_vector
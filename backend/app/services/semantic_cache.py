@@ -0,0 +1,103 @@
+import math
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.core.config import settings
+
+# Query tokens (by weight) used to look up candidate entries in the inverted index
+LOOKUP_TOKENS = 32
+
+class SemanticAnswerCache:
+    """
+    Answers of recently answered queries, matched by cosine similarity between SPLADE
+    query vectors instead of exact text. An inverted index from token id to entries
+    limits the comparison to queries sharing heavy tokens. A hit also requires the new
+    query to have retrieved the same top documents (same chunk ids and `updated`), so a
+    paraphrase never gets an answer grounded in different or stale sources.
+    """
+
+    def __init__(self, maxsize: int = 1000, threshold: float = 0.9, top_docs: int = 3):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.top_docs = top_docs
+        self._entries: "OrderedDict[int, Tuple[Dict[str, float], frozenset, List[str]]]" = OrderedDict()
+        self._postings: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector: Dict[str, float]) -> Dict[str, float]:
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {t: w / norm for t, w in vector.items()} if norm > 0 else {}
+
+    def _doc_key(self, contexts: List[Dict[str, Any]]) -> frozenset:
+        return frozenset((ctx.get("id") or ctx.get("url"), ctx.get("updated")) for ctx in contexts[:self.top_docs])
+
+    def get(self, query_vector: Dict[str, float], contexts: List[Dict[str, Any]]) -> Optional[List[str]]:
+        vector = self._normalize(query_vector)
+        doc_key = self._doc_key(contexts)
+        lookup = sorted(vector, key=vector.get, reverse=True)[:LOOKUP_TOKENS]
+        candidates: Set[int] = set()
+        for token in lookup:
+            candidates |= self._postings.get(token, set())
+
+        best_id, best_score = None, self.threshold
+        for entry_id in candidates:
+            entry_vector, entry_docs, _ = self._entries[entry_id]
+            if entry_docs != doc_key:
+                continue
+            score = sum(w * entry_vector.get(t, 0.0) for t, w in vector.items())
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        return self._entries[best_id][2]
+
+    def set(self, query_vector: Dict[str, float], contexts: List[Dict[str, Any]], tokens: List[str]):
+        vector = self._normalize(query_vector)
+        if not vector:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (vector, self._doc_key(contexts), tokens)
+        for token in vector:
+            self._postings.setdefault(token, set()).add(entry_id)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        vector, _, _ = self._entries.pop(entry_id)
+        for token in vector:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.discard(entry_id)
+                if not postings:
+                    del self._postings[token]
+
+    def clear(self):
+        self._entries.clear()
+        self._postings.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": settings.SEMANTIC_CACHE_ENABLED,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+semantic_cache = SemanticAnswerCache(
+    settings.SEMANTIC_CACHE_SIZE,
+    settings.SEMANTIC_CACHE_THRESHOLD,
+    settings.SEMANTIC_CACHE_TOP_DOCS,
+)
@@ -0,0 +1,55 @@
+from typing import Dict, Optional
+from pydantic import BaseModel
+from app.core.config import settings
+
+class PruningConfig(BaseModel):
+    """
+    Sparse vector pruning thresholds. Tokens below `min_weight` are dropped, then the
+    vector is cut to the heaviest `top_k` tokens and/or to the fewest tokens covering
+    `mass` (0-1) of the total weight, whichever keeps fewer.
+    """
+    top_k: Optional[int] = None
+    mass: Optional[float] = None
+    min_weight: float = 0.0
+
+    @classmethod
+    def for_query(cls) -> "PruningConfig":
+        return cls(
+            top_k=settings.QUERY_PRUNE_TOP_K,
+            mass=settings.QUERY_PRUNE_MASS,
+            min_weight=settings.QUERY_PRUNE_MIN_WEIGHT,
+        )
+
+    @classmethod
+    def for_document(cls) -> "PruningConfig":
+        return cls(
+            top_k=settings.DOC_PRUNE_TOP_K,
+            mass=settings.DOC_PRUNE_MASS,
+            min_weight=settings.DOC_PRUNE_MIN_WEIGHT,
+        )
+
+    @property
+    def is_noop(self) -> bool:
+        return self.top_k is None and self.mass is None and self.min_weight <= 0
+
+def prune_sparse_vector(vector: Dict[str, float], config: PruningConfig) -> Dict[str, float]:
+    if config.is_noop or not vector:
+        return vector
+
+    total = sum(vector.values())
+    items = sorted(
+        ((token, weight) for token, weight in vector.items() if weight >= config.min_weight),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    keep = len(items)
+    if config.top_k is not None:
+        keep = min(keep, config.top_k)
+    if config.mass is not None and total > 0:
+        covered = 0.0
+        for i, (_, weight) in enumerate(items):
+            covered += weight
+            if covered >= config.mass * total:
+                keep = min(keep, i + 1)
+                break
+    return dict(items[:keep])
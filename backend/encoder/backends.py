@@ -0,0 +1,234 @@
+import abc
+import os
+from typing import Dict, List, Optional, Tuple
+import torch
+from transformers import AutoModelForMaskedLM, AutoTokenizer, BatchEncoding
+
+# "torch": eager PyTorch (float32), "torch-int8": PyTorch with int8 dynamically quantized Linear layers,
+# "onnx": exported ONNX Runtime model, "onnx-int8": the same model dynamically quantized to int8
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# One sparse vector as (token ids, weights) tensors
+SparseRow = Tuple[torch.Tensor, torch.Tensor]
+
+
+def configure_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None):
+    """Sets PyTorch's thread pools; must run before the first forward pass."""
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # Only settable once, before any inter-op parallel work has started
+            pass
+
+
+def splade_weights(logits: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """SPLADE max-pooling over log(1 + ReLU(logits)); returns one vocabulary-sized row per text."""
+    weights = torch.log1p(torch.relu(logits))
+    # Padding positions must not contribute to the max-pooling
+    weights = weights * attention_mask.unsqueeze(-1).to(weights.dtype)
+    return torch.max(weights, dim=1).values
+
+
+def pool_windows(weights: torch.Tensor, owners: torch.Tensor, n: int) -> torch.Tensor:
+    """Max-pools window rows into one row per text; `owners[i]` is the text of window `i`."""
+    # SPLADE weights are >= 0, so zero-initialized rows leave the window maxima unchanged
+    pooled = torch.zeros(n, weights.shape[1], dtype=weights.dtype)
+    return pooled.scatter_reduce_(0, owners.unsqueeze(1).expand_as(weights), weights, "amax")
+
+
+def sparsify(weights: torch.Tensor, threshold: float = 0.01, top_k: Optional[int] = None) -> List[SparseRow]:
+    """
+    Selects the weights above `threshold` (at most the `top_k` largest per row) with tensor ops,
+    so only the surviving (id, weight) pairs are materialized instead of the whole vocabulary.
+    """
+    weights = weights.float().cpu()
+    if top_k and top_k < weights.shape[1]:
+        values, indices = weights.topk(top_k, dim=1)
+        keep = values > threshold
+        return [(indices[i][keep[i]], values[i][keep[i]]) for i in range(weights.shape[0])]
+    keep = weights > threshold
+    rows, cols = keep.nonzero(as_tuple=True)
+    counts = keep.sum(dim=1).tolist()
+    return list(zip(cols.split(counts), weights[rows, cols].split(counts)))
+
+
+def to_dict(row: SparseRow) -> Dict[str, float]:
+    # Elasticsearch rank_features needs string keys, so token ids are sent as strings
+    indices, values = row
+    return dict(zip(map(str, indices.tolist()), values.tolist()))
+
+
+class SpladeBackend(abc.ABC):
+    """Tokenizer plus a masked-LM runtime; subclasses provide `logits` for a tokenized batch."""
+
+    name = ""
+    threshold = 0.01
+    top_k: Optional[int] = None
+    # Sliding windows over long texts: tokens per window (special tokens included),
+    # tokens shared by consecutive windows, and windows per text (None = unlimited)
+    window_size = 512
+    stride = 64
+    max_windows: Optional[int] = 8
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        # Special tokens around every window, e.g. [CLS] ... [SEP] for BERT models
+        specials = self.tokenizer("")["input_ids"]
+        self.prefix, self.suffix = specials[:1], specials[1:]
+
+    @abc.abstractmethod
+    def logits(self, tokens) -> torch.Tensor:
+        """MLM logits of a tokenized batch, shaped (batch, sequence, vocabulary)."""
+
+    def windows(self, texts: List[str]) -> Tuple[BatchEncoding, torch.Tensor]:
+        """
+        Splits each text into overlapping token windows of at most `window_size` tokens,
+        so texts beyond the model's position limit are covered instead of failing.
+        Returns the padded windows and the index of the text each window belongs to.
+        """
+        size = min(self.window_size, self.tokenizer.model_max_length) - len(self.prefix) - len(self.suffix)
+        step = max(size - self.stride, 1)
+        windows, owners = [], []
+        for i, ids in enumerate(self.tokenizer(texts, add_special_tokens=False)["input_ids"]):
+            starts = range(0, max(len(ids) - self.stride, 1), step)
+            # Text beyond max_windows is truncated to keep per-request compute bounded
+            for start in starts[:self.max_windows]:
+                windows.append(self.prefix + ids[start:start + size] + self.suffix)
+                owners.append(i)
+
+        length = max(len(w) for w in windows)
+        pad = self.tokenizer.pad_token_id or 0
+        input_ids = torch.tensor([w + [pad] * (length - len(w)) for w in windows])
+        attention_mask = torch.tensor([[1] * len(w) + [0] * (length - len(w)) for w in windows])
+        tokens = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            tokens["token_type_ids"] = torch.zeros_like(input_ids)
+        return BatchEncoding(tokens), torch.tensor(owners)
+
+    def encode_sparse(self, texts: List[str]) -> List[SparseRow]:
+        """
+        Runs one padded forward pass over the windows of all `texts` and returns one
+        sparse vector per text, max-pooled across its windows.
+        """
+        tokens, owners = self.windows(texts)
+        weights = splade_weights(self.logits(tokens), tokens["attention_mask"])
+        return sparsify(pool_windows(weights.float().cpu(), owners, len(texts)), self.threshold, self.top_k)
+
+    def encode(self, texts: List[str]) -> List[Dict[str, float]]:
+        return [to_dict(row) for row in self.encode_sparse(texts)]
+
+
+class TorchBackend(SpladeBackend):
+    def __init__(self, model_id: str, device: str = "cpu", quantize: bool = False, inference_mode: bool = True):
+        super().__init__(model_id)
+        self.name = "torch-int8" if quantize else "torch"
+        self.device = device
+        self.inference_mode = inference_mode
+        model = AutoModelForMaskedLM.from_pretrained(model_id).eval()
+        if quantize:
+            # int8 weights for Linear layers, activations quantized on the fly (CPU only)
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.device = "cpu"
+        self.model = model.to(self.device)
+
+    def logits(self, tokens) -> torch.Tensor:
+        # inference_mode also skips version counting and view tracking, unlike no_grad
+        context = torch.inference_mode() if self.inference_mode else torch.no_grad()
+        with context:
+            return self.model(**tokens.to(self.device)).logits
+
+
+def export_onnx(model_id: str, path: str):
+    """Exports the masked-LM to ONNX with dynamic batch and sequence axes."""
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForMaskedLM.from_pretrained(model_id).eval()
+    # A padded batch, so the traced graph handles padding masks
+    sample = tokenizer(["sample text", "a somewhat longer sample text"], return_tensors="pt", padding=True)
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    axes = {0: "batch", 1: "sequence"}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.onnx.export(
+        model,
+        tuple(sample[name] for name in input_names),
+        path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes={**{name: axes for name in input_names}, "logits": axes},
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+class OnnxBackend(SpladeBackend):
+    def __init__(
+        self,
+        model_id: str,
+        path: str,
+        quantize: bool = False,
+        intra_op: Optional[int] = None,
+        inter_op: Optional[int] = None,
+    ):
+        # Optional dependency: pip install onnxruntime onnx
+        import onnxruntime as ort
+
+        super().__init__(model_id)
+        self.name = "onnx-int8" if quantize else "onnx"
+        if not os.path.exists(path):
+            export_onnx(model_id, path)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantized = path.replace(".onnx", "") + ".int8.onnx"
+            if not os.path.exists(quantized):
+                quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+            path = quantized
+
+        options = ort.SessionOptions()
+        if intra_op:
+            options.intra_op_num_threads = intra_op
+        if inter_op:
+            options.inter_op_num_threads = inter_op
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def logits(self, tokens) -> torch.Tensor:
+        feeds = {name: tokens[name].numpy() for name in self.input_names}
+        return torch.from_numpy(self.session.run(["logits"], feeds)[0])
+
+
+def load_backend(
+    name: str,
+    model_id: str,
+    device: str = "cpu",
+    onnx_path: Optional[str] = None,
+    intra_op: Optional[int] = None,
+    inter_op: Optional[int] = None,
+    inference_mode: bool = True,
+    threshold: float = 0.01,
+    top_k: Optional[int] = None,
+    window_size: int = 512,
+    stride: int = 64,
+    max_windows: Optional[int] = 8,
+) -> SpladeBackend:
+    if not 0 <= stride < window_size:
+        raise ValueError(f"Window stride {stride} must be smaller than the window size {window_size}")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {name!r}, expected one of {BACKENDS}")
+    if name.startswith("onnx"):
+        path = onnx_path or os.path.join(".cache", "onnx", model_id.replace("/", "--"), "model.onnx")
+        backend: SpladeBackend = OnnxBackend(
+            model_id, path, quantize=name == "onnx-int8", intra_op=intra_op, inter_op=inter_op
+        )
+    else:
+        configure_threads(intra_op, inter_op)
+        backend = TorchBackend(model_id, device=device, quantize=name == "torch-int8", inference_mode=inference_mode)
+    backend.threshold = threshold
+    backend.top_k = top_k
+    backend.window_size = window_size
+    backend.stride = stride
+    backend.max_windows = max_windows
+    return backend
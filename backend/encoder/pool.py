@@ -0,0 +1,268 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import torch
+from encoder.backends import SparseRow, load_backend
+
+# Seconds the result reader waits before picking up restarted workers or noticing a stop
+POLL_INTERVAL = 0.5
+
+
+def worker_main(name: str, model_id: str, options: Dict[str, Any], conn: Connection):
+    """
+    Entry point of a worker process: loads one model replica and encodes the batches
+    received on `conn` until it receives None. Rows are sent back as numpy arrays,
+    which pickle without torch's shared-memory machinery.
+    """
+    try:
+        backend = load_backend(name, model_id, **options)
+    except Exception as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", None))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        job_id, texts = job
+        start = time.monotonic()
+        rows, error = None, None
+        try:
+            rows = [(indices.numpy(), values.numpy()) for indices, values in backend.encode_sparse(texts)]
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        conn.send(("done", (job_id, rows, error, time.monotonic() - start)))
+
+
+class Worker:
+    def __init__(self, process: mp.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.exited = False
+        self.error: Optional[str] = None
+        self.job: Optional[int] = None
+        self.jobs = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    @property
+    def idle(self) -> bool:
+        return self.ready and not self.exited and self.job is None
+
+    def stats(self, worker_id: int) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.started_at
+        return {
+            "id": worker_id,
+            "pid": self.process.pid,
+            "alive": not self.exited,
+            "ready": self.ready,
+            "busy": self.job is not None,
+            "jobs": self.jobs,
+            "utilization": round(self.busy_seconds / uptime, 3) if uptime > 0 else 0.0,
+            "error": self.error,
+        }
+
+
+class WorkerPool:
+    """
+    Runs `size` model replicas in separate processes behind one asyncio front.
+    Submitted batches wait in a FIFO queue and are dispatched to idle workers over a
+    pipe per worker; a reader thread waits on the pipes and the process sentinels and
+    hands results and exits back to the event loop. Each replica gets `threads`
+    intra-op threads so the replicas together use the machine without oversubscribing it.
+    A worker that dies is restarted and the batch it was running fails. A worker that
+    cannot load the model is not restarted; once every worker has failed, queued and new
+    batches fail immediately with the load error.
+    """
+
+    def __init__(self, size: int, backend: str, model_id: str, options: Dict[str, Any], threads: Optional[int] = None):
+        self.size = size
+        self.backend = backend
+        self.model_id = model_id
+        self.threads = threads or max(1, (mp.cpu_count() or 1) // size)
+        self.options = {**options, "intra_op": self.threads}
+        self.workers: Dict[int, Worker] = {}
+        self._queue: Deque[Tuple[int, List[str]]] = deque()
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._stopping = False
+        self._ctx = mp.get_context("spawn")
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        self._reader = threading.Thread(target=self._read, name="encoder-pool-reader", daemon=True)
+        self._reader.start()
+
+    def _spawn(self, worker_id: int):
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(self.backend, self.model_id, self.options, child_conn),
+            name=f"encoder-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.workers[worker_id] = Worker(process, conn)
+
+    async def stop(self):
+        self._stopping = True
+        for worker in self.workers.values():
+            if not worker.exited:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        await asyncio.to_thread(self._join)
+        await asyncio.to_thread(self._reader.join)
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Encoder worker pool stopped"))
+        self._futures.clear()
+        self._queue.clear()
+
+    def _join(self, timeout: float = 10.0):
+        for worker in self.workers.values():
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    async def submit(self, texts: List[str]) -> List[SparseRow]:
+        """Encodes one batch on the next idle worker."""
+        error = self.failed
+        if error is not None:
+            raise RuntimeError(error)
+        job_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[job_id] = future
+        self._queue.append((job_id, texts))
+        self._dispatch()
+        try:
+            rows = await future
+        finally:
+            self._futures.pop(job_id, None)
+        return [(torch.from_numpy(indices), torch.from_numpy(values)) for indices, values in rows]
+
+    def _dispatch(self):
+        for worker in self.workers.values():
+            while worker.idle and self._queue:
+                job_id, texts = self._queue.popleft()
+                # The submitter went away while the batch was queued
+                if job_id not in self._futures:
+                    continue
+                try:
+                    worker.conn.send((job_id, texts))
+                except OSError:
+                    # The worker just died; the batch goes to the next one and _on_exit restarts it
+                    worker.exited = True
+                    self._queue.appendleft((job_id, texts))
+                    break
+                worker.job = job_id
+
+    def _read(self):
+        """Reader thread: forwards worker messages and exits to the event loop."""
+        seen_exits = set()
+        while not self._stopping:
+            objects = {}
+            for worker_id, worker in list(self.workers.items()):
+                if worker.process.sentinel not in seen_exits:
+                    objects[worker.conn] = (worker_id, worker)
+                    objects[worker.process.sentinel] = (worker_id, worker)
+            for ready in wait(list(objects), timeout=POLL_INTERVAL):
+                worker_id, worker = objects[ready]
+                if ready is worker.conn:
+                    try:
+                        message = worker.conn.recv()
+                    except (EOFError, OSError):
+                        continue
+                    self._loop.call_soon_threadsafe(self._handle, worker, *message)
+                elif ready not in seen_exits:
+                    seen_exits.add(ready)
+                    # Deliver what the worker sent before exiting, then release the pipe
+                    while worker.conn.poll():
+                        try:
+                            self._loop.call_soon_threadsafe(self._handle, worker, *worker.conn.recv())
+                        except (EOFError, OSError):
+                            break
+                    worker.conn.close()
+                    self._loop.call_soon_threadsafe(self._on_exit, worker_id, worker)
+
+    def _handle(self, worker: Worker, kind: str, payload: Any):
+        if kind == "ready":
+            worker.ready = True
+            worker.started_at = time.monotonic()
+        elif kind == "failed":
+            worker.error = payload
+            self._fail_queued()
+        elif kind == "done":
+            job_id, rows, error, seconds = payload
+            worker.job = None
+            worker.jobs += 1
+            worker.busy_seconds += seconds
+            self._resolve(job_id, rows, error)
+        self._dispatch()
+
+    def _resolve(self, job_id: int, rows: Any, error: Optional[str]):
+        future = self._futures.get(job_id)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(rows)
+
+    def _on_exit(self, worker_id: int, worker: Worker):
+        worker.exited = True
+        if worker.job is not None:
+            self._resolve(worker.job, None, f"Encoder worker {worker_id} died (exit code {worker.process.exitcode})")
+            worker.job = None
+        # Workers that failed to load the model stay down; restarting would fail again
+        if self._stopping or worker.error is not None:
+            self._fail_queued()
+            return
+        self._spawn(worker_id)
+
+    def _fail_queued(self):
+        """Fails every queued batch once no worker is left to run it."""
+        error = self.failed
+        if error is None:
+            return
+        while self._queue:
+            job_id, _ = self._queue.popleft()
+            self._resolve(job_id, None, error)
+
+    @property
+    def failed(self) -> Optional[str]:
+        """The model load error once every worker failed to load it (none is alive or restartable)."""
+        if not self.workers or any(w.error is None for w in self.workers.values()):
+            return None
+        return f"Encoder workers failed to load the model: {next(iter(self.workers.values())).error}"
+
+    @property
+    def queue_depth(self) -> int:
+        """Batches waiting for an idle worker."""
+        return len(self._queue)
+
+    @property
+    def ready(self) -> bool:
+        return any(w.ready and not w.exited for w in self.workers.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [worker.stats(worker_id) for worker_id, worker in sorted(self.workers.items())],
+            "queue_depth": self.queue_depth,
+            "threads_per_worker": self.threads,
+        }
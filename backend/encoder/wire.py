@@ -0,0 +1,43 @@
+from typing import Any, Dict, List, Optional
+import msgpack
+from fastapi.responses import JSONResponse, Response
+from encoder.backends import SparseRow, to_dict
+
+# Response formats negotiated with the Accept header:
+# - JSON {token_id: weight} (default, understood by every client)
+# - compact JSON {"indices": [...], "values": [...]}
+# - msgpack with little-endian uint32 token ids and float16 weights as raw bytes
+JSON = "application/json"
+COMPACT_JSON = "application/vnd.splade.compact+json"
+MSGPACK = "application/x-msgpack"
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Picks the first supported media type listed in `accept`, falling back to JSON."""
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip()
+        if media_type in (COMPACT_JSON, MSGPACK):
+            return media_type
+    return JSON
+
+
+def encode_row(row: SparseRow, media_type: str) -> Any:
+    indices, values = row
+    if media_type == MSGPACK:
+        return {
+            "indices": indices.numpy().astype("<u4").tobytes(),
+            "values": values.numpy().astype("<f2").tobytes(),
+        }
+    if media_type == COMPACT_JSON:
+        return {"indices": indices.tolist(), "values": values.tolist()}
+    return to_dict(row)
+
+
+def encode_rows(rows: List[SparseRow], media_type: str) -> List[Any]:
+    return [encode_row(row, media_type) for row in rows]
+
+
+def response(payload: Dict[str, Any], media_type: str) -> Response:
+    if media_type == MSGPACK:
+        return Response(msgpack.packb(payload, use_bin_type=True), media_type=MSGPACK)
+    return JSONResponse(payload, media_type=media_type)
@@ -1,48 +1,228 @@
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import torch
-from transformers import AutoModelForMaskedLM, AutoTokenizer
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
 import os
-
-app = FastAPI()
+from encoder.backends import SparseRow, load_backend
+from encoder import wire
+from encoder.pool import WorkerPool
 
 # Model for SPLADE
 # Using a Japanese-optimized SPLADE model for better Scrapbox search results
-MODEL_ID = "hotchpotch/japanese-splade-v2"
+# SPLADE_MODEL_ID is shared with the API, whose embedding cache is keyed on it
+MODEL_ID = os.getenv("SPLADE_MODEL_ID", "hotchpotch/japanese-splade-v2")
+
+# Dynamic micro-batching: concurrent /encode calls are merged into one forward pass
+MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+
+# Inference backend: "torch" (eager float32), "torch-int8", "onnx" or "onnx-int8" (CPU).
+# ONNX backends export the model to ENCODER_ONNX_PATH on first start (needs onnxruntime and onnx).
+BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ONNX_PATH = os.getenv("ENCODER_ONNX_PATH") or None
+# Thread pools of the CPU runtime (unset = runtime defaults, usually one thread per core)
+INTRA_OP_THREADS = int(os.getenv("ENCODER_INTRA_OP_THREADS", "0")) or None
+INTER_OP_THREADS = int(os.getenv("ENCODER_INTER_OP_THREADS", "0")) or None
+INFERENCE_MODE = os.getenv("ENCODER_INFERENCE_MODE", "1") == "1"
+# Weights at or below THRESHOLD are dropped; TOP_K (0 = unlimited) caps the terms per vector
+THRESHOLD = float(os.getenv("ENCODER_THRESHOLD", "0.01"))
+TOP_K = int(os.getenv("ENCODER_TOP_K", "0")) or None
+# Long texts are encoded as overlapping windows of WINDOW_SIZE tokens (capped at the model limit)
+# sharing WINDOW_STRIDE tokens, max-pooled into one vector; tokens beyond MAX_WINDOWS windows
+# (0 = unlimited) are dropped. MAX_WINDOWS=1 is plain truncation.
+WINDOW_SIZE = int(os.getenv("ENCODER_WINDOW_SIZE", "512"))
+WINDOW_STRIDE = int(os.getenv("ENCODER_WINDOW_STRIDE", "64"))
+MAX_WINDOWS = int(os.getenv("ENCODER_MAX_WINDOWS", "8")) or None
+# Worker-pool mode: WORKERS > 0 runs that many model replicas in separate processes, each with
+# ENCODER_INTRA_OP_THREADS threads (default: CPU cores / WORKERS); 0 runs the model in-process
+WORKERS = int(os.getenv("ENCODER_WORKERS", "0"))
 
 device = "mps" if torch.backends.mps.is_available() else "cpu"
-print(f"Using device: {device}")
+print(f"Using device: {device}, backend: {BACKEND}")
+
+BACKEND_OPTIONS = dict(
+    device=device,
+    onnx_path=ONNX_PATH,
+    intra_op=INTRA_OP_THREADS,
+    inter_op=INTER_OP_THREADS,
+    inference_mode=INFERENCE_MODE,
+    threshold=THRESHOLD,
+    top_k=TOP_K,
+    window_size=WINDOW_SIZE,
+    stride=WINDOW_STRIDE,
+    max_windows=MAX_WINDOWS,
+)
+
+# In pool mode the front process only does HTTP and batching; the replicas load the model
+pool = WorkerPool(WORKERS, BACKEND, MODEL_ID, BACKEND_OPTIONS, threads=INTRA_OP_THREADS) if WORKERS else None
+backend = None if pool else load_backend(BACKEND, MODEL_ID, **BACKEND_OPTIONS)
+
+
+def encode_texts(texts: List[str]) -> List[SparseRow]:
+    """Runs one padded forward pass over `texts` and returns one sparse vector per text."""
+    return backend.encode_sparse(texts)
+
+
+async def encode_batch_async(texts: List[str]) -> List[SparseRow]:
+    """Encodes one batch on a pool worker, or in a thread so the event loop keeps accepting requests."""
+    if pool:
+        return await pool.submit(texts)
+    return await asyncio.to_thread(encode_texts, texts)
+
+
+def length_batches(texts: List[str], batch_size: int = MAX_BATCH_SIZE) -> List[List[int]]:
+    """Groups text indices into batches of similar length to minimize padding."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+async def encode_sorted(texts: List[str], batch_size: int = MAX_BATCH_SIZE) -> List[SparseRow]:
+    """
+    Encodes texts in length-sorted batches, preserving input order. In pool mode the
+    batches run concurrently on the workers; otherwise one after another.
+    """
+    batches = length_batches(texts, batch_size)
+    if pool:
+        results = await asyncio.gather(*(pool.submit([texts[i] for i in ids]) for ids in batches))
+    else:
+        results = [await encode_batch_async([texts[i] for i in ids]) for ids in batches]
+    vectors: List[Optional[SparseRow]] = [None] * len(texts)
+    for ids, rows in zip(batches, results):
+        for i, vector in zip(ids, rows):
+            vectors[i] = vector
+    return vectors
+
+
+class MicroBatcher:
+    """
+    Collects single-text requests into micro-batches.
+    A batch is flushed when it reaches `max_batch_size` or when the oldest
+    request has waited `max_wait_ms`, whichever comes first. Up to `concurrency`
+    batches are encoded at once (one per pool worker); while all are busy, requests
+    keep queueing and go out together in the next batch.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS, concurrency: int = 1):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._flushes = set()
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
-model = AutoModelForMaskedLM.from_pretrained(MODEL_ID).to(device)
+    def start(self):
+        self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._task, *self._flushes]:
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._flushes.clear()
+
+    async def submit(self, text: str) -> SparseRow:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            batch = await self._collect()
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            vectors = await encode_batch_async([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+batcher = MicroBatcher(concurrency=max(WORKERS, 1))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if pool:
+        pool.start()
+    batcher.start()
+    yield
+    await batcher.stop()
+    if pool:
+        await pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 class EncodeRequest(BaseModel):
     text: str
 
+class EncodeBatchRequest(BaseModel):
+    texts: List[str]
+
+# The response format follows the Accept header (see encoder/wire.py); JSON by default
+
 @app.post("/encode")
-async def encode(request: EncodeRequest):
-    tokens = tokenizer(request.text, return_tensors="pt").to(device)
-    
-    with torch.no_grad():
-        output = model(**tokens)
-    
-    # SPLADE logic: max-pooling over log(1 + ReLU(logits))
-    logits = output.logits
-    weights = torch.log(1 + torch.relu(logits))
-    weights = torch.max(weights, dim=1).values.squeeze()
-    
-    # Filter non-zero weights
-    cols = weights.nonzero().squeeze().cpu().tolist()
-    if isinstance(cols, int): cols = [cols]
-    
-    weights = weights.cpu().tolist()
-    
-    # Map token IDs to strings for better readability/debugging if needed,
-    # or just keep as IDs. Elasticsearch rank_features needs string keys.
-    result = {str(i): weights[i] for i in cols if weights[i] > 0.01}
-    
-    return {"vector": result}
+async def encode(request: EncodeRequest, accept: Optional[str] = Header(None)):
+    media_type = wire.negotiate(accept)
+    vector = await batcher.submit(request.text)
+    return wire.response({"vector": wire.encode_row(vector, media_type)}, media_type)
+
+@app.post("/encode_batch")
+async def encode_batch(request: EncodeBatchRequest, accept: Optional[str] = Header(None)):
+    media_type = wire.negotiate(accept)
+    vectors = await encode_sorted(request.texts)
+    return wire.response({"vectors": wire.encode_rows(vectors, media_type)}, media_type)
+
+@app.get("/health")
+async def health():
+    """
+    Readiness and load: 503 until a model replica can serve requests. `pending` counts
+    /encode requests waiting for a micro-batch, `queue_depth` batches waiting for a worker.
+    """
+    ready = pool.ready if pool else backend is not None
+    body = {
+        "status": "ready" if ready else "starting",
+        "mode": "pool" if pool else "single",
+        "backend": BACKEND,
+        "pending": batcher.queue.qsize() if batcher.queue else 0,
+    }
+    body.update(pool.stats() if pool else {"queue_depth": 0, "workers": []})
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 if __name__ == "__main__":
     import uvicorn
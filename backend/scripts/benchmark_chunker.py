@@ -0,0 +1,106 @@
+import sys
+import time
+import random
+import argparse
+import statistics
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+# Add app directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.chunker import Chunker, clean_line
+from app.services.context_packer import estimate_tokens
+from loguru import logger
+
+WORDS = ["設定", "手順", "サーバー", "ログ", "確認", "エラー", "会議", "議事録", "deploy", "cache", "release", "VPN"]
+CODE = ["def handler(event):", "    items = event['items']", "    return [i['id'] for i in items]", "curl -s http://localhost:9200/_cat/indices"]
+
+def sentence(rng: random.Random, words: int) -> str:
+    return "".join(rng.choice(WORDS) + rng.choice(["", "の", "を", "は", " ", "、"]) for _ in range(words)) + "。"
+
+def synthetic_page(rng: random.Random, i: int) -> Dict:
+    """A page mixing paragraphs, headings, nested lists, code blocks, tables and long pasted lines."""
+    title = f"ページ{i} {rng.choice(WORDS)}"
+    lines = [title]
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.random()
+        if kind < 0.15:
+            lines.append(f"[* {sentence(rng, 2)}]")
+        elif kind < 0.45:
+            lines.append(sentence(rng, rng.randint(3, 15)))
+            lines.extend(" " * rng.randint(1, 3) + sentence(rng, rng.randint(2, 8)) for _ in range(rng.randint(0, 6)))
+        elif kind < 0.6:
+            lines.append("code:example.py")
+            lines.extend(" " + rng.choice(CODE) for _ in range(rng.randint(2, 30)))
+        elif kind < 0.7:
+            lines.append("table:一覧")
+            lines.extend(f" {rng.choice(WORDS)}\t{rng.randint(1, 999)}\t[{rng.choice(WORDS)}]" for _ in range(rng.randint(2, 20)))
+        elif kind < 0.75:
+            # Pasted logs or minified text on a single line
+            lines.append(" ".join(rng.choice(CODE) for _ in range(rng.randint(20, 120))))
+        else:
+            lines.append(f"[{rng.choice(WORDS)}] と [{rng.choice(WORDS)}] を参照")
+        lines.append("")
+    return {"title": title, "lines": lines}
+
+def synthetic_project(pages: int, seed: int) -> Iterator[Dict]:
+    rng = random.Random(seed)
+    return (synthetic_page(rng, i) for i in range(pages))
+
+def legacy_chunks(title: str, lines: List[str], max_chunk_length: int = 500) -> List[str]:
+    """The previous character-based chunk_page, kept here as the baseline."""
+    chunks = []
+    current: List[str] = []
+    for line in lines:
+        if not line.strip() and not current:
+            continue
+        current.append(clean_line(line))
+        if sum(len(l) for l in current) > max_chunk_length:
+            chunks.append("\n".join(current))
+            current = []
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def run(name: str, split: Callable[[str, List[str]], List[str]], pages: int, seed: int, limit: int) -> Dict:
+    tokens: List[int] = []
+    start = time.perf_counter()
+    for page in synthetic_project(pages, seed):
+        chunks = split(page["title"], page["lines"])
+        tokens.extend(estimate_tokens(text) for text in chunks)
+    elapsed = time.perf_counter() - start
+    tokens.sort()
+    return {
+        "chunker": name,
+        "pages_per_s": pages / elapsed,
+        "chunks": len(tokens),
+        "avg_tokens": statistics.mean(tokens),
+        "p95_tokens": tokens[int(len(tokens) * 0.95)],
+        "max_tokens": tokens[-1],
+        # Chunks the encoder cannot see in one window; their tail is truncated or windowed
+        f"over_{limit}": sum(t > limit for t in tokens),
+        "total_tokens": sum(tokens),
+    }
+
+def main(pages: int, seed: int, max_tokens: int, overlap: int, limit: int):
+    chunker = Chunker(max_tokens=max_tokens, overlap_tokens=overlap, counter=None)
+    rows = [
+        run("legacy", legacy_chunks, pages, seed, limit),
+        run("structured", chunker.split, pages, seed, limit),
+    ]
+    print("\t".join(rows[0].keys()))
+    for row in rows:
+        print("\t".join(f"{v:.1f}" if isinstance(v, float) else str(v) for v in row.values()))
+    logger.info(f"Chunked {pages} synthetic pages (seed {seed}) with each chunker; token counts are estimates")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the page chunker against the legacy character-based chunker on a synthetic project")
+    parser.add_argument("--pages", type=int, default=100_000, help="Synthetic pages to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-tokens", type=int, default=None, help="Chunk size (default: CHUNK_MAX_TOKENS)")
+    parser.add_argument("--overlap", type=int, default=None, help="Overlap tokens (default: CHUNK_OVERLAP_TOKENS)")
+    parser.add_argument("--limit", type=int, default=512, help="Encoder window used to count oversized chunks")
+
+    args = parser.parse_args()
+    main(args.pages, args.seed, args.max_tokens, args.overlap, args.limit)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import sys
+import time
+import argparse
+import itertools
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add app directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.encoder_service import EncoderService
+from app.services.elasticsearch_service import ElasticsearchService
+from app.services.sparse_vector import PruningConfig, prune_sparse_vector
+from app.core.http_client import http_clients
+from loguru import logger
+
+def load_queries(path: str) -> List[Dict]:
+    """JSONL, one labeled query per line: {"query": "...", "relevant": ["<page_id>", ...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def recall_at_k(results: List[Dict], relevant: List[str]) -> float:
+    retrieved = {r["page_id"] for r in results}
+    return len(retrieved & set(relevant)) / len(relevant) if relevant else 0.0
+
+async def evaluate(
+    es_service: ElasticsearchService,
+    queries: List[Dict],
+    vectors: List[Dict[str, float]],
+    config: PruningConfig,
+    k: int,
+    repeats: int,
+) -> Dict:
+    recalls, latencies, tokens = [], [], []
+    for item, vector in zip(queries, vectors):
+        tokens.append(len(prune_sparse_vector(vector, config)))
+        for _ in range(repeats):
+            start = time.perf_counter()
+            results = await es_service.search(vector, top_k=k, pruning=config)
+            latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(recall_at_k(results, item["relevant"]))
+    latencies.sort()
+    return {
+        "top_k": config.top_k,
+        "mass": config.mass,
+        "min_weight": config.min_weight,
+        "avg_tokens": float(statistics.mean(tokens)),
+        f"recall@{k}": statistics.mean(recalls),
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+async def run_evaluation(
+    query_path: str,
+    k: int,
+    top_ks: List[Optional[int]],
+    masses: List[Optional[float]],
+    min_weights: List[float],
+    repeats: int,
+):
+    queries = load_queries(query_path)
+    es_service = ElasticsearchService()
+    try:
+        # Queries are encoded once and unpruned; every configuration prunes the same vectors
+        vectors = [await EncoderService.encode(item["query"]) for item in queries]
+        configs = [PruningConfig()] + [
+            PruningConfig(top_k=t, mass=m, min_weight=w)
+            for t, m, w in itertools.product(top_ks, masses, min_weights)
+            if not PruningConfig(top_k=t, mass=m, min_weight=w).is_noop
+        ]
+        rows = [await evaluate(es_service, queries, vectors, config, k, repeats) for config in configs]
+    finally:
+        await es_service.client.close()
+        await http_clients.close()
+
+    baseline = rows[0]
+    columns = list(baseline.keys())
+    print("\t".join(columns + ["recall_delta", "p50_speedup"]))
+    for row in rows:
+        recall_delta = row[f"recall@{k}"] - baseline[f"recall@{k}"]
+        speedup = baseline["p50_ms"] / row["p50_ms"] if row["p50_ms"] else 0.0
+        values = [f"{v:.3f}" if isinstance(v, float) else str(v) for v in row.values()]
+        print("\t".join(values + [f"{recall_delta:+.3f}", f"{speedup:.2f}x"]))
+    logger.info(f"Evaluated {len(configs)} configurations on {len(queries)} queries (first row = unpruned baseline)")
+
+def optional_int(value: str) -> Optional[int]:
+    return None if value.lower() == "none" else int(value)
+
+def optional_float(value: str) -> Optional[float]:
+    return None if value.lower() == "none" else float(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare recall@k and latency of query pruning settings against the unpruned baseline")
+    parser.add_argument("queries", help="JSONL file of {\"query\": ..., \"relevant\": [page_id, ...]}")
+    parser.add_argument("--k", type=int, default=10, help="Cutoff for recall@k")
+    parser.add_argument("--top-k", nargs="+", type=optional_int, default=[None, 32, 64, 128], help="Token top-N values ('none' = no limit)")
+    parser.add_argument("--mass", nargs="+", type=optional_float, default=[None, 0.8, 0.9, 0.95], help="Weight-mass shares ('none' = no limit)")
+    parser.add_argument("--min-weight", nargs="+", type=float, default=[0.0], help="Minimum token weights")
+    parser.add_argument("--repeats", type=int, default=3, help="Searches per query and configuration for latency")
+
+    args = parser.parse_args()
+    asyncio.run(run_evaluation(args.queries, args.k, args.top_k, args.mass, args.min_weight, args.repeats))
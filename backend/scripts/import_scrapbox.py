@@ -1,5 +1,4 @@
 import asyncio
-import json
 import sys
 import os
 import argparse
@@ -10,71 +9,46 @@ from typing import Optional
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.services.scrapbox_service import ScrapboxService
-from app.services.encoder_service import EncoderService
 from app.services.elasticsearch_service import ElasticsearchService
-from app.models.scrapbox import ScrapboxProject
+from app.services.ingestion_service import IngestionService
+from app.core.http_client import http_clients
 from loguru import logger
 
-async def run_import(json_path: str):
+async def run_import(json_path: str, incremental: bool = False):
+    try:
+        await _run_import(json_path, incremental)
+    finally:
+        await http_clients.close()
+
+async def _run_import(json_path: str, incremental: bool = False):
     if not os.path.exists(json_path):
         logger.error(f"File not found: {json_path}")
         return
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    project = ScrapboxProject(**data)
     es_service = ElasticsearchService()
-    await es_service.create_index_if_not_exists()
-
-    all_chunks = []
-    for page in project.pages:
-        chunks = ScrapboxService.chunk_page(page, project.name)
-        all_chunks.extend(chunks)
-
-    logger.info(f"Importing {len(all_chunks)} chunks from {project.name}")
-
-    batch_size = 20
-    for i in range(0, len(all_chunks), batch_size):
-        batch = all_chunks[i:i + batch_size]
-        for chunk in batch:
-            try:
-                chunk.sparse_vector = await EncoderService.encode(chunk.text)
-            except Exception as e:
-                logger.warning(f"Failed to encode chunk {chunk.id}: {e}")
-        await es_service.bulk_index_chunks(batch)
-        logger.info(f"Progress: {i + len(batch)}/{len(all_chunks)}")
+    # Streams pages from the file instead of loading the whole export
+    await IngestionService.ingest_export_file(
+        json_path, es_service, incremental=incremental, project_name=Path(json_path).stem
+    )
 
     logger.info("Import completed successfully!")
 
-async def run_import_api(project_name: str, connect_sid: Optional[str] = None):
+async def run_import_api(project_name: str, connect_sid: Optional[str] = None, incremental: bool = False):
+    try:
+        await _run_import_api(project_name, connect_sid, incremental)
+    finally:
+        await http_clients.close()
+
+async def _run_import_api(project_name: str, connect_sid: Optional[str] = None, incremental: bool = False):
     es_service = ElasticsearchService()
+    known_versions = await IngestionService.known_versions(es_service, project_name) if incremental else None
     try:
-        data = await ScrapboxService.fetch_project_data(project_name, connect_sid)
+        data = await ScrapboxService.fetch_project_data(project_name, connect_sid, known_versions=known_versions)
     except Exception as e:
         logger.error(f"Failed to fetch data from Scrapbox API: {e}")
         return
-    
-    project = ScrapboxProject(**data)
-    await es_service.create_index_if_not_exists()
-
-    all_chunks = []
-    for page in project.pages:
-        chunks = ScrapboxService.chunk_page(page, project.name)
-        all_chunks.extend(chunks)
-
-    logger.info(f"Importing {len(all_chunks)} chunks from API: {project.name}")
 
-    batch_size = 20
-    for i in range(0, len(all_chunks), batch_size):
-        batch = all_chunks[i:i + batch_size]
-        for chunk in batch:
-            try:
-                chunk.sparse_vector = await EncoderService.encode(chunk.text)
-            except Exception as e:
-                logger.warning(f"Failed to encode chunk {chunk.id}: {e}")
-        await es_service.bulk_index_chunks(batch)
-        logger.info(f"Progress: {i + len(batch)}/{len(all_chunks)}")
+    await IngestionService.ingest_project(data, es_service, incremental=incremental)
 
     logger.info("Import completed successfully!")
 
@@ -83,13 +57,14 @@ if __name__ == "__main__":
     parser.add_argument("--json", help="Path to JSON file")
     parser.add_argument("--project", help="Scrapbox project name")
     parser.add_argument("--sid", help="Scrapbox connect.sid cookie for private projects")
+    parser.add_argument("--incremental", action="store_true", help="Only re-encode new or modified pages")
     
     args = parser.parse_args()
     
     if args.json:
-        asyncio.run(run_import(args.json))
+        asyncio.run(run_import(args.json, args.incremental))
     elif args.project:
-        asyncio.run(run_import_api(args.project, args.sid))
+        asyncio.run(run_import_api(args.project, args.sid, args.incremental))
     else:
         parser.print_help()
         sys.exit(1)
@@ -0,0 +1,31 @@
+import asyncio
+import sys
+import argparse
+from pathlib import Path
+from typing import Optional
+
+# Add app directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.elasticsearch_service import ElasticsearchService
+from app.core.config import settings
+from loguru import logger
+
+async def run_migration(source: str, dest: str, alias: Optional[str] = None):
+    es_service = ElasticsearchService()
+    try:
+        await es_service.migrate_to_sparse_vector(source, dest, alias)
+    finally:
+        await es_service.client.close()
+
+    logger.info("Migration completed successfully!")
+    logger.info(f"Set ES_INDEX={alias or dest} and ES_VECTOR_MODE=sparse_vector to search the new index.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reindex a rank_features index into a native sparse_vector index")
+    parser.add_argument("--source", default=settings.ES_INDEX, help="Existing rank_features index")
+    parser.add_argument("--dest", required=True, help="New index to create with the sparse_vector mapping")
+    parser.add_argument("--alias", help="Alias to move from the source to the new index")
+
+    args = parser.parse_args()
+    asyncio.run(run_migration(args.source, args.dest, args.alias))
@@ -0,0 +1,26 @@
+import pytest
+from app.core.config import settings
+from app.core.http_client import http_clients
+from app.services import encoder_service
+from app.services.answer_cache import answer_cache
+from app.services.llm_metrics import llm_metrics
+from app.services.semantic_cache import semantic_cache
+
+@pytest.fixture(autouse=True)
+async def close_http_clients():
+    # Shared clients are bound to the event loop of the test that created them
+    yield
+    await http_clients.close()
+
+@pytest.fixture(autouse=True)
+def embedding_cache_path(tmp_path, monkeypatch):
+    # Each test gets its own embedding cache file instead of the working-directory default
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite3"))
+    monkeypatch.setattr(encoder_service, "_embedding_cache", None)
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    answer_cache.clear()
+    semantic_cache.clear()
+    encoder_service.query_vector_cache.clear()
+    llm_metrics.clear()
@@ -0,0 +1,52 @@
+import time
+from app.core.cache import LRUCache, SQLiteCache, normalize_query
+
+def test_normalize_query():
+    assert normalize_query("  ＶＰＮの  設定\n方法 ") == "vpnの 設定 方法"
+
+def test_lru_cache_eviction_and_counters():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+def test_lru_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    writer = SQLiteCache(path, namespace="q")
+    reader = SQLiteCache(path, namespace="q")
+    writer.set("query", {"1": 0.5})
+
+    assert reader.get("query") == {"1": 0.5}
+    assert reader.get("missing") is None
+    assert reader.stats()["hits"] == 1
+
+def test_sqlite_cache_eviction(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+
+def test_sqlite_cache_exclusive_namespace(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCache(path, namespace="model-a").set("x", 1)
+    cache = SQLiteCache(path, namespace="model-b", exclusive_namespace=True)
+
+    assert SQLiteCache(path, namespace="model-a").get("x") is None
+    assert cache.get("x") is None
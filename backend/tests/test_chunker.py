@@ -0,0 +1,68 @@
+from app.services.chunker import Chunker, split_blocks
+from app.services.context_packer import ContextPacker, estimate_tokens
+
+def chunker(**kwargs):
+    options = {"max_tokens": 40, "overlap_tokens": 8, "min_tokens": 10, "title_prefix": True}
+    return Chunker(**{**options, **kwargs})
+
+def test_title_is_prefixed_once():
+    chunks = chunker().split("VPN 設定", ["VPN 設定", "接続手順です"])
+    assert chunks == ["VPN 設定\n接続手順です"]
+
+def test_title_only_page_keeps_a_chunk():
+    assert chunker().split("空のページ", ["空のページ"]) == ["空のページ"]
+
+def test_chunks_are_bounded_by_tokens():
+    lines = ["あ" * 25, "い" * 30, "x" * 500, "う" * 90, " 子" * 10]
+    for text in chunker().split("T", lines):
+        assert estimate_tokens(text) <= 40
+
+def test_indented_lines_stay_with_their_parent():
+    lines = ["親項目" * 4, " " + "子項目" * 4, "  " + "孫項目" * 4, "次の項目" * 4]
+    blocks = split_blocks(lines)
+    assert [len(b.lines) for b in blocks] == [3, 1]
+    chunks = chunker(max_tokens=45, title_prefix=False).split("T", lines)
+    assert chunks[0] == "\n".join(["親項目" * 4, "子項目" * 4, "孫項目" * 4])
+
+def test_heading_starts_a_new_chunk():
+    lines = ["概要です。" * 3, "[* 手順]", "手順の本文"]
+    chunks = chunker(title_prefix=False).split("T", lines)
+    assert chunks == ["概要です。" * 3, "* 手順\n手順の本文"]
+
+def test_short_section_before_heading_is_not_split_off():
+    chunks = chunker(title_prefix=False).split("T", ["短い", "[* 見出し]", "本文"])
+    assert chunks == ["短い\n* 見出し\n本文"]
+
+def test_code_and_table_blocks_keep_their_content():
+    lines = ["code:main.py", " def f(a):", "  return a[0]", "table:料金", " プラン\t月額", " 基本\t[1000円]", "本文"]
+    blocks = split_blocks(lines)
+    assert blocks[0].lines == ["code:main.py", "def f(a):", " return a[0]"]
+    assert blocks[1].lines == ["table:料金", "プラン | 月額", "基本 | 1000円"]
+    assert blocks[2].lines == ["本文"]
+
+def test_indent_only_lines_stay_inside_code_blocks():
+    lines = ["code:a.py", " def f(x):", "     return [x]", " ", " def g(y):", "     return y[0]", "", "本文"]
+    blocks = split_blocks(lines)
+    assert blocks[0].lines == ["code:a.py", "def f(x):", "    return [x]", "", "def g(y):", "    return y[0]"]
+    assert blocks[1].lines == ["本文"]
+
+def test_size_split_chunks_overlap_and_merge_back():
+    lines = ["行" + "あ" * 5 + str(i) for i in range(12)]
+    chunks = chunker(min_tokens=0).split("T", lines)
+    assert len(chunks) > 1
+    first, second = chunks[0].split("\n"), chunks[1].split("\n")
+    assert first[-1] == second[1]  # the title line, then the repeated line
+
+    contexts = [
+        {"id": f"p_{i}", "page_id": "p", "title": "T", "text": text, "url": "u", "score": 1.0}
+        for i, text in enumerate(chunks)
+    ]
+    merged = ContextPacker.merge(contexts)
+    assert merged[0]["text"] == "\n".join(["T"] + [line.strip() for line in lines])
+
+def test_token_counter_is_pluggable():
+    # Every line counts as 10 tokens
+    chunks = chunker(counter=lambda lines: [10] * len(lines), title_prefix=False, overlap_tokens=0).split(
+        "T", ["a", "b", "c", "d", "e"]
+    )
+    assert chunks == ["a\nb\nc\nd", "e"]
@@ -0,0 +1,56 @@
+from app.services.context_packer import ContextPacker, estimate_tokens, format_context, truncate_to_tokens
+
+def ctx(chunk_id, text, score, title="T"):
+    page_id = chunk_id.rsplit("_", 1)[0]
+    return {"id": chunk_id, "page_id": page_id, "title": title, "text": text, "url": f"http://x/{page_id}", "score": score}
+
+def test_estimate_tokens():
+    assert estimate_tokens("日本語") == 3
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("日本abcd") == 3
+
+def test_truncate_to_tokens():
+    assert truncate_to_tokens("日本語です", 2) == "日本"
+    assert truncate_to_tokens("abc", 10) == "abc"
+
+def test_merges_adjacent_chunks_and_drops_overlap():
+    merged = ContextPacker.merge([
+        ctx("p_1", "line2\nline3", 0.9),
+        ctx("p_0", "line1\nline2", 0.5),
+        ctx("p_3", "line5", 0.4),
+    ])
+    assert [(c["id"], c["text"], c["score"]) for c in merged] == [
+        ("p_0", "line1\nline2\nline3", 0.9),
+        ("p_3", "line5", 0.4),
+    ]
+
+def test_deduplicates_chunks():
+    merged = ContextPacker.merge([
+        ctx("p_0", "shared text", 0.9),
+        ctx("p_0", "shared text", 0.9),
+        ctx("p_5", "shared", 0.3),
+        ctx("q_0", "shared text", 0.2),
+    ])
+    # Containment only deduplicates within a page
+    assert [c["id"] for c in merged] == ["p_0", "q_0"]
+
+def test_pack_fills_budget_in_score_order():
+    contexts = [ctx("a_0", "あ" * 100, 0.2), ctx("b_0", "い" * 100, 0.9), ctx("c_0", "う" * 100, 0.5)]
+    packed = ContextPacker.pack(contexts, budget=200)
+    assert [c["id"] for c in packed.contexts] == ["b_0", "c_0"]
+    assert packed.truncated == 1
+    assert packed.dropped == 1
+    assert packed.contexts[1]["text"].startswith("う") and len(packed.contexts[1]["text"]) < 100
+    assert packed.tokens <= 200
+
+def test_pack_within_budget_keeps_everything():
+    contexts = [ctx("a_0", "short", 0.2), ctx("b_0", "text", 0.9)]
+    packed = ContextPacker.pack(contexts, budget=1000)
+    assert [c["text"] for c in packed.contexts] == ["text", "short"]
+    assert packed.truncated == packed.dropped == 0
+
+def test_title_prefix_is_not_repeated_in_prompt():
+    chunk = ctx("p_0", "T\nbody", 0.9)
+    assert format_context(chunk) == "Source: T (http://x/p)\nContent: body"
+    merged = ContextPacker.merge([chunk, ctx("p_1", "T\nmore", 0.5)])
+    assert merged[0]["text"] == "T\nbody\nmore"
@@ -0,0 +1,135 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.core.config import settings
+from app.services.elasticsearch_service import ElasticsearchService
+
+HITS = {"hits": {"hits": [
+    {"_id": "p1_0", "_score": 1.5, "_source": {"title": "T", "text": "body", "url": "u", "updated": 1}},
+]}}
+
+@pytest.fixture
+def es_service():
+    service = ElasticsearchService()
+    service.client = AsyncMock()
+    service.client.search.return_value = HITS
+    return service
+
+@pytest.mark.asyncio
+async def test_search_rank_features_query(es_service, monkeypatch):
+    monkeypatch.setattr(settings, "ES_VECTOR_MODE", "rank_features")
+
+    results = await es_service.search({"1": 0.5, "2": 0.8}, top_k=3)
+
+    query = es_service.client.search.call_args.kwargs["body"]["query"]
+    assert query["bool"]["should"][0] == {"rank_feature": {"field": "sparse_vector.1", "boost": 0.5}}
+    assert results[0]["title"] == "T"
+
+@pytest.mark.asyncio
+async def test_search_sparse_vector_query(es_service, monkeypatch):
+    monkeypatch.setattr(settings, "ES_VECTOR_MODE", "sparse_vector")
+    vector = {str(i): 1.0 for i in range(2000)}
+
+    await es_service.search(vector, top_k=3)
+
+    query = es_service.client.search.call_args.kwargs["body"]["query"]
+    # No truncation: every token reaches ES in a single clause
+    assert query == {"sparse_vector": {"field": "sparse_vector", "query_vector": vector}}
+
+def test_index_body_vector_mode():
+    body = ElasticsearchService.index_body("sparse_vector")
+    assert body["mappings"]["properties"]["sparse_vector"] == {"type": "sparse_vector"}
+
+@pytest.mark.asyncio
+async def test_search_hybrid_uses_one_msearch(es_service):
+    es_service.client.msearch.return_value = {"responses": [HITS, HITS]}
+
+    results = await es_service.search_hybrid("VPN 設定", {"1": 0.5}, top_k=3)
+
+    searches = es_service.client.msearch.call_args.kwargs["searches"]
+    assert searches[1]["query"] == {"multi_match": {"query": "VPN 設定", "fields": ["title^2", "text"]}}
+    assert es_service.client.msearch.await_count == 1
+    assert [r["id"] for r in results] == ["p1_0"]
+
+@pytest.mark.asyncio
+async def test_search_hybrid_degrades_when_one_search_fails(es_service):
+    error = {"error": {"type": "search_phase_execution_exception"}, "status": 400}
+    es_service.client.msearch.return_value = {"responses": [HITS, error]}
+
+    results = await es_service.search_hybrid("VPN 設定", {"1": 0.5}, top_k=3)
+
+    assert [r["id"] for r in results] == ["p1_0"]
+
+    es_service.client.msearch.return_value = {"responses": [error, error]}
+    with pytest.raises(RuntimeError):
+        await es_service.search_hybrid("VPN 設定", {"1": 0.5}, top_k=3)
+
+@pytest.mark.asyncio
+async def test_bulk_load_relaxes_and_restores_settings(es_service):
+    es_service.client.indices.get_settings.return_value = {"idx": {"settings": {"index.refresh_interval": "5s"}}}
+    es_service.client.indices.forcemerge.return_value = {"task": "t1"}
+    es_service.client.tasks.get.return_value = {"completed": True, "task": {}}
+
+    async with es_service.bulk_load(force_merge_segments=1, poll_interval=0):
+        assert es_service.client.indices.put_settings.call_args.kwargs["settings"] == {
+            "index.refresh_interval": "-1", "index.number_of_replicas": 0,
+        }
+
+    # Unset settings go back to their defaults
+    assert es_service.client.indices.put_settings.call_args.kwargs["settings"] == {
+        "index.refresh_interval": "5s", "index.number_of_replicas": None,
+    }
+    es_service.client.indices.refresh.assert_awaited_once()
+    assert es_service.client.indices.forcemerge.call_args.kwargs["max_num_segments"] == 1
+
+@pytest.mark.asyncio
+async def test_bulk_load_restores_settings_on_error(es_service):
+    es_service.client.indices.get_settings.return_value = {"idx": {"settings": {}}}
+
+    with pytest.raises(RuntimeError):
+        async with es_service.bulk_load():
+            raise RuntimeError("import failed")
+
+    assert es_service.client.indices.put_settings.await_count == 2
+    es_service.client.indices.forcemerge.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_bulk_index_returns_failed_documents(es_service, monkeypatch):
+    from app.models.scrapbox import ScrapboxChunk
+    from app.services import elasticsearch_service
+    calls = []
+
+    async def streaming_bulk(client, actions, **kwargs):
+        calls.append(kwargs)
+        for action in actions:
+            if action["_id"] == "p_1":
+                yield False, {"index": {"_id": "p_1", "status": 400, "error": {"type": "mapper_parsing_exception"}}}
+
+    monkeypatch.setattr(elasticsearch_service.helpers, "async_streaming_bulk", streaming_bulk)
+    chunks = [
+        ScrapboxChunk(id=f"p_{i}", page_id="p", title="T", text="x", url="u", updated=1, sparse_vector={"1": 1.0})
+        for i in range(2)
+    ]
+
+    failures = await es_service.bulk_index_chunks(chunks)
+
+    assert [f["index"]["_id"] for f in failures] == ["p_1"]
+    assert calls[0]["chunk_size"] == settings.ES_BULK_CHUNK_SIZE
+    assert calls[0]["max_chunk_bytes"] == settings.ES_BULK_MAX_BYTES
+    assert 429 in calls[0]["retry_on_status"] and calls[0]["yield_ok"] is False
+
+@pytest.mark.asyncio
+async def test_overlapping_bulk_loads_restore_settings_once(es_service):
+    es_service.client.indices.get_settings.return_value = {"idx": {"settings": {"index.refresh_interval": "5s"}}}
+    put_settings = es_service.client.indices.put_settings
+
+    async with es_service.bulk_load(poll_interval=0):
+        async with es_service.bulk_load(poll_interval=0):
+            assert put_settings.await_count == 1
+        # The outer load is still running: bulk settings stay in place
+        assert put_settings.await_count == 1
+        es_service.client.indices.refresh.assert_not_awaited()
+
+    assert put_settings.await_count == 2
+    assert put_settings.call_args.kwargs["settings"]["index.refresh_interval"] == "5s"
+    es_service.client.indices.get_settings.assert_awaited_once()
+    es_service.client.indices.refresh.assert_awaited_once()
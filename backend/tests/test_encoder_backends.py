@@ -0,0 +1,171 @@
+import asyncio
+import math
+import os
+import signal
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from transformers import BatchEncoding
+from encoder.backends import load_backend, sparsify, splade_weights, to_dict
+from encoder.pool import WorkerPool
+
+TEXTS = ["東京 の 天気 は 晴れ", "vpn の 設定 方法 を 教えて ください", "短い"]
+# int8 weights shift SPLADE weights slightly; vectors must stay close to the float32 reference
+MAX_ABS_DIFF = 0.05
+MIN_COSINE = 0.99
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    """A tiny randomly initialized BERT masked-LM with a word-level vocabulary, saved locally."""
+    path = tmp_path_factory.mktemp("tiny-splade")
+    words = sorted({w for text in TEXTS for w in text.split()} | set("東京天気晴れ短い"))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words
+    (path / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(path / "vocab.txt"))
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=64,
+    )
+    transformers.BertForMaskedLM(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return str(path)
+
+def assert_close(reference, vectors):
+    for ref, vec in zip(reference, vectors):
+        keys = set(ref) | set(vec)
+        assert max(abs(ref.get(k, 0.0) - vec.get(k, 0.0)) for k in keys) <= MAX_ABS_DIFF
+        dot = sum(ref.get(k, 0.0) * vec.get(k, 0.0) for k in keys)
+        norm = math.sqrt(sum(v * v for v in ref.values())) * math.sqrt(sum(v * v for v in vec.values()))
+        assert dot / norm >= MIN_COSINE
+
+@pytest.fixture(scope="module")
+def reference(model_dir):
+    vectors = load_backend("torch", model_dir, inference_mode=False).encode(TEXTS)
+    assert all(vectors)
+    return vectors
+
+def test_padded_batch_matches_single_texts(model_dir, reference):
+    backend = load_backend("torch", model_dir)
+    singles = [backend.encode([text])[0] for text in TEXTS]
+    assert_close(reference, singles)
+
+def test_torch_int8_parity(model_dir, reference):
+    assert_close(reference, load_backend("torch-int8", model_dir).encode(TEXTS))
+
+@pytest.mark.parametrize("name", ["onnx", "onnx-int8"])
+def test_onnx_parity(model_dir, reference, tmp_path, name):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    backend = load_backend(name, model_dir, onnx_path=str(tmp_path / "model.onnx"), intra_op=1)
+    assert_close(reference, backend.encode(TEXTS))
+
+def reference_sparsify(row, threshold, top_k=None):
+    """The original per-element loop over the vocabulary."""
+    vector = {str(i): w for i, w in enumerate(row.tolist()) if w > threshold}
+    if top_k:
+        vector = dict(sorted(vector.items(), key=lambda kv: -kv[1])[:top_k])
+    return vector
+
+@pytest.mark.parametrize("top_k", [None, 3])
+def test_sparsify_matches_loop(top_k):
+    torch.manual_seed(0)
+    weights = torch.relu(torch.randn(4, 50))
+    weights[2] = 0  # a row with no surviving terms, as for an empty text
+    rows = sparsify(weights, threshold=0.5, top_k=top_k)
+    assert [to_dict(row) for row in rows] == [reference_sparsify(w, 0.5, top_k) for w in weights]
+
+def test_wire_formats_roundtrip():
+    wire = pytest.importorskip("encoder.wire")
+    msgpack = pytest.importorskip("msgpack")
+    from app.services.encoder_service import decode_vector
+
+    row = (torch.tensor([3, 17, 250000]), torch.tensor([0.25, 1.5, 2.0]))
+    expected = {"3": 0.25, "17": 1.5, "250000": 2.0}
+    for media_type in (wire.JSON, wire.COMPACT_JSON):
+        assert decode_vector(wire.encode_row(row, media_type), media_type) == expected
+    packed = msgpack.unpackb(msgpack.packb(wire.encode_row(row, wire.MSGPACK)))
+    # float16 keeps ~3 significant digits, plenty for ranking
+    assert decode_vector(packed, wire.MSGPACK) == pytest.approx(expected, rel=1e-3)
+
+def test_short_text_is_a_single_plain_window(model_dir):
+    backend = load_backend("torch", model_dir)
+    tokens, owners = backend.windows([TEXTS[1]])
+    assert tokens["input_ids"].tolist() == backend.tokenizer([TEXTS[1]])["input_ids"]
+    assert owners.tolist() == [0]
+
+def test_long_text_is_max_pooled_over_windows(model_dir):
+    # Far beyond the model's 64 positions, which a single forward pass cannot handle
+    long_text = " ".join(TEXTS * 20)
+    backend = load_backend("torch", model_dir, window_size=16, stride=4, max_windows=None)
+    tokens, owners = backend.windows([long_text, TEXTS[2]])
+    n_tokens = len(backend.tokenizer(long_text, add_special_tokens=False)["input_ids"])
+    assert tokens["input_ids"].shape[1] == 16
+    assert owners.tolist().count(0) == math.ceil((n_tokens - 4) / (14 - 4))
+
+    vector, short = backend.encode([long_text, TEXTS[2]])
+    # Each window on its own, unpadded, then the element-wise max
+    rows = []
+    for ids, mask in zip(tokens["input_ids"][owners == 0], tokens["attention_mask"][owners == 0]):
+        window = BatchEncoding({"input_ids": ids[mask == 1][None], "attention_mask": mask[mask == 1][None]})
+        rows.append(splade_weights(backend.logits(window), window["attention_mask"])[0])
+    expected = to_dict(sparsify(torch.stack(rows).max(dim=0).values[None], backend.threshold)[0])
+    assert vector == pytest.approx(expected, abs=1e-5)
+    assert short == pytest.approx(backend.encode([TEXTS[2]])[0], abs=1e-5)
+
+def test_max_windows_bounds_compute(model_dir):
+    backend = load_backend("torch", model_dir, window_size=16, stride=4, max_windows=2)
+    _, owners = backend.windows([" ".join(TEXTS * 20)])
+    assert owners.tolist() == [0, 0]
+
+async def wait_ready(pool, workers, timeout=60.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while sum(w["ready"] and w["alive"] for w in pool.stats()["workers"]) < workers:
+        assert loop.time() < deadline, pool.stats()
+        await asyncio.sleep(0.1)
+
+async def test_worker_pool_matches_in_process(model_dir, reference):
+    pool = WorkerPool(2, "torch", model_dir, {}, threads=1)
+    pool.start()
+    try:
+        await wait_ready(pool, 2)
+        results = await asyncio.gather(*(pool.submit(TEXTS) for _ in range(6)))
+        for rows in results:
+            assert_close(reference, [to_dict(row) for row in rows])
+        stats = pool.stats()
+        assert stats["queue_depth"] == 0
+        assert sum(w["jobs"] for w in stats["workers"]) == 6
+        assert not any(w["busy"] for w in stats["workers"])
+    finally:
+        await pool.stop()
+
+async def test_worker_pool_restarts_dead_worker(model_dir):
+    pool = WorkerPool(1, "torch", model_dir, {}, threads=1)
+    pool.start()
+    try:
+        await wait_ready(pool, 1)
+        pid = pool.stats()["workers"][0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        await asyncio.sleep(0.5)
+        await wait_ready(pool, 1)
+        assert pool.stats()["workers"][0]["pid"] != pid
+        assert len(await pool.submit(TEXTS)) == len(TEXTS)
+    finally:
+        await pool.stop()
+
+async def test_worker_pool_fails_fast_when_no_worker_loads(tmp_path):
+    pool = WorkerPool(2, "torch", str(tmp_path / "missing"), {}, threads=1)
+    pool.start()
+    try:
+        # Queued before the workers report the failure, then failed instead of waiting forever
+        with pytest.raises(RuntimeError, match="failed to load the model"):
+            await asyncio.wait_for(pool.submit(TEXTS), 60.0)
+        assert pool.queue_depth == 0
+        with pytest.raises(RuntimeError, match="failed to load the model"):
+            await pool.submit(TEXTS)
+        assert not pool.ready
+    finally:
+        await pool.stop()
@@ -1,6 +1,11 @@
 import pytest
-from app.services.encoder_service import EncoderService
+from app.core.config import settings
+from app.services.encoder_service import EncoderService, EmbeddingCache, query_vector_cache
+from app.core.http_client import http_clients
 import httpx
+import json
+import struct
+import msgpack
 
 @pytest.mark.asyncio
 async def test_encode_success(respx_mock):
@@ -20,3 +25,97 @@ async def test_encode_failure(respx_mock):
     
     with pytest.raises(Exception):
         await EncoderService.encode("fail")
+
+@pytest.mark.asyncio
+async def test_encode_batch_single_call(respx_mock):
+    route = respx_mock.post("http://localhost:8001/encode_batch").mock(
+        return_value=httpx.Response(200, json={"vectors": [{"1": 0.5}, {"2": 0.8}]})
+    )
+
+    result = await EncoderService.encode_batch(["hello", "world"])
+    assert result == [{"1": 0.5}, {"2": 0.8}]
+    assert route.call_count == 1
+    assert json.loads(route.calls[0].request.content) == {"texts": ["hello", "world"]}
+    # Lossless JSON unless the float16 msgpack format is opted into
+    assert route.calls[0].request.headers["accept"] == "application/json"
+
+@pytest.mark.asyncio
+async def test_encode_batch_decodes_compact_json(respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "ENCODER_WIRE_FORMAT", "msgpack")
+    route = respx_mock.post("http://localhost:8001/encode_batch").mock(
+        return_value=httpx.Response(
+            200,
+            content=json.dumps({"vectors": [{"indices": [1, 7], "values": [0.5, 1.0]}]}),
+            headers={"content-type": "application/vnd.splade.compact+json"},
+        )
+    )
+
+    assert await EncoderService.encode_batch(["hello"]) == [{"1": 0.5, "7": 1.0}]
+    assert route.calls[0].request.headers["accept"] == "application/x-msgpack"
+
+@pytest.mark.asyncio
+async def test_encode_decodes_msgpack(respx_mock):
+    vector = {"indices": struct.pack("<2I", 5, 9), "values": struct.pack("<2e", 0.5, 2.0)}
+    respx_mock.post("http://localhost:8001/encode").mock(
+        return_value=httpx.Response(
+            200, content=msgpack.packb({"vector": vector}), headers={"content-type": "application/x-msgpack"}
+        )
+    )
+
+    assert await EncoderService.encode("hello") == {"5": 0.5, "9": 2.0}
+
+@pytest.mark.asyncio
+async def test_encode_batch_empty():
+    assert await EncoderService.encode_batch([]) == []
+
+@pytest.mark.asyncio
+async def test_encode_reuses_pooled_client(respx_mock):
+    respx_mock.post("http://localhost:8001/encode").mock(
+        return_value=httpx.Response(200, json={"vector": {"1": 1.0}})
+    )
+
+    await EncoderService.encode("first")
+    client = http_clients.get("encoder")
+    await EncoderService.encode("second")
+    assert http_clients.get("encoder") is client
+    assert not client.is_closed
+
+@pytest.mark.asyncio
+async def test_encode_query_uses_cache(respx_mock):
+    query_vector_cache.clear()
+    route = respx_mock.post("http://localhost:8001/encode").mock(
+        return_value=httpx.Response(200, json={"vector": {"1": 1.0}})
+    )
+
+    assert await EncoderService.encode_query("VPN 設定") == {"1": 1.0}
+    assert await EncoderService.encode_query("  vpn   設定 ") == {"1": 1.0}
+    assert route.call_count == 1
+    assert query_vector_cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_encode_batch_cached_only_encodes_new_texts(respx_mock):
+    route = respx_mock.post("http://localhost:8001/encode_batch").mock(
+        side_effect=lambda request: httpx.Response(
+            200, json={"vectors": [{"1": float(len(t))} for t in json.loads(request.content)["texts"]]}
+        )
+    )
+
+    assert await EncoderService.encode_batch_cached(["a", "bb"]) == [{"1": 1.0}, {"1": 2.0}]
+    assert await EncoderService.encode_batch_cached(["bb", "ccc", "ccc"]) == [{"1": 2.0}, {"1": 3.0}, {"1": 3.0}]
+    assert json.loads(route.calls[1].request.content) == {"texts": ["ccc"]}
+
+@pytest.mark.asyncio
+async def test_embedding_cache_invalidated_on_model_change(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache(path, 10, "model-a").set_many(["text"], [{"1": 1.0}])
+
+    assert EmbeddingCache(path, 10, "model-a").get_many(["text"])
+    assert EmbeddingCache(path, 10, "model-b").get_many(["text"]) == {}
+
+@pytest.mark.asyncio
+async def test_embedding_cache_invalidated_on_version_bump(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache(path, 10, "model-a", "1").set_many(["text"], [{"1": 1.0}])
+
+    assert EmbeddingCache(path, 10, "model-a", "1").get_many(["text"])
+    assert EmbeddingCache(path, 10, "model-a", "2").get_many(["text"]) == {}
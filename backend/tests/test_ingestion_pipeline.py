@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from app.models.scrapbox import ScrapboxPage
+from app.services.encoder_service import EncoderService
+from app.services.ingestion_pipeline import IngestionPipeline
+
+class SlowElasticsearchService:
+    def __init__(self, events):
+        self.events = events
+        self.indexed = []
+
+    async def bulk_index_chunks(self, chunks):
+        self.events.append(("index", len(chunks)))
+        await asyncio.sleep(0.01)
+        self.indexed.extend(chunks)
+        return []
+
+@pytest.mark.asyncio
+async def test_pipeline_overlaps_encode_and_index(monkeypatch):
+    events = []
+
+    async def fake_encode(texts):
+        events.append(("encode", len(texts)))
+        await asyncio.sleep(0.01)
+        return [{"1": 1.0} for _ in texts]
+
+    monkeypatch.setattr(EncoderService, "encode_batch_cached", staticmethod(fake_encode))
+    pages = [ScrapboxPage(id=f"p{i}", title=f"p{i}", lines=[f"line {i}"], updated=1) for i in range(20)]
+    es = SlowElasticsearchService(events)
+    pipeline = IngestionPipeline(es, encode_batch_size=4, encode_concurrency=2, index_batch_size=4, index_concurrency=1, queue_size=4)
+
+    metrics = await pipeline.run("proj", pages, stored={})
+
+    assert sorted(c.page_id for c in es.indexed) == sorted(p.id for p in pages)
+    # Indexing started before the encoder had seen every chunk
+    first_index = events.index(("index", 4))
+    assert sum(n for kind, n in events[first_index:] if kind == "encode") > 0
+    assert metrics["stages"]["encode"]["items"] == 20
+    assert metrics["stages"]["index"]["items"] == 20
+    assert metrics["stages"]["index"]["items_per_second"] > 0
+    assert metrics["running"] is False
+
+@pytest.mark.asyncio
+async def test_pipeline_drops_chunks_that_failed_to_encode(monkeypatch):
+    async def failing_encode(texts):
+        raise RuntimeError("encoder down")
+
+    monkeypatch.setattr(EncoderService, "encode_batch_cached", staticmethod(failing_encode))
+    es = SlowElasticsearchService([])
+    pipeline = IngestionPipeline(es)
+
+    metrics = await pipeline.run("proj", [ScrapboxPage(id="p", title="p", lines=["x"], updated=1)], stored={})
+
+    assert es.indexed == []
+    assert metrics["stages"]["encode"]["failed"] == 1
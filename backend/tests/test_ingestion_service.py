@@ -0,0 +1,124 @@
+import pytest
+import json
+import httpx
+from contextlib import asynccontextmanager
+from app.core.config import settings
+from app.services.ingestion_service import IngestionService
+from app.services.scrapbox_service import ScrapboxService
+
+class FakeElasticsearchService:
+    def __init__(self, versions=None):
+        self.versions = versions or {}
+        self.indexed = []
+        self.deleted_pages = []
+        self.deleted_chunks = []
+        self.bulk_loads = 0
+
+    async def create_index_if_not_exists(self):
+        pass
+
+    @asynccontextmanager
+    async def bulk_load(self):
+        self.bulk_loads += 1
+        yield
+
+    async def get_page_versions(self, project_name):
+        return self.versions
+
+    async def bulk_index_chunks(self, chunks):
+        self.indexed.extend(c for c in chunks if c.sparse_vector)
+        return []
+
+    async def delete_pages(self, page_ids):
+        self.deleted_pages.extend(page_ids)
+
+    async def delete_chunks(self, chunk_ids):
+        self.deleted_chunks.extend(chunk_ids)
+
+def project(*pages):
+    return {
+        "name": "proj",
+        "displayName": "proj",
+        "pages": [{"id": pid, "title": pid, "lines": lines, "updated": updated} for pid, lines, updated in pages],
+    }
+
+@pytest.fixture
+def encoder(respx_mock):
+    def reply(request):
+        texts = json.loads(request.content)["texts"]
+        return httpx.Response(200, json={"vectors": [{"1": 1.0} for _ in texts]})
+    return respx_mock.post("http://localhost:8001/encode_batch").mock(side_effect=reply)
+
+@pytest.mark.asyncio
+async def test_incremental_skips_unchanged_pages(encoder):
+    es = FakeElasticsearchService({
+        "same": {"updated": 1, "chunks": 1},
+        "edited": {"updated": 1, "chunks": 1},
+        "removed": {"updated": 1, "chunks": 2},
+    })
+    data = project(("same", ["a"], 1), ("edited", ["b"], 2), ("new", ["c"], 1))
+
+    await IngestionService.ingest_project(data, es, incremental=True)
+
+    assert sorted(c.page_id for c in es.indexed) == ["edited", "new"]
+    assert es.deleted_pages == ["removed"]
+    assert es.deleted_chunks == []
+    assert es.bulk_loads == 0
+
+@pytest.mark.asyncio
+async def test_shrunk_page_loses_trailing_chunks(encoder):
+    es = FakeElasticsearchService({"page": {"updated": 1, "chunks": 3}})
+    data = project(("page", ["short"], 2))
+
+    await IngestionService.ingest_project(data, es, incremental=True)
+
+    assert [c.id for c in es.indexed] == ["page_0"]
+    assert es.deleted_chunks == ["page_1", "page_2"]
+
+@pytest.mark.asyncio
+async def test_pages_skipped_by_fetcher_are_kept(encoder):
+    es = FakeElasticsearchService({"kept": {"updated": 1, "chunks": 1}})
+    data = project(("new", ["c"], 1))
+    data["unchanged_page_ids"] = ["kept"]
+
+    await IngestionService.ingest_project(data, es, incremental=True)
+
+    assert es.deleted_pages == []
+
+@pytest.mark.asyncio
+async def test_ingest_export_file_streams_pages(encoder, tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(project(("a", ["x"], 1), ("b", ["y"], 1))), encoding="utf-8")
+    es = FakeElasticsearchService()
+
+    await IngestionService.ingest_export_file(str(path), es)
+
+    assert [c.id for c in es.indexed] == ["a_0", "b_0"]
+    assert es.indexed[0].project == "proj"
+    # Full imports run in bulk-load mode
+    assert es.bulk_loads == 1
+
+@pytest.mark.asyncio
+async def test_page_failing_to_fetch_stays_indexed(encoder, respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "SCRAPBOX_MAX_RETRIES", 1)
+    monkeypatch.setattr(settings, "SCRAPBOX_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(settings, "SCRAPBOX_RATE_LIMIT", 1000.0)
+    listed = [{"id": "ok", "title": "ok"}, {"id": "down", "title": "down"}]
+    respx_mock.get("https://scrapbox.io/api/pages/proj").mock(
+        return_value=httpx.Response(200, json={"count": 2, "pages": listed})
+    )
+    respx_mock.get("https://scrapbox.io/api/pages/proj/ok").mock(
+        return_value=httpx.Response(200, json={"id": "ok", "title": "ok", "updated": 2, "lines": [{"text": "x"}]})
+    )
+    respx_mock.get("https://scrapbox.io/api/pages/proj/down").mock(return_value=httpx.Response(503))
+    es = FakeElasticsearchService({
+        "ok": {"updated": 1, "chunks": 1},
+        "down": {"updated": 1, "chunks": 1},
+        "gone": {"updated": 1, "chunks": 1},
+    })
+
+    data = await ScrapboxService.fetch_project_data("proj")
+    await IngestionService.ingest_project(data, es)
+
+    assert data["failed_page_ids"] == ["down"]
+    assert es.deleted_pages == ["gone"]
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from app.api.v1 import search
+from app.main import app
+from app.services.llm_scheduler import LLMOverloaded, LLMScheduler
+
+@pytest.mark.asyncio
+async def test_admits_up_to_concurrency_then_queues_in_order():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, queue_timeout=5)
+    first = scheduler.enqueue()
+    second = scheduler.enqueue()
+    third = scheduler.enqueue()
+    assert (first.admitted, second.position, third.position) == (True, 1, 2)
+
+    positions = []
+
+    async def wait(ticket):
+        async for position in ticket.positions():
+            positions.append(position)
+
+    waiter = asyncio.create_task(wait(third))
+    await asyncio.sleep(0.01)
+    first.release()
+    await asyncio.sleep(0.01)
+    assert second.admitted and not third.admitted
+    second.release()
+    await waiter
+    assert positions == [2, 1]
+    assert scheduler.stats()["active"] == 1
+
+@pytest.mark.asyncio
+async def test_rejects_when_queue_is_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=1, queue_timeout=5)
+    scheduler.enqueue()
+    scheduler.enqueue()
+    with pytest.raises(LLMOverloaded) as e:
+        scheduler.enqueue()
+    assert e.value.status_code == 429
+
+@pytest.mark.asyncio
+async def test_queue_deadline_and_cancellation_release_places():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, queue_timeout=0.01)
+    scheduler.enqueue()
+    late = scheduler.enqueue()
+    with pytest.raises(LLMOverloaded) as e:
+        await late.wait()
+    assert e.value.status_code == 503
+
+    scheduler._queue_timeout = 5
+    cancelled = asyncio.create_task(scheduler.enqueue().wait())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert scheduler.stats()["queued"] == 0
+
+def test_search_returns_429_with_retry_after(monkeypatch):
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0)
+    scheduler.active = 1
+    monkeypatch.setattr(search, "llm_scheduler", scheduler)
+    with TestClient(app) as client:
+        response = client.post("/api/v1/search", json={"query": "q"})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "10"
+        assert client.post("/api/v1/search/stream", json={"query": "q"}).status_code == 429
@@ -1,11 +1,14 @@
 import pytest
 from app.services.llm_service import LLMService
 import httpx
+import json
+from app.services.answer_cache import answer_cache
+from app.core.config import settings
 
 @pytest.mark.asyncio
 async def test_generate_answer_success(respx_mock):
     respx_mock.post("http://localhost:11434/api/generate").mock(
-        return_value=httpx.Response(200, json={"response": "This is a test answer."})
+        return_value=httpx.Response(200, json={"response": "This is a test answer.", "done": True})
     )
     
     contexts = [
@@ -23,3 +26,123 @@ async def test_generate_answer_error(respx_mock):
     
     answer = await LLMService.generate_answer("Fail", [])
     assert "エラーが発生しました" in answer
+
+CONTEXTS = [{"id": "p1_0", "title": "T", "text": "Context", "url": "http://test.com", "updated": 1}]
+
+@pytest.mark.asyncio
+async def test_generate_answer_cached(respx_mock):
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, json={"response": "Cached answer", "done": True})
+    )
+
+    assert await LLMService.generate_answer("What?", CONTEXTS) == "Cached answer"
+    assert await LLMService.generate_answer(" what? ", CONTEXTS) == "Cached answer"
+    assert route.call_count == 1
+    assert answer_cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_answer_cache_stale_when_page_updated(respx_mock):
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, json={"response": "Answer", "done": True})
+    )
+
+    await LLMService.generate_answer("What?", CONTEXTS)
+    await LLMService.generate_answer("What?", [{**CONTEXTS[0], "updated": 2}])
+    assert route.call_count == 2
+
+@pytest.mark.asyncio
+async def test_stream_replays_cached_tokens(respx_mock):
+    lines = [{"response": "Hel"}, {"response": "lo"}, {"response": "", "done": True}]
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, text="\n".join(json.dumps(l) for l in lines))
+    )
+
+    first = [t async for t in LLMService.generate_answer_stream("What?", CONTEXTS)]
+    second = [t async for t in LLMService.generate_answer_stream("What?", CONTEXTS)]
+
+    assert first == second == ["Hel", "lo", ""]
+    assert route.call_count == 1
+    assert await LLMService.generate_answer("What?", CONTEXTS) == "Hello"
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached(respx_mock):
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(500)
+    )
+
+    await LLMService.generate_answer("What?", CONTEXTS)
+    [t async for t in LLMService.generate_answer_stream("What?", CONTEXTS)]
+    assert route.call_count == 2
+    assert len(answer_cache.cache) == 0
+
+@pytest.mark.asyncio
+async def test_semantic_cache_serves_paraphrase(respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_CACHE_ENABLED", True)
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, json={"response": "VPN answer", "done": True})
+    )
+
+    await LLMService.generate_answer("VPNの設定方法", CONTEXTS, {"vpn": 1.0, "設定": 0.8, "方法": 0.3})
+    answer = await LLMService.generate_answer("VPN 設定 手順", CONTEXTS, {"vpn": 1.0, "設定": 0.8, "手順": 0.2})
+
+    assert answer == "VPN answer"
+    assert route.call_count == 1
+
+def test_prompt_starts_with_static_prefix():
+    from app.services.llm_service import PROMPT_PREFIX
+    a = LLMService.build_prompt("質問A", "ctx A")
+    b = LLMService.build_prompt("別の質問", "ctx B")
+    assert a.startswith(PROMPT_PREFIX) and b.startswith(PROMPT_PREFIX)
+
+@pytest.mark.asyncio
+async def test_request_options_and_warm_up(respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_KEEP_ALIVE", "1h")
+    monkeypatch.setattr(settings, "LLM_NUM_CTX", 8192)
+    monkeypatch.setattr(settings, "LLM_NUM_PREDICT", 256)
+    route = respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, json={"response": "ok", "done": True})
+    )
+    await LLMService.generate_answer("q", CONTEXTS)
+    body = json.loads(route.calls.last.request.content)
+    assert body["keep_alive"] == "1h"
+    assert body["options"]["num_ctx"] == 8192
+    assert body["options"]["num_predict"] == 256
+
+    await LLMService.warm_up()
+    body = json.loads(route.calls.last.request.content)
+    assert body["options"]["num_predict"] == 1
+    from app.services.llm_service import PROMPT_PREFIX
+    assert body["prompt"] == PROMPT_PREFIX
+
+@pytest.mark.asyncio
+async def test_generation_metrics_from_done_message(respx_mock):
+    from app.services.llm_metrics import llm_metrics
+    lines = [
+        {"response": "A"},
+        {"response": "B"},
+        {"response": "", "done": True, "prompt_eval_count": 120, "prompt_eval_duration": 600_000_000,
+         "eval_count": 20, "eval_duration": 2_000_000_000, "load_duration": 0},
+    ]
+    respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, text="\n".join(json.dumps(l) for l in lines))
+    )
+
+    assert await LLMService.generate_answer("What?", CONTEXTS) == "AB"
+    summary = llm_metrics.summary()
+    assert summary["completed"] == 1
+    assert summary["tokens_per_second"]["avg"] == 10.0
+    assert summary["prompt_tokens_per_second"]["avg"] == 200.0
+    assert summary["prompt_tokens"]["avg"] == 120
+    assert summary["ttft_seconds"]["avg"] is not None
+
+@pytest.mark.asyncio
+async def test_truncated_stream_is_an_error(respx_mock):
+    from app.services.llm_metrics import llm_metrics
+    respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, text=json.dumps({"response": "partial"}))
+    )
+
+    tokens = [t async for t in LLMService.generate_answer_stream("What?", CONTEXTS)]
+    assert tokens[0] == "partial" and "[Error:" in tokens[-1]
+    assert len(answer_cache.cache) == 0
+    assert llm_metrics.summary()["errors"] == 1
@@ -0,0 +1,65 @@
+import json
+from unittest.mock import AsyncMock
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.api.v1 import search
+from app.core.metrics import Counter, Histogram, ES_TOOK_SECONDS, LLM_TTFT_SECONDS
+from app.main import app
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "Test", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    lines = histogram.render().splitlines()
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 2' in lines
+    assert 'test_seconds_count{stage="a"} 2' in lines
+
+def test_label_values_are_escaped():
+    counter = Counter("test_total", "Test", ["path"])
+    counter.inc(path='a\\b"c\nd')
+    assert counter.samples() == ['test_total{path="a\\\\b\\"c\\nd"} 1']
+
+def test_middleware_records_requests():
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.headers["server-timing"].startswith("total;dur=")
+        body = client.get("/metrics").text
+    assert 'rag_http_request_duration_seconds_count{method="GET",route="/",status="200"}' in body
+    assert "rag_http_requests_in_flight" in body
+
+@pytest.fixture
+def es_client(monkeypatch):
+    hit = {"_id": "p_0", "_score": 1.0, "_source": {"page_id": "p", "title": "T", "text": "body", "url": "u", "updated": 1}}
+    client = AsyncMock()
+    client.search.return_value = {"took": 7, "hits": {"hits": [hit]}}
+    monkeypatch.setattr(search.es_service, "client", client)
+    return client
+
+def test_search_server_timing_header(es_client, respx_mock):
+    respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, json={"response": "answer", "done": True})
+    )
+    took_before = ES_TOOK_SECONDS.count(mode="bm25")
+    with TestClient(app) as client:
+        response = client.post("/api/v1/search", json={"query": "q", "mode": "bm25"})
+    stages = [part.split(";")[0] for part in response.headers["server-timing"].split(", ")]
+    assert stages == ["es", "es_took", "llm_ttft", "llm", "total"]
+    assert ES_TOOK_SECONDS.count(mode="bm25") == took_before + 1
+
+def test_stream_sends_timing_events(es_client, respx_mock):
+    lines = [{"response": "Hi"}, {"response": "", "done": True}]
+    respx_mock.post("http://localhost:11434/api/generate").mock(
+        return_value=httpx.Response(200, text="\n".join(json.dumps(l) for l in lines))
+    )
+    ttft_before = LLM_TTFT_SECONDS.count()
+    with TestClient(app) as client:
+        response = client.post("/api/v1/search/stream", json={"query": "q", "mode": "bm25"})
+    events = [json.loads(line[6:]) for line in response.text.splitlines() if line.startswith("data: ")]
+    timings = [e["timing"] for e in events if "timing" in e]
+    assert [t["phase"] for t in timings] == ["retrieve", "first_token", "done"]
+    assert "es" in timings[0]["stages"] and "llm" in timings[-1]["stages"]
+    assert LLM_TTFT_SECONDS.count() == ttft_before + 1
@@ -0,0 +1,37 @@
+import io
+import json
+import pytest
+from app.services.scrapbox_export import ScrapboxExportReader
+
+EXPORT = {
+    "name": "proj",
+    "displayName": "Project",
+    "exported": 1612345678,
+    "users": [{"id": "u1", "name": "someone"}],
+    "pages": [
+        {"id": "p1", "title": "ページ1", "created": 1, "updated": 1612345678, "lines": ["ページ1", "本文 [link]"]},
+        {"id": "p2", "title": "Page 2", "updated": 2, "lines": [{"text": "Page 2", "created": 1}, {"text": "body"}]},
+    ],
+}
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+def test_reader_streams_pages(read_size):
+    reader = ScrapboxExportReader(io.StringIO(json.dumps(EXPORT, ensure_ascii=False, indent=1)), read_size=read_size)
+
+    header = reader.header()
+    pages = list(reader.pages())
+
+    assert header == {"name": "proj", "displayName": "Project", "exported": 1612345678, "users": EXPORT["users"]}
+    assert [p.id for p in pages] == ["p1", "p2"]
+    assert pages[0].updated == 1612345678
+    assert pages[1].lines == ["Page 2", "body"]
+
+def test_reader_without_pages():
+    reader = ScrapboxExportReader(io.StringIO('{"name": "proj", "pages": []}'))
+    assert list(reader.pages()) == []
+    assert reader.header() == {"name": "proj"}
+
+def test_reader_rejects_truncated_export():
+    reader = ScrapboxExportReader(io.StringIO('{"name": "proj", "pages": [{"id": "p1"'))
+    with pytest.raises(ValueError):
+        list(reader.pages())
@@ -1,4 +1,8 @@
 import pytest
+import asyncio
+import urllib.parse
+import httpx
+from app.core.config import settings
 from app.services.scrapbox_service import ScrapboxService
 from app.models.scrapbox import ScrapboxPage
 
@@ -29,3 +33,59 @@ def test_chunk_page():
     assert chunks[0].title == "Test Page"
     assert "https://scrapbox.io/test-project/Test_Page" == chunks[0].url
     assert "First line of text" in chunks[0].text
+
+class StubScrapboxServer:
+    """Minimal in-process stand-in for the Scrapbox page API."""
+
+    def __init__(self, titles, flaky=(), missing=()):
+        self.titles = titles
+        self.flaky = set(flaky)  # answer 429 once before succeeding
+        self.missing = set(missing)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.list_calls = []
+
+    async def __call__(self, request):
+        path = urllib.parse.unquote(request.url.path)
+        if path == "/api/pages/proj":
+            skip = int(request.url.params["skip"])
+            limit = int(request.url.params["limit"])
+            self.list_calls.append(skip)
+            pages = [{"id": f"id-{t}", "title": t} for t in self.titles[skip:skip + limit]]
+            return httpx.Response(200, json={"skip": skip, "limit": limit, "count": len(self.titles), "pages": pages})
+
+        title = path.rsplit("/", 1)[-1]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if title in self.flaky:
+            self.flaky.discard(title)
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        if title in self.missing:
+            return httpx.Response(404)
+        return httpx.Response(200, json={
+            "id": f"id-{title}", "title": title, "updated": 1,
+            "lines": [{"text": title}, {"text": "body"}],
+        })
+
+@pytest.mark.asyncio
+async def test_fetch_project_data_paginates_and_fetches_concurrently(respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "SCRAPBOX_PAGE_LIST_LIMIT", 3)
+    monkeypatch.setattr(settings, "SCRAPBOX_FETCH_CONCURRENCY", 4)
+    monkeypatch.setattr(settings, "SCRAPBOX_RATE_LIMIT", 1000.0)
+    monkeypatch.setattr(settings, "SCRAPBOX_RETRY_BACKOFF", 0.0)
+
+    titles = [f"page {i}" for i in range(10)]
+    server = StubScrapboxServer(titles, flaky=["page 2"], missing=["page 7"])
+    respx_mock.get(url__startswith="https://scrapbox.io/api/pages/proj").mock(side_effect=server)
+
+    progress = []
+    data = await ScrapboxService.fetch_project_data("proj", progress=lambda done, total: progress.append((done, total)))
+
+    assert server.list_calls == [0, 3, 6, 9]
+    assert [p["title"] for p in data["pages"]] == [t for t in titles if t != "page 7"]
+    assert data["pages"][0]["lines"] == ["page 0", "body"]
+    assert data["failed_page_ids"] == ["id-page 7"]
+    assert 1 < server.max_in_flight <= 4
+    assert progress[-1] == (10, 10)
@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.core.metrics import SEARCH_DEGRADED
+from app.services.encoder_service import EncoderService
+from app.services.elasticsearch_service import ElasticsearchService
+from app.services.search_service import SearchService, RetrievalError
+
+class FakeElasticsearchService:
+    def __init__(self):
+        self.calls = []
+
+    async def search(self, query_vector, top_k=5):
+        self.calls.append("splade")
+        return [{"id": "a"}]
+
+    async def search_bm25(self, query_text, top_k=5):
+        self.calls.append("bm25")
+        return [{"id": "b"}]
+
+    async def search_hybrid(self, query_text, query_vector, top_k=5):
+        self.calls.append("hybrid")
+        return [{"id": "c"}]
+
+@pytest.fixture
+def encoder(monkeypatch):
+    state = {"delay": 0.0, "error": None}
+
+    async def encode_query(query):
+        await asyncio.sleep(state["delay"])
+        if state["error"]:
+            raise state["error"]
+        return {"1": 1.0}
+
+    monkeypatch.setattr(EncoderService, "encode_query", staticmethod(encode_query))
+    return state
+
+@pytest.mark.asyncio
+async def test_retrieve_modes(encoder):
+    es = FakeElasticsearchService()
+    for mode in ["splade", "bm25", "hybrid"]:
+        await SearchService.retrieve(es, "q", mode=mode)
+    assert es.calls == ["splade", "bm25", "hybrid"]
+
+@pytest.mark.asyncio
+async def test_falls_back_to_bm25_when_encoder_is_down(encoder):
+    encoder["error"] = RuntimeError("connection refused")
+    es = FakeElasticsearchService()
+    before = SEARCH_DEGRADED.value(failed="encoder")
+
+    assert await SearchService.retrieve(es, "q", mode="hybrid") == ([{"id": "b"}], None)
+    assert SEARCH_DEGRADED.value(failed="encoder") == before + 1
+
+@pytest.mark.asyncio
+async def test_falls_back_to_bm25_when_encoder_is_slow(encoder, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_ENCODER_TIMEOUT", 0.01)
+    monkeypatch.setattr(settings, "SEARCH_MODE", "splade")
+    encoder["delay"] = 1.0
+    es = FakeElasticsearchService()
+
+    assert await SearchService.retrieve(es, "q") == ([{"id": "b"}], None)
+
+@pytest.mark.asyncio
+async def test_explicit_splade_mode_does_not_fall_back(encoder):
+    encoder["error"] = RuntimeError("down")
+
+    with pytest.raises(RetrievalError, match="Encoder error: down"):
+        await SearchService.retrieve(FakeElasticsearchService(), "q", mode="splade")
+
+@pytest.mark.asyncio
+async def test_encoder_error_without_fallback(encoder, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_BM25_FALLBACK", False)
+    encoder["error"] = RuntimeError("down")
+
+    with pytest.raises(RetrievalError, match="Encoder error: down"):
+        await SearchService.retrieve(FakeElasticsearchService(), "q", mode="splade")
+
+def test_reciprocal_rank_fusion():
+    bm25 = [{"id": "a", "score": 9.0}, {"id": "b", "score": 5.0}]
+    splade = [{"id": "b", "score": 30.0}, {"id": "c", "score": 20.0}]
+
+    fused = ElasticsearchService.reciprocal_rank_fusion([bm25, splade], k=60)
+
+    assert [d["id"] for d in fused] == ["b", "a", "c"]
+    assert fused[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+
+def test_weighted_score_fusion():
+    bm25 = [{"id": "a", "score": 9.0}, {"id": "b", "score": 5.0}]
+    splade = [{"id": "b", "score": 30.0}, {"id": "c", "score": 20.0}]
+
+    fused = ElasticsearchService.weighted_score_fusion([bm25, splade], [0.3, 0.7])
+
+    assert [d["id"] for d in fused] == ["b", "a", "c"]
+    assert fused[0]["score"] == pytest.approx(0.7)
@@ -0,0 +1,34 @@
+from app.services.semantic_cache import SemanticAnswerCache
+
+DOCS = [{"id": "a_0", "updated": 1}, {"id": "b_0", "updated": 1}, {"id": "c_0", "updated": 1}]
+
+def test_paraphrase_with_same_documents_hits():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.set({"vpn": 1.0, "設定": 0.8, "方法": 0.3}, DOCS, ["answer"])
+
+    assert cache.get({"vpn": 1.0, "設定": 0.8, "手順": 0.2}, DOCS) == ["answer"]
+    assert cache.stats()["hits"] == 1
+
+def test_dissimilar_query_misses():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.set({"vpn": 1.0, "設定": 0.8}, DOCS, ["answer"])
+
+    assert cache.get({"メール": 1.0, "設定": 0.3}, DOCS) is None
+
+def test_different_or_updated_documents_miss():
+    cache = SemanticAnswerCache(threshold=0.9, top_docs=2)
+    vector = {"vpn": 1.0, "設定": 0.8}
+    cache.set(vector, DOCS, ["answer"])
+
+    assert cache.get(vector, [DOCS[1], DOCS[0]]) == ["answer"]  # same top documents, other order
+    assert cache.get(vector, [DOCS[0], DOCS[2]]) is None
+    assert cache.get(vector, [{"id": "a_0", "updated": 2}, DOCS[1]]) is None
+
+def test_eviction_cleans_inverted_index():
+    cache = SemanticAnswerCache(maxsize=1)
+    cache.set({"x": 1.0}, DOCS, ["first"])
+    cache.set({"y": 1.0}, DOCS, ["second"])
+
+    assert cache.get({"x": 1.0}, DOCS) is None
+    assert cache.get({"y": 1.0}, DOCS) == ["second"]
+    assert "x" not in cache._postings
@@ -0,0 +1,85 @@
+import asyncio
+import httpx
+import pytest
+from app.core.single_flight import SingleFlight, StreamingSingleFlight
+from app.main import app
+from app.services.llm_service import LLMService
+from app.services.search_service import SearchService
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result_and_error():
+    flights = SingleFlight()
+    calls = []
+
+    async def work(result):
+        calls.append(result)
+        await asyncio.sleep(0.01)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    results = await asyncio.gather(*(flights.do("k", lambda: work("r")) for _ in range(3)))
+    assert results == ["r", "r", "r"] and calls == ["r"]
+    assert not flights.in_flight("k")
+
+    outcomes = await asyncio.gather(
+        *(flights.do("k", lambda: work(ValueError("boom"))) for _ in range(2)), return_exceptions=True
+    )
+    assert all(isinstance(o, ValueError) for o in outcomes) and len(calls) == 2
+
+async def numbers(n, started, delay=0.01):
+    started.append(True)
+    for i in range(n):
+        await asyncio.sleep(delay)
+        yield i
+
+@pytest.mark.asyncio
+async def test_stream_fans_out_to_late_subscribers():
+    flights = StreamingSingleFlight()
+    started = []
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [i async for i in flights.subscribe("k", lambda: numbers(5, started))]
+
+    first, late = await asyncio.gather(collect(0), collect(0.025))
+    assert first == late == [0, 1, 2, 3, 4]
+    assert len(started) == 1
+    assert not flights.in_flight("k")
+
+@pytest.mark.asyncio
+async def test_source_cancelled_when_last_subscriber_leaves():
+    flights = StreamingSingleFlight()
+    stream = flights.subscribe("k", lambda: numbers(100, []))
+    assert await stream.__anext__() == 0
+    await stream.aclose()
+    assert not flights.in_flight("k")
+
+    # A new request right after the cancellation starts a fresh stream
+    restarted = [i async for i in flights.subscribe("k", lambda: numbers(3, []))]
+    assert restarted == [0, 1, 2]
+
+@pytest.mark.asyncio
+async def test_identical_searches_are_coalesced(monkeypatch):
+    calls = []
+
+    async def retrieve(es_service, query, top_k=5, mode=None):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return [{"id": "p_0", "title": "T", "text": "x", "url": "u"}], None
+
+    async def generate_answer(query, contexts, query_vector=None):
+        return "answer"
+
+    monkeypatch.setattr(SearchService, "retrieve", staticmethod(retrieve))
+    monkeypatch.setattr(LLMService, "generate_answer", staticmethod(generate_answer))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            client.post("/api/v1/search", json={"query": "VPN 設定"}),
+            client.post("/api/v1/search", json={"query": "vpn  設定"}),
+            client.post("/api/v1/search", json={"query": "VPN 設定", "top_k": 3}),
+        )
+    assert [r.json()["answer"] for r in responses] == ["answer"] * 3
+    assert len(calls) == 2
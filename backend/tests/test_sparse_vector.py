@@ -0,0 +1,18 @@
+from app.services.sparse_vector import PruningConfig, prune_sparse_vector
+
+VECTOR = {"a": 0.5, "b": 0.3, "c": 0.15, "d": 0.05}
+
+def test_noop_keeps_vector():
+    assert prune_sparse_vector(VECTOR, PruningConfig()) == VECTOR
+
+def test_top_k():
+    assert prune_sparse_vector(VECTOR, PruningConfig(top_k=2)) == {"a": 0.5, "b": 0.3}
+
+def test_weight_mass():
+    # 0.5 + 0.3 = 80% of the total weight
+    assert prune_sparse_vector(VECTOR, PruningConfig(mass=0.8)) == {"a": 0.5, "b": 0.3}
+    assert prune_sparse_vector(VECTOR, PruningConfig(mass=0.81)) == {"a": 0.5, "b": 0.3, "c": 0.15}
+
+def test_min_weight_and_tighter_limit_wins():
+    assert prune_sparse_vector(VECTOR, PruningConfig(min_weight=0.1)) == {"a": 0.5, "b": 0.3, "c": 0.15}
+    assert prune_sparse_vector(VECTOR, PruningConfig(top_k=1, mass=0.9)) == {"a": 0.5}